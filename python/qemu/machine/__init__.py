@@ -7,6 +7,8 @@
  | QEMUQtestProtocol: send/receive qtest messages.
  | QEMUMachine: Configure and Boot a QEMU VM
  | +-- QEMUQtestMachine: VM class, with a qtest socket.
+ | AsyncQEMUMachine: asyncio-native sibling of QEMUMachine
+ | MachinePool: Hand out VMs restored from a snapshot of a booted VM.
 
 """
 
@@ -25,7 +27,9 @@
 # pylint: disable=import-error
 # see: https://github.com/PyCQA/pylint/issues/3624
 # see: https://github.com/PyCQA/pylint/issues/3651
+from .async_machine import AsyncQEMUMachine
 from .machine import QEMUMachine
+from .pool import MachinePool
 from .qtest import QEMUQtestMachine, QEMUQtestProtocol
 
 
@@ -33,4 +37,6 @@
     'QEMUMachine',
     'QEMUQtestProtocol',
     'QEMUQtestMachine',
+    'AsyncQEMUMachine',
+    'MachinePool',
 )
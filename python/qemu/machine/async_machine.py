@@ -0,0 +1,378 @@
+"""
+QEMU async machine module:
+
+The async machine module provides the AsyncQEMUMachine class, an
+asyncio-native sibling of QEMUMachine. It runs QEMU with
+asyncio.create_subprocess_exec() and talks to it with a QMPClient, so
+that a single event loop can drive many VMs at once.
+"""
+
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+from types import TracebackType
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+from qemu.qmp import (
+    ExecInterruptedError,
+    Message,
+    QMPClient,
+    StateError,
+)
+
+from .event_cache import EventCache, EventFilter
+from .machine import (
+    AbnormalShutdown,
+    QEMUMachineError,
+    _QEMUMachineBase,
+)
+
+
+LOG = logging.getLogger(__name__)
+
+
+_T = TypeVar('_T', bound='AsyncQEMUMachine')
+
+
+class AsyncQEMUMachine(_QEMUMachineBase):
+    """
+    A QEMU VM, driven from asyncio.
+
+    Use this object as an async context manager to ensure
+    the QEMU process terminates::
+
+        async with AsyncQEMUMachine(binary) as vm:
+            await vm.launch()
+            await vm.cmd('query-status')
+        # vm is guaranteed to be shut down here
+
+    :param binary: path to the qemu binary
+    :param args: list of extra arguments
+    :param wrapper: list of arguments used as prefix to qemu binary
+    :param name: prefix for log file names, and nickname of the QMP
+                 connection (default: qemu-PID)
+    :param base_temp_dir: default location where temp files are created
+    :param log_dir: where to create and keep log files
+    :param qmp_timer: timeout for establishing the QMP connection
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 binary: str,
+                 args: Sequence[str] = (),
+                 wrapper: Sequence[str] = (),
+                 name: Optional[str] = None,
+                 base_temp_dir: str = "/var/tmp",
+                 log_dir: Optional[str] = None,
+                 qmp_timer: Optional[float] = 30):
+        # pylint: disable=too-many-arguments
+        super().__init__(binary, args, wrapper, name, base_temp_dir,
+                         log_dir, qmp_timer)
+
+        # Runstate
+        self._proc: Optional['asyncio.subprocess.Process'] = None
+        self._qmp_client: Optional[QMPClient] = None
+        self._events: EventCache[Message] = EventCache()
+        self._launched = False
+        self._quit_issued = False
+        self._user_killed = False
+
+    async def __aenter__(self: _T) -> _T:
+        return self
+
+    async def __aexit__(self,
+                        exc_type: Optional[Type[BaseException]],
+                        exc_val: Optional[BaseException],
+                        exc_tb: Optional[TracebackType]) -> None:
+        await self.shutdown()
+
+    @property
+    def qmp(self) -> QMPClient:
+        """
+        The QMPClient connected to the VM, for direct use.
+        """
+        if self._qmp_client is None:
+            raise QEMUMachineError("Attempt to access QMP with no connection")
+        return self._qmp_client
+
+    def is_running(self) -> bool:
+        """Returns true if the VM is running."""
+        return self._proc is not None and self._proc.returncode is None
+
+    def exitcode(self) -> Optional[int]:
+        """Returns the exit code if possible, or None."""
+        if self._proc is None:
+            return None
+        return self._proc.returncode
+
+    def get_pid(self) -> Optional[int]:
+        """Returns the PID of the running process, or None."""
+        if self._proc is None or not self.is_running():
+            return None
+        return self._proc.pid
+
+    def _base_args(self, monitor_fd: int) -> List[str]:
+        args = ['-display', 'none', '-vga', 'none',
+                '-chardev', f"socket,id=mon,fd={monitor_fd}",
+                '-mon', 'chardev=mon,mode=control']
+        if self._machine is not None:
+            args.extend(['-machine', self._machine])
+        return args
+
+    async def launch(self) -> None:
+        """
+        Launch the VM and establish a QMP connection.
+
+        :raise VMLaunchFailure: When QEMU could not be started, or
+                                exited before QMP was up.
+        """
+        if self._launched:
+            raise QEMUMachineError('VM already launched')
+
+        try:
+            await self._launch()
+        except BaseException as exc:
+            await self._stop(hard=True)
+            if isinstance(exc, Exception):
+                raise self._launch_failure() from exc
+            raise
+
+    async def _launch(self) -> None:
+        self._launched = True
+        ours, theirs = socket.socketpair()
+        try:
+            try:
+                await self._spawn(theirs.fileno())
+            finally:
+                theirs.close()
+            self._qmp_client = QMPClient(self._name)
+            await asyncio.wait_for(self._qmp_client.connect(ours),
+                                   self._qmp_timer)
+        except BaseException:
+            self._qmp_client = None
+            ours.close()
+            raise
+
+    async def _spawn(self, monitor_fd: int) -> None:
+        self._qemu_full_args = tuple(
+            [*self._wrapper, self._binary,
+             *self._base_args(monitor_fd), *self._args]
+        )
+        LOG.debug('VM launch command: %r', ' '.join(self._qemu_full_args))
+
+        # pylint: disable=consider-using-with
+        self._qemu_log_path = os.path.join(self.log_dir, self._name + ".log")
+        self._qemu_log_file = open(self._qemu_log_path, 'wb')
+        self._iolog = None
+
+        self._proc = await asyncio.create_subprocess_exec(
+            *self._qemu_full_args,
+            stdin=subprocess.DEVNULL,
+            stdout=self._qemu_log_file,
+            stderr=subprocess.STDOUT,
+            pass_fds=(monitor_fd,),
+        )
+
+    async def cmd(self, cmd: str,
+                  args_dict: Optional[Dict[str, object]] = None,
+                  conv_keys: Optional[bool] = None,
+                  **args: Any) -> object:
+        """
+        Invoke a QMP command.
+        On success return the command's return value.
+        On failure raise an exception (ExecuteError for error responses).
+        """
+        qmp_args = self._qmp_args(args_dict, conv_keys, args)
+        ret = await self.qmp.execute(cmd, qmp_args)
+        if cmd == 'quit':
+            self._quit_issued = True
+        return ret
+
+    def get_qmp_events(self) -> List[Message]:
+        """
+        Return and forget all the QMP events received so far.
+        """
+        events = self._events.drain()
+        events.extend(self.qmp.events.clear())
+        return events
+
+    async def event_wait(self, name: str,
+                         timeout: Optional[float] = 60.0,
+                         match: Optional[Dict[str, Any]] = None) -> Message:
+        """
+        Wait for and return a named QMP event.
+
+        :param name: The event to wait for.
+        :param timeout: Timeout in seconds, or None to wait forever.
+        :param match: Optional match criteria.
+                      See QEMUMachine.event_match for details.
+        """
+        return await self.events_wait([(name, match)], timeout)
+
+    async def events_wait(self,
+                          events: Union[Sequence[Tuple[str, Any]],
+                                        EventFilter],
+                          timeout: Optional[float] = 60.0) -> Message:
+        """
+        Wait for and return a single named QMP event.
+
+        Events that do not match are kept, and will be considered by
+        later waits. In the case of multiple qualifying events, the
+        first one is returned.
+
+        :param events: A sequence of (name, match_criteria) tuples.
+                       The match criteria are optional and may be None.
+                       See QEMUMachine.event_match for details.
+                       An EventFilter built from that sequence can be
+                       passed instead.
+        :param timeout: Timeout in seconds, or None to wait forever.
+
+        :raise asyncio.TimeoutError: If no matching event was found.
+        """
+        event_filter = (events if isinstance(events, EventFilter)
+                        else EventFilter(events))
+
+        # Search events that were not matched by earlier waits
+        cached = self._events.take(event_filter)
+        if cached is not None:
+            return cached
+
+        async def _wait() -> Message:
+            while True:
+                event = await self.qmp.events.get()
+                if event_filter(event):
+                    return event
+                self._events.append(event)
+
+        return await asyncio.wait_for(_wait(), timeout)
+
+    async def shutdown(self,
+                       hard: bool = False,
+                       timeout: Optional[float] = 30) -> None:
+        """
+        Terminate the VM (gracefully if possible) and perform cleanup.
+        Cleanup will always be performed.
+
+        If the VM has not yet been launched, or shutdown(), wait(), or kill()
+        have already been called, this method does nothing.
+
+        :param hard: When true, do not attempt graceful shutdown.
+        :param timeout: Timeout in seconds for graceful shutdown.
+                        A `None` value is an infinite wait.
+
+        :raise AbnormalShutdown: When the VM could not be shut down
+                                 gracefully, and was killed instead.
+        """
+        if not self._launched:
+            return
+        await self._stop(hard, timeout)
+
+    async def kill(self) -> None:
+        """
+        Terminate the VM forcefully, wait for it to exit, and perform cleanup.
+        """
+        await self.shutdown(hard=True)
+
+    async def wait(self, timeout: Optional[float] = 30) -> None:
+        """
+        Wait for the VM to power off and perform post-shutdown cleanup.
+
+        :param timeout: Timeout in seconds. A value of `None` is an
+                        infinite wait.
+        """
+        self._quit_issued = True
+        await self.shutdown(timeout=timeout)
+
+    async def _soft_shutdown(self, timeout: Optional[float]) -> None:
+        assert self._proc is not None
+        if self._qmp_client is not None:
+            try:
+                if not self._quit_issued and self.is_running():
+                    await self.cmd('quit')
+            except (ExecInterruptedError, StateError, EOFError):
+                # The connection died, or has *already* died.
+                pass
+            finally:
+                await self._close_qmp()
+        elif not self._quit_issued:
+            self._proc.terminate()
+        await asyncio.wait_for(self._proc.wait(), timeout)
+
+    async def _close_qmp(self) -> None:
+        if self._qmp_client is None:
+            return
+        try:
+            await self._qmp_client.disconnect()
+        except EOFError:
+            # The server closed the stream, which is expected after
+            # 'quit', or when we killed QEMU.
+            if not (self._user_killed or self._quit_issued):
+                raise
+        finally:
+            self._qmp_client = None
+
+    async def _stop(self, hard: bool,
+                    timeout: Optional[float] = None) -> None:
+        """
+        Stop QEMU if it was started, and clean up after it.
+        """
+        try:
+            if self._proc is not None and self._proc.returncode is None:
+                if not hard:
+                    try:
+                        await self._soft_shutdown(timeout)
+                    except Exception as exc:
+                        LOG.debug("Graceful shutdown failed", exc_info=True)
+                        await self._hard_shutdown()
+                        raise AbnormalShutdown(
+                            "Could not perform graceful shutdown"
+                        ) from exc
+                else:
+                    self._user_killed = True
+                    await self._hard_shutdown()
+        finally:
+            await self._post_shutdown()
+
+    async def _hard_shutdown(self) -> None:
+        assert self._proc is not None
+        if self._proc.returncode is None:
+            self._proc.kill()
+        await self._proc.wait()
+
+    async def _post_shutdown(self) -> None:
+        try:
+            await self._close_qmp()
+        except Exception as err:  # pylint: disable=broad-except
+            LOG.warning(
+                "Exception closing QMP connection: %s",
+                str(err) if str(err) else type(err).__name__
+            )
+
+        if self._qemu_log_file is not None:
+            self._qemu_log_file.close()
+            self._qemu_log_file = None
+
+        self._load_io_log()
+        self._qemu_log_path = None
+
+        self._remove_temp_dir()
+
+        self._events.clear()
+        self._quit_issued = False
+        self._user_killed = False
+        self._launched = False
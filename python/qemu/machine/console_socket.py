@@ -13,11 +13,17 @@
 # the COPYING file in the top-level directory.
 #
 
-from collections import deque
+import re
+import selectors
 import socket
 import threading
 import time
-from typing import Deque, Optional
+from typing import (
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
 
 
 class ConsoleSocket(socket.socket):
@@ -31,6 +37,11 @@ class ConsoleSocket(socket.socket):
     :param drain: Optionally, drains the socket and places the bytes
                   into an in memory buffer for later processing.
     """
+    # Size of the reads from the socket.
+    _chunk_size = 64 * 1024
+    # Default bound on the length of readuntil() regex matches.
+    _max_match_len = 64 * 1024
+
     def __init__(self,
                  address: Optional[str] = None,
                  sock_fd: Optional[int] = None,
@@ -42,8 +53,13 @@ def __init__(self,
             raise ValueError("can't specify both 'address' and 'sock_fd'")
 
         self._recv_timeout_sec = 300.0
-        self._sleep_time = 0.5
-        self._buffer: Deque[int] = deque()
+        # Bytes received but not consumed yet are _buffer[_head:].
+        # Consumed bytes are only dropped once they make up half of
+        # the buffer, so that consuming does not move the rest around.
+        self._buffer = bytearray()
+        self._head = 0
+        self._eof = False
+        self._cond = threading.Condition()
         if address is not None:
             socket.socket.__init__(self, socket.AF_UNIX, socket.SOCK_STREAM)
             self.connect(address)
@@ -55,6 +71,7 @@ def __init__(self,
             # pylint: disable=consider-using-with
             self._logfile = open(file, "bw")
         self._open = True
+        self._wakeup: Optional[Tuple[socket.socket, socket.socket]] = None
         self._drain_thread = None
         if drain:
             self._drain_thread = self._thread_start()
@@ -68,22 +85,29 @@ def __repr__(self) -> str:
 
     def _drain_fn(self) -> None:
         """Drains the socket and runs while the socket is open."""
-        while self._open:
-            try:
-                self._drain_socket()
-            except socket.timeout:
-                # The socket is expected to timeout since we set a
-                # short timeout to allow the thread to exit when
-                # self._open is set to False.
-                time.sleep(self._sleep_time)
+        assert self._wakeup is not None
+        with selectors.DefaultSelector() as sel:
+            sel.register(self, selectors.EVENT_READ)
+            sel.register(self._wakeup[1], selectors.EVENT_READ)
+            while self._open and not self._eof:
+                # The log is written in chunks and only flushed when
+                # there is nothing more to read for now.
+                timeout = 0.0 if self._logfile else None
+                if not sel.select(timeout):
+                    if self._logfile:
+                        self._logfile.flush()
+                    sel.select()
+                if self._open:
+                    self._drain_socket()
+        if self._logfile:
+            self._logfile.flush()
 
     def _thread_start(self) -> threading.Thread:
         """Kick off a thread to drain the socket."""
-        # Configure socket to not block and timeout.
-        # This allows our drain thread to not block
-        # on receive and exit smoothly.
+        # The drain thread waits for data with a selector, and is woken
+        # up through a socket pair when we are closed.
         socket.socket.setblocking(self, False)
-        socket.socket.settimeout(self, 1)
+        self._wakeup = socket.socketpair()
         drain_thread = threading.Thread(target=self._drain_fn)
         drain_thread.daemon = True
         drain_thread.start()
@@ -94,36 +118,156 @@ def close(self) -> None:
         if self._open:
             self._open = False
             if self._drain_thread is not None:
+                assert self._wakeup is not None
+                self._wakeup[0].send(b'\0')
                 thread, self._drain_thread = self._drain_thread, None
                 thread.join()
+                for sock in self._wakeup:
+                    sock.close()
+                self._wakeup = None
             socket.socket.close(self)
             if self._logfile:
                 self._logfile.close()
                 self._logfile = None
+            with self._cond:
+                self._cond.notify_all()
 
     def _drain_socket(self) -> None:
         """process arriving characters into in memory _buffer"""
-        data = socket.socket.recv(self, 1)
+        try:
+            data = socket.socket.recv(self, self._chunk_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if self._logfile:
+            self._logfile.write(data)
+        self._append(data)
+
+    def _append(self, data: bytes) -> None:
+        with self._cond:
+            if data:
+                self._buffer += data
+            else:
+                self._eof = True
+            self._cond.notify_all()
+
+    def _consume(self, size: int) -> bytes:
+        """Remove and return up to size bytes from the buffer."""
+        end = min(self._head + size, len(self._buffer))
+        data = bytes(self._buffer[self._head:end])
+        self._head = end
+        if self._head == len(self._buffer):
+            self._buffer.clear()
+            self._head = 0
+        elif self._head > len(self._buffer) // 2:
+            del self._buffer[:self._head]
+            self._head = 0
+        return data
+
+    def _wait(self, deadline: float) -> None:
+        """
+        Wait for more data, or EOF, with self._cond held.
+
+        When not draining, read from the socket directly instead.
+        """
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise socket.timeout
+        if self._drain_thread is not None:
+            self._cond.wait(timeout)
+            return
+        old_timeout = socket.socket.gettimeout(self)
+        socket.socket.settimeout(self, timeout)
+        try:
+            data = socket.socket.recv(self, self._chunk_size)
+        finally:
+            socket.socket.settimeout(self, old_timeout)
         if self._logfile:
             self._logfile.write(data)
             self._logfile.flush()
-        self._buffer.extend(data)
+        self._append(data)
 
     def recv(self, bufsize: int = 1, flags: int = 0) -> bytes:
         """Return chars from in memory buffer.
            Maintains the same API as socket.socket.recv.
         """
+        peek = flags == socket.MSG_PEEK
         if self._drain_thread is None:
+            if self._head < len(self._buffer):
+                # Left over from readuntil()
+                if peek:
+                    return bytes(self._buffer[self._head:
+                                              self._head + bufsize])
+                return self._consume(bufsize)
             # Not buffering the socket, pass thru to socket.
             return socket.socket.recv(self, bufsize, flags)
-        assert not flags, "Cannot pass flags to recv() in drained mode"
-        start_time = time.time()
-        while len(self._buffer) < bufsize:
-            time.sleep(self._sleep_time)
-            elapsed_sec = time.time() - start_time
-            if elapsed_sec > self._recv_timeout_sec:
-                raise socket.timeout
-        return bytes((self._buffer.popleft() for i in range(bufsize)))
+        assert peek or not flags, \
+            "Only MSG_PEEK can be passed to recv() in drained mode"
+        # Like the socket, MSG_PEEK returns as soon as there is data
+        needed = 1 if peek else bufsize
+        deadline = time.monotonic() + self._recv_timeout_sec
+        with self._cond:
+            while (len(self._buffer) - self._head < needed
+                   and not self._eof and self._open):
+                self._wait(deadline)
+            if peek:
+                return bytes(self._buffer[self._head:self._head + bufsize])
+            return self._consume(bufsize)
+
+    def readuntil(self, pattern: Union[bytes, Pattern[bytes]],
+                  timeout: Optional[float] = None,
+                  max_len: Optional[int] = None) -> bytes:
+        """
+        Return everything up to and including the first match of pattern.
+
+        Waiting threads are woken up as soon as new data arrives.  Only
+        the new data, and the end of the data already searched that a
+        match could start in, is searched again.
+
+        :param pattern: A byte string, or a compiled bytes regex.
+        :param timeout: Timeout in seconds, defaults to the recv()
+                        timeout set with settimeout().
+        :param max_len: The length of the longest match of a regex
+                        pattern, 64 KiB by default.  Longer matches
+                        may be missed.
+
+        :raise socket.timeout: If pattern is not seen within timeout.
+                               The data read so far is left unconsumed.
+        :raise EOFError: If the console is closed before pattern is seen.
+        """
+        if timeout is None:
+            timeout = self._recv_timeout_sec
+        deadline = time.monotonic() + timeout
+        regex: Optional[Pattern[bytes]] = None
+        if isinstance(pattern, re.Pattern):
+            regex = pattern
+            if max_len is None:
+                max_len = self._max_match_len
+        else:
+            max_len = len(pattern)
+        # Offset (relative to _head) where the next search starts: no
+        # match was found in the data already searched, so a match has
+        # to end in new data and cannot start earlier than max_len - 1
+        # bytes before the end of the old data.
+        skip = 0
+        with self._cond:
+            while True:
+                start = self._head + skip
+                if regex is not None:
+                    match = regex.search(self._buffer, start)
+                    if match:
+                        return self._consume(match.end() - self._head)
+                else:
+                    assert isinstance(pattern, bytes)
+                    pos = self._buffer.find(pattern, start)
+                    if pos >= 0:
+                        return self._consume(pos - self._head + len(pattern))
+                skip = max(0, len(self._buffer) - self._head - max_len + 1)
+                if self._eof or not self._open:
+                    raise EOFError("console closed while waiting for %r"
+                                   % pattern)
+                self._wait(deadline)
 
     def setblocking(self, value: bool) -> None:
         """When not draining we pass thru to the socket,
@@ -0,0 +1,251 @@
+"""
+QEMU machine event cache module:
+
+The event cache module provides EventFilter, which precompiles the
+(name, match) criteria taken by QEMUMachine.events_wait(), and
+EventCache, which holds the QMP events that were received but not
+consumed yet, indexed by event name.
+"""
+
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+from collections import deque
+import logging
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+
+LOG = logging.getLogger(__name__)
+
+#: A precompiled match criteria; returns whether an object matches it.
+Matcher = Callable[[Any], bool]
+
+_EventT = TypeVar('_EventT', bound=Mapping[str, Any])
+
+
+def event_match(event: Any, match: Optional[Any]) -> bool:
+    """
+    Check if an event matches optional match criteria.
+
+    See QEMUMachine.event_match for details.
+    """
+    if match is None:
+        return True
+
+    try:
+        for key in match:
+            if key in event:
+                if not event_match(event[key], match[key]):
+                    return False
+            else:
+                return False
+        return True
+    except TypeError:
+        # either match or event wasn't iterable (not a dict)
+        return bool(match == event)
+
+
+def _match_any(_obj: Any) -> bool:
+    return True
+
+
+def compile_match(match: Any) -> Matcher:
+    """
+    Turn match criteria into a function checking them.
+
+    The function returned behaves exactly like
+    ``event_match(obj, match)``, but the match subdict is
+    only walked once, here, instead of on every call.
+    """
+    if match is None:
+        return _match_any
+
+    if isinstance(match, dict):
+        items: List[Tuple[Any, Matcher]] = [
+            (key, compile_match(value)) for key, value in match.items()
+        ]
+
+        def _match_dict(obj: Any) -> bool:
+            try:
+                for key, sub_match in items:
+                    if key not in obj or not sub_match(obj[key]):
+                        return False
+                return True
+            except TypeError:
+                # obj wasn't a dict
+                return bool(match == obj)
+        return _match_dict
+
+    if isinstance(match, (str, bytes, list, tuple)):
+        # Iterable criteria other than dicts have peculiar semantics;
+        # leave them to the reference implementation.
+        def _match_iterable(obj: Any) -> bool:
+            return event_match(obj, match)
+        return _match_iterable
+
+    def _match_value(obj: Any) -> bool:
+        return bool(match == obj)
+    return _match_value
+
+
+class EventFilter:
+    """
+    Precompiled criteria for QEMUMachine.events_wait().
+
+    Building the filter once and passing it to every call avoids
+    compiling the criteria again, e.g. when waiting for the events of a
+    job in a loop.
+
+    :param events: A sequence of (name, match_criteria) tuples.
+                   The match criteria are optional and may be None.
+                   See QEMUMachine.event_match for details.
+    """
+    def __init__(self, events: Iterable[Tuple[str, Any]]):
+        self._matchers: Dict[str, List[Matcher]] = {}
+        for name, match in events:
+            self._matchers.setdefault(name, []).append(compile_match(match))
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        """The names of the events accepted by the filter."""
+        return tuple(self._matchers)
+
+    def match_named(self, name: str, event: Any) -> bool:
+        """Check an event which is known to be called ``name``."""
+        return any(matcher(event) for matcher in self._matchers[name])
+
+    def __call__(self, event: Mapping[str, Any]) -> bool:
+        """Check whether an event matches any of the criteria."""
+        name = event.get('event')
+        if not isinstance(name, str):
+            return False
+        matchers = self._matchers.get(name, ())
+        return any(matcher(event) for matcher in matchers)
+
+
+class _Entry(Generic[_EventT]):
+    """A cached event, and its place in the arrival order."""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('seq', 'event')
+
+    def __init__(self, seq: int, event: _EventT):
+        self.seq = seq
+        # None once the event has been taken out of the cache
+        self.event: Optional[_EventT] = event
+
+
+class EventCache(Generic[_EventT]):
+    """
+    QMP events received but not consumed yet.
+
+    Events are kept in a deque per event name, so that looking for an
+    event only goes through the cached events with the same name.
+    The order in which events arrived is kept across names.
+
+    :param maxlen: Optionally, how many events to keep for each name.
+                   When more arrive, the oldest ones are dropped.
+    """
+    def __init__(self, maxlen: Optional[int] = None):
+        if maxlen is not None and maxlen < 1:
+            raise ValueError("maxlen must be at least 1")
+        self._maxlen = maxlen
+        self._by_name: Dict[str, Deque[_Entry[_EventT]]] = {}
+        # Every entry in arrival order; entries whose event was taken
+        # are only dropped from here lazily.
+        self._order: Deque[_Entry[_EventT]] = deque()
+        self._len = 0
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _remove(self, name: str, entry: _Entry[_EventT],
+                index: int = 0) -> _EventT:
+        entries = self._by_name[name]
+        if index == 0:
+            entries.popleft()
+        else:
+            del entries[index]
+        if not entries:
+            del self._by_name[name]
+
+        event = entry.event
+        assert event is not None
+        entry.event = None
+        self._len -= 1
+        while self._order and self._order[0].event is None:
+            self._order.popleft()
+        if len(self._order) > 2 * self._len + 64:
+            self._order = deque(e for e in self._order if e.event is not None)
+        return event
+
+    def append(self, event: _EventT) -> None:
+        """Add an event to the cache."""
+        name = event['event']
+        entries = self._by_name.get(name)
+        if entries is not None and self._maxlen is not None:
+            while len(entries) >= self._maxlen:
+                LOG.debug("Dropping cached %s event", name)
+                self._remove(name, entries[0])
+        entries = self._by_name.setdefault(name, deque())
+
+        entry = _Entry(self._seq, event)
+        self._seq += 1
+        entries.append(entry)
+        self._order.append(entry)
+        self._len += 1
+
+    def popleft(self) -> Optional[_EventT]:
+        """Remove and return the oldest event, or None if there is none."""
+        if not self._len:
+            return None
+        # _remove() never leaves a taken entry at the left of _order
+        entry = self._order[0]
+        assert entry.event is not None
+        return self._remove(entry.event['event'], entry)
+
+    def take(self, events: EventFilter) -> Optional[_EventT]:
+        """
+        Remove and return the oldest event matching a filter.
+
+        :return: The event, or None if no cached event matches.
+        """
+        best_entry: Optional[_Entry[_EventT]] = None
+        best_name = ''
+        best_index = 0
+        for name in events.names:
+            for index, entry in enumerate(self._by_name.get(name, ())):
+                if best_entry is not None and entry.seq > best_entry.seq:
+                    break
+                if events.match_named(name, entry.event):
+                    best_entry, best_name, best_index = entry, name, index
+                    break
+        if best_entry is None:
+            return None
+        return self._remove(best_name, best_entry, best_index)
+
+    def drain(self) -> List[_EventT]:
+        """Remove and return all the events, oldest first."""
+        events = [e.event for e in self._order if e.event is not None]
+        self.clear()
+        return events
+
+    def clear(self) -> None:
+        """Forget all the events."""
+        for entry in self._order:
+            entry.event = None
+        self._by_name.clear()
+        self._order.clear()
+        self._len = 0
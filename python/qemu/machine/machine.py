@@ -38,6 +38,7 @@
     Tuple,
     Type,
     TypeVar,
+    Union,
 )
 
 from qemu.qmp import SocketAddrT
@@ -48,6 +49,7 @@
 )
 
 from . import console_socket
+from .event_cache import EventCache, EventFilter, event_match
 
 
 LOG = logging.getLogger(__name__)
@@ -104,10 +106,142 @@ class AbnormalShutdown(QEMUMachineError):
     """
 
 
+class _QEMUMachineBase:
+    """
+    The configuration and the files shared by QEMUMachine and
+    AsyncQEMUMachine, whichever way they run QEMU and talk to it.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 binary: str,
+                 args: Sequence[str],
+                 wrapper: Sequence[str],
+                 name: Optional[str],
+                 base_temp_dir: str,
+                 log_dir: Optional[str],
+                 qmp_timer: Optional[float]):
+        # pylint: disable=too-many-arguments
+        self._binary = binary
+        self._args = list(args)
+        self._wrapper = wrapper
+        self._qmp_timer = qmp_timer
+        self._name = name or f"{id(self):x}"
+        self._temp_dir: Optional[str] = None
+        self._base_temp_dir = base_temp_dir
+        self._log_dir = log_dir
+        self._machine: Optional[str] = None
+
+        # Runstate
+        self._qemu_log_path: Optional[str] = None
+        self._qemu_log_file: Optional[BinaryIO] = None
+        self._iolog: Optional[str] = None
+        self._qemu_full_args: Tuple[str, ...] = ()
+
+    @property
+    def args(self) -> List[str]:
+        """Returns the list of arguments given to the QEMU binary."""
+        return self._args
+
+    @property
+    def binary(self) -> str:
+        """Returns path to the QEMU binary"""
+        return self._binary
+
+    def add_args(self, *args: str) -> None:
+        """
+        Adds to the list of extra arguments to be given to the QEMU binary
+        """
+        self._args.extend(args)
+
+    def set_machine(self, machine_type: str) -> None:
+        """
+        Sets the machine type
+
+        If set, the machine type will be added to the base arguments
+        of the resulting QEMU command line.
+        """
+        self._machine = machine_type
+
+    @property
+    def temp_dir(self) -> str:
+        """
+        Returns a temporary directory to be used for this machine
+        """
+        if self._temp_dir is None:
+            self._temp_dir = tempfile.mkdtemp(prefix="qemu-machine-",
+                                              dir=self._base_temp_dir)
+        return self._temp_dir
+
+    @property
+    def log_dir(self) -> str:
+        """
+        Returns a directory to be used for writing logs
+        """
+        if self._log_dir is None:
+            return self.temp_dir
+        return self._log_dir
+
+    def _remove_temp_dir(self) -> None:
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir)
+            self._temp_dir = None
+
+    def exitcode(self) -> Optional[int]:
+        """Returns the exit code if possible, or None."""
+        raise NotImplementedError
+
+    def get_log(self) -> Optional[str]:
+        """
+        After self.shutdown or failed qemu execution, this returns the output
+        of the qemu process.
+        """
+        return self._iolog
+
+    def _load_io_log(self) -> None:
+        # Assume that the output encoding of QEMU's terminal output is
+        # defined by our locale. If indeterminate, allow open() to fall
+        # back to the platform default.
+        _, encoding = locale.getlocale()
+        if self._qemu_log_path is not None:
+            with open(self._qemu_log_path, "r", encoding=encoding) as iolog:
+                self._iolog = iolog.read()
+
+    def _launch_failure(self) -> VMLaunchFailure:
+        """
+        The exception to raise, once cleaned up, when the VM failed to
+        launch.
+        """
+        return VMLaunchFailure(
+            exitcode=self.exitcode(),
+            command=' '.join(self._qemu_full_args),
+            output=self._iolog
+        )
+
+    @staticmethod
+    def _qmp_args(args_dict: Optional[Dict[str, object]],
+                  conv_keys: Optional[bool],
+                  args: Dict[str, Any]) -> Dict[str, object]:
+        """
+        The arguments of a QMP command, given either as @args_dict or as
+        keyword @args. Underscores in keyword arguments are converted to
+        dashes, unless @conv_keys is false.
+        """
+        if args_dict is not None:
+            assert not args
+            assert conv_keys is None
+            return args_dict
+
+        if conv_keys is None or conv_keys:
+            return {k.replace('_', '-'): v for k, v in args.items()}
+
+        return args
+
+
 _T = TypeVar('_T', bound='QEMUMachine')
 
 
-class QEMUMachine:
+class QEMUMachine(_QEMUMachineBase):
     """
     A QEMU VM.
 
@@ -130,7 +264,8 @@ def __init__(self,
                  drain_console: bool = False,
                  console_log: Optional[str] = None,
                  log_dir: Optional[str] = None,
-                 qmp_timer: Optional[float] = 30):
+                 qmp_timer: Optional[float] = 30,
+                 max_cached_events: Optional[int] = None):
         '''
         Initialize a QEMUMachine
 
@@ -144,24 +279,19 @@ def __init__(self,
         @param console_log: (optional) path to console log file
         @param log_dir: where to create and keep log files
         @param qmp_timer: (optional) default QMP socket timeout
+        @param max_cached_events: (optional) how many unconsumed events to
+                                  keep per event name (default: all)
         @note: Qemu process is not started until launch() is used.
         '''
         # pylint: disable=too-many-arguments
 
         # Direct user configuration
 
-        self._binary = binary
-        self._args = list(args)
-        self._wrapper = wrapper
-        self._qmp_timer = qmp_timer
-
-        self._name = name or f"{id(self):x}"
+        super().__init__(binary, args, wrapper, name, base_temp_dir,
+                         log_dir, qmp_timer)
         self._sock_pair: Optional[Tuple[socket.socket, socket.socket]] = None
         self._cons_sock_pair: Optional[
             Tuple[socket.socket, socket.socket]] = None
-        self._temp_dir: Optional[str] = None
-        self._base_temp_dir = base_temp_dir
-        self._log_dir = log_dir
 
         self._monitor_address = monitor_address
 
@@ -173,16 +303,11 @@ def __init__(self,
             self._drain_console = drain_console
 
         # Runstate
-        self._qemu_log_path: Optional[str] = None
-        self._qemu_log_file: Optional[BinaryIO] = None
         self._popen: Optional['subprocess.Popen[bytes]'] = None
-        self._events: List[QMPMessage] = []
-        self._iolog: Optional[str] = None
+        self._events: EventCache[QMPMessage] = EventCache(max_cached_events)
         self._qmp_set = True   # Enable QMP monitor by default.
         self._qmp_connection: Optional[QEMUMonitorProtocol] = None
-        self._qemu_full_args: Tuple[str, ...] = ()
         self._launched = False
-        self._machine: Optional[str] = None
         self._console_index = 0
         self._console_set = False
         self._console_device_type: Optional[str] = None
@@ -282,15 +407,6 @@ def get_pid(self) -> Optional[int]:
             return None
         return self._subp.pid
 
-    def _load_io_log(self) -> None:
-        # Assume that the output encoding of QEMU's terminal output is
-        # defined by our locale. If indeterminate, allow open() to fall
-        # back to the platform default.
-        _, encoding = locale.getlocale()
-        if self._qemu_log_path is not None:
-            with open(self._qemu_log_path, "r", encoding=encoding) as iolog:
-                self._iolog = iolog.read()
-
     @property
     def _base_args(self) -> List[str]:
         args = ['-display', 'none', '-vga', 'none']
@@ -323,16 +439,6 @@ def _base_args(self) -> List[str]:
                 args.extend(['-device', device])
         return args
 
-    @property
-    def args(self) -> List[str]:
-        """Returns the list of arguments given to the QEMU binary."""
-        return self._args
-
-    @property
-    def binary(self) -> str:
-        """Returns path to the QEMU binary"""
-        return self._binary
-
     def _pre_launch(self) -> None:
         if self._qmp_set:
             sock = None
@@ -414,9 +520,7 @@ def _post_shutdown(self) -> None:
 
         self._qemu_log_path = None
 
-        if self._temp_dir is not None:
-            shutil.rmtree(self._temp_dir)
-            self._temp_dir = None
+        self._remove_temp_dir()
 
         while len(self._remove_files) > 0:
             self._remove_if_exists(self._remove_files.pop())
@@ -458,11 +562,7 @@ def launch(self) -> None:
                 self._post_shutdown()
 
             if isinstance(exc, Exception):
-                raise VMLaunchFailure(
-                    exitcode=self.exitcode(),
-                    command=' '.join(self._qemu_full_args),
-                    output=self._iolog
-                ) from exc
+                raise self._launch_failure() from exc
 
             # Don't wrap 'BaseException'; doing so would downgrade
             # that exception. However, we still want to clean up.
@@ -683,14 +783,6 @@ def _qmp(self) -> QEMUMonitorProtocol:
             raise QEMUMachineError("Attempt to access QMP with no connection")
         return self._qmp_connection
 
-    @classmethod
-    def _qmp_args(cls, conv_keys: bool,
-                  args: Dict[str, Any]) -> Dict[str, object]:
-        if conv_keys:
-            return {k.replace('_', '-'): v for k, v in args.items()}
-
-        return args
-
     def qmp(self, cmd: str,
             args_dict: Optional[Dict[str, object]] = None,
             conv_keys: Optional[bool] = None,
@@ -698,16 +790,7 @@ def qmp(self, cmd: str,
         """
         Invoke a QMP command and return the response dict
         """
-        if args_dict is not None:
-            assert not args
-            assert conv_keys is None
-            args = args_dict
-            conv_keys = False
-
-        if conv_keys is None:
-            conv_keys = True
-
-        qmp_args = self._qmp_args(conv_keys, args)
+        qmp_args = self._qmp_args(args_dict, conv_keys, args)
         ret = self._qmp.cmd_raw(cmd, args=qmp_args)
         if cmd == 'quit' and 'error' not in ret and 'return' in ret:
             self._quit_issued = True
@@ -722,16 +805,7 @@ def cmd(self, cmd: str,
         On success return the response dict.
         On failure raise an exception.
         """
-        if args_dict is not None:
-            assert not args
-            assert conv_keys is None
-            args = args_dict
-            conv_keys = False
-
-        if conv_keys is None:
-            conv_keys = True
-
-        qmp_args = self._qmp_args(conv_keys, args)
+        qmp_args = self._qmp_args(args_dict, conv_keys, args)
         ret = self._qmp.cmd(cmd, **qmp_args)
         if cmd == 'quit':
             self._quit_issued = True
@@ -741,8 +815,9 @@ def get_qmp_event(self, wait: bool = False) -> Optional[QMPMessage]:
         """
         Poll for one queued QMP events and return it
         """
-        if self._events:
-            return self._events.pop(0)
+        event = self._events.popleft()
+        if event is not None:
+            return event
         return self._qmp.pull_event(wait=wait)
 
     def get_qmp_events(self, wait: bool = False) -> List[QMPMessage]:
@@ -750,8 +825,7 @@ def get_qmp_events(self, wait: bool = False) -> List[QMPMessage]:
         Poll for queued QMP events and return a list of dicts
         """
         events = self._qmp.get_events(wait=wait)
-        events.extend(self._events)
-        del self._events[:]
+        events.extend(self._events.drain())
         return events
 
     @staticmethod
@@ -771,21 +845,11 @@ def event_match(event: Any, match: Optional[Any]) -> bool:
          - {"foo": None} matches {"foo": 5}
          - {"foo": {"abc": None}} does not match {"foo": {"bar": 1}}
          - {"foo": {"rab": 2}} matches {"foo": {"bar": 1, "rab": 2}}
-        """
-        if match is None:
-            return True
 
-        try:
-            for key in match:
-                if key in event:
-                    if not QEMUMachine.event_match(event[key], match[key]):
-                        return False
-                else:
-                    return False
-            return True
-        except TypeError:
-            # either match or event wasn't iterable (not a dict)
-            return bool(match == event)
+        To check many events against the same criteria, EventFilter
+        precompiles them.
+        """
+        return event_match(event, match)
 
     def event_wait(self, name: str,
                    timeout: float = 60.0,
@@ -800,7 +864,7 @@ def event_wait(self, name: str,
         return self.events_wait([(name, match)], timeout)
 
     def events_wait(self,
-                    events: Sequence[Tuple[str, Any]],
+                    events: Union[Sequence[Tuple[str, Any]], EventFilter],
                     timeout: float = 60.0) -> Optional[QMPMessage]:
         """
         events_wait waits for and returns a single named event from QMP.
@@ -809,7 +873,9 @@ def events_wait(self,
 
         :param events: A sequence of (name, match_criteria) tuples.
                        The match criteria are optional and may be None.
-                       See event_match for details.
+                       See event_match for details. Callers waiting
+                       repeatedly for the same events can pass an
+                       EventFilter built from that sequence instead.
         :param timeout: Optional timeout, in seconds.
                         See QEMUMonitorProtocol.pull_event.
 
@@ -819,19 +885,13 @@ def events_wait(self,
         :return: A QMP event matching the filter criteria.
                  If timeout was 0 and no event matched, None.
         """
-        def _match(event: QMPMessage) -> bool:
-            for name, match in events:
-                if event['event'] == name and self.event_match(event, match):
-                    return True
-            return False
-
-        event: Optional[QMPMessage]
+        if not isinstance(events, EventFilter):
+            events = EventFilter(events)
 
         # Search cached events
-        for event in self._events:
-            if _match(event):
-                self._events.remove(event)
-                return event
+        event = self._events.take(events)
+        if event is not None:
+            return event
 
         # Poll for new events
         while True:
@@ -840,34 +900,12 @@ def _match(event: QMPMessage) -> bool:
                 # NB: None is only returned when timeout is false-ish.
                 # Timeouts raise asyncio.TimeoutError instead!
                 break
-            if _match(event):
+            if events(event):
                 return event
             self._events.append(event)
 
         return None
 
-    def get_log(self) -> Optional[str]:
-        """
-        After self.shutdown or failed qemu execution, this returns the output
-        of the qemu process.
-        """
-        return self._iolog
-
-    def add_args(self, *args: str) -> None:
-        """
-        Adds to the list of extra arguments to be given to the QEMU binary
-        """
-        self._args.extend(args)
-
-    def set_machine(self, machine_type: str) -> None:
-        """
-        Sets the machine type
-
-        If set, the machine type will be added to the base arguments
-        of the resulting QEMU command line.
-        """
-        self._machine = machine_type
-
     def set_console(self,
                     device_type: Optional[str] = None,
                     console_index: int = 0) -> None:
@@ -933,22 +971,3 @@ def console_file(self) -> socket.SocketIO:
                                                               buffering=0,
                                                               encoding='utf-8')
         return self._console_file
-
-    @property
-    def temp_dir(self) -> str:
-        """
-        Returns a temporary directory to be used for this machine
-        """
-        if self._temp_dir is None:
-            self._temp_dir = tempfile.mkdtemp(prefix="qemu-machine-",
-                                              dir=self._base_temp_dir)
-        return self._temp_dir
-
-    @property
-    def log_dir(self) -> str:
-        """
-        Returns a directory to be used for writing logs
-        """
-        if self._log_dir is None:
-            return self.temp_dir
-        return self._log_dir
@@ -0,0 +1,222 @@
+"""
+QEMU machine pool module:
+
+The pool module provides the MachinePool class, which hands out
+QEMUMachine instances that are restored from a snapshot of a VM that
+has already booted, instead of booting each of them from scratch.
+"""
+
+# This work is licensed under the terms of the GNU GPL, version 2.  See
+# the COPYING file in the top-level directory.
+
+import asyncio
+from contextlib import contextmanager
+import json
+import logging
+import os
+import shutil
+import tempfile
+from types import TracebackType
+from typing import (
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Type,
+)
+
+from .machine import QEMUMachine, QEMUMachineError
+
+
+LOG = logging.getLogger(__name__)
+
+
+class MachinePool:
+    """
+    A pool of warm QEMU VMs sharing the same configuration.
+
+    On first use, a template VM is launched and prepared by the ``boot``
+    callback (e.g. by waiting for a login prompt on its console). It is
+    then stopped and migrated to a file, which becomes the snapshot all
+    the pooled VMs are restored from with ``-incoming``.
+
+    Up to ``size`` VMs are kept launched and restored, so that acquire()
+    does not have to wait for QEMU to start. Use the pool as a context
+    manager to ensure all its QEMU processes terminate::
+
+        with MachinePool(make_vm, size=2, boot=wait_for_prompt) as pool:
+            with pool.machine() as vm:
+                ...
+
+    All the VMs use the same disk images, so they are launched with
+    ``-snapshot`` and their writes to ``-drive`` disks are discarded. This
+    includes the writes of the template VM, which the guest in the
+    snapshot may expect to find on disk: the ``boot`` callback should
+    avoid them. Disks configured with ``-blockdev`` must be read-only.
+
+    :param factory: Returns a new, unlaunched QEMUMachine. All the VMs it
+                    returns must have the same configuration, as they
+                    are all restored from the same snapshot.
+    :param size: Number of restored VMs to keep ready.
+    :param boot: Optional callable preparing the launched template VM
+                 before the snapshot is taken.
+    :param base_temp_dir: Where to create the directory for the snapshot.
+    :param timeout: Timeout in seconds for saving or restoring the
+                    snapshot.
+    """
+    def __init__(self,
+                 factory: Callable[[], QEMUMachine],
+                 size: int = 1,
+                 boot: Optional[Callable[[QEMUMachine], None]] = None,
+                 base_temp_dir: str = "/var/tmp",
+                 timeout: float = 60.0):
+        self._factory = factory
+        self._size = size
+        self._boot = boot
+        self._base_temp_dir = base_temp_dir
+        self._timeout = timeout
+        self._temp_dir: Optional[str] = None
+        self._snapshot: Optional[str] = None
+        self._ready: List[QEMUMachine] = []
+
+    def __enter__(self) -> 'MachinePool':
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_val: Optional[BaseException],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
+
+    @property
+    def snapshot(self) -> str:
+        """Returns the path of the snapshot, taking it if necessary."""
+        if self._snapshot is None:
+            self._take_snapshot()
+        assert self._snapshot is not None
+        return self._snapshot
+
+    def _new_vm(self) -> QEMUMachine:
+        """Create a VM with the factory, and keep it off its disk images."""
+        vm = self._factory()
+        args = vm.args
+        for opt, value in zip(args, args[1:]):
+            if opt == '-blockdev' and not self._is_read_only(value):
+                raise QEMUMachineError(
+                    "Pooled VMs share their disks, '-blockdev %s' must be "
+                    "read-only" % value)
+        vm.add_args('-snapshot')
+        return vm
+
+    @staticmethod
+    def _is_read_only(blockdev: str) -> bool:
+        if blockdev.startswith('{'):
+            return json.loads(blockdev).get('read-only') is True
+        return 'read-only=on' in blockdev.split(',')
+
+    def _migrate_wait(self, vm: QEMUMachine) -> None:
+        try:
+            event = vm.events_wait([
+                ('MIGRATION', {'data': {'status': 'completed'}}),
+                ('MIGRATION', {'data': {'status': 'failed'}}),
+            ], timeout=self._timeout)
+        except asyncio.TimeoutError:
+            event = None
+        if event is None or event['data']['status'] != 'completed':
+            raise QEMUMachineError(
+                "Migration %s: %r" % ('timed out' if event is None
+                                      else 'failed',
+                                      vm.cmd('query-migrate')))
+
+    @staticmethod
+    def _enable_migration_events(vm: QEMUMachine) -> None:
+        vm.cmd('migrate-set-capabilities', capabilities=[
+            {'capability': 'events', 'state': True}
+        ])
+
+    def _take_snapshot(self) -> None:
+        self._temp_dir = tempfile.mkdtemp(prefix="qemu-machine-pool-",
+                                          dir=self._base_temp_dir)
+        path = os.path.join(self._temp_dir, "snapshot")
+
+        LOG.debug("Booting template VM for snapshot %s", path)
+        with self._new_vm() as vm:
+            vm.launch()
+            if self._boot is not None:
+                self._boot(vm)
+            self._enable_migration_events(vm)
+            vm.cmd('stop')
+            vm.cmd('migrate', uri=f"file:{path}")
+            self._migrate_wait(vm)
+        self._snapshot = path
+
+    def _restore(self) -> QEMUMachine:
+        """Launch a new VM from the snapshot, and leave it paused."""
+        snapshot = self.snapshot
+        vm = self._new_vm()
+        vm.add_args('-incoming', 'defer')
+        vm.launch()
+        try:
+            self._enable_migration_events(vm)
+            vm.cmd('migrate-incoming', uri=f"file:{snapshot}")
+            self._migrate_wait(vm)
+        except BaseException:
+            vm.shutdown(hard=True)
+            raise
+        return vm
+
+    def fill(self) -> None:
+        """Restore VMs until the pool holds the requested number of them."""
+        while len(self._ready) < self._size:
+            self._ready.append(self._restore())
+
+    def acquire(self, resume: bool = True) -> QEMUMachine:
+        """
+        Take a VM out of the pool, restoring a new one if it is empty.
+
+        The pool is not refilled here, so that handing out VMs is quick;
+        release() and fill() do that.
+
+        :param resume: Whether to resume the VM, which is paused after
+                       restoring the snapshot.
+        """
+        if self._ready:
+            vm = self._ready.pop()
+        else:
+            vm = self._restore()
+        if resume:
+            vm.cmd('cont')
+        return vm
+
+    def release(self, vm: QEMUMachine) -> None:
+        """
+        Shut down a VM returned by acquire(), and refill the pool.
+
+        A VM that has run is no longer in the state of the snapshot, and
+        QEMU cannot restore a snapshot into it again, so it is never put
+        back into the pool.
+        """
+        vm.shutdown()
+        self.fill()
+
+    @contextmanager
+    def machine(self, resume: bool = True) -> Iterator[QEMUMachine]:
+        """
+        Context manager for a VM taken out of the pool with acquire().
+
+        The VM is released when leaving the context.
+        """
+        vm = self.acquire(resume)
+        try:
+            yield vm
+        finally:
+            self.release(vm)
+
+    def close(self) -> None:
+        """Shut down all the VMs of the pool and delete the snapshot."""
+        while self._ready:
+            self._ready.pop().shutdown()
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir)
+            self._temp_dir = None
+            self._snapshot = None
@@ -26,6 +26,7 @@
 from .error import QMPError
 from .events import EventListener
 from .message import Message
+from .pool import PoolResult, QMPPool, SyncQMPPool
 from .protocol import (
     ConnectError,
     Runstate,
@@ -47,6 +48,9 @@
     'Message',
     'EventListener',
     'Runstate',
+    'QMPPool',
+    'SyncQMPPool',
+    'PoolResult',
 
     # Exceptions, most generic to most explicit
     'QMPError',
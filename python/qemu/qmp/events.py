@@ -451,8 +451,11 @@ def accept(self, event) -> bool:
 from contextlib import contextmanager
 import logging
 from typing import (
+    AbstractSet,
     AsyncIterator,
     Callable,
+    Dict,
+    FrozenSet,
     Iterable,
     Iterator,
     List,
@@ -476,6 +479,81 @@ class ListenerError(QMPError):
     """
 
 
+class _EventNames(Set[str]):
+    """
+    The set of `EventListener.names`; tells the listener when it changes.
+    """
+    def __init__(self, listener: 'EventListener', names: Iterable[str] = ()):
+        super().__init__(names)
+        self._listener = listener
+
+    def _changed(self) -> None:
+        self._listener._names_changed()  # pylint: disable=protected-access
+
+    def add(self, element: str) -> None:
+        super().add(element)
+        self._changed()
+
+    def discard(self, element: object) -> None:
+        super().discard(element)
+        self._changed()
+
+    def remove(self, element: str) -> None:
+        super().remove(element)
+        self._changed()
+
+    def pop(self) -> str:
+        element = super().pop()
+        self._changed()
+        return element
+
+    def clear(self) -> None:
+        super().clear()
+        self._changed()
+
+    def update(self, *others: Iterable[str]) -> None:
+        super().update(*others)
+        self._changed()
+
+    def difference_update(self, *others: Iterable[object]) -> None:
+        super().difference_update(*others)
+        self._changed()
+
+    def intersection_update(self, *others: Iterable[object]) -> None:
+        super().intersection_update(*others)
+        self._changed()
+
+    def symmetric_difference_update(self, other: Iterable[str]) -> None:
+        super().symmetric_difference_update(other)
+        self._changed()
+
+    # The in-place operators of set do not use the methods above.
+    # typeshed declares them to return Self, which cannot be spelled
+    # here for all supported Python versions.
+
+    def __ior__(  # type: ignore[override,misc]
+            self, other: AbstractSet[str]) -> '_EventNames':
+        super().__ior__(other)
+        self._changed()
+        return self
+
+    def __iand__(self, other: AbstractSet[object]) -> '_EventNames':
+        super().__iand__(other)
+        self._changed()
+        return self
+
+    def __isub__(self, other: AbstractSet[object]) -> '_EventNames':
+        super().__isub__(other)
+        self._changed()
+        return self
+
+    def __ixor__(  # type: ignore[override,misc]
+            self, other: AbstractSet[str]) -> '_EventNames':
+        super().__ixor__(other)
+        self._changed()
+        return self
+
+
 class EventListener:
     """
     Selectively listens for events with runtime configurable filtering.
@@ -494,6 +572,19 @@ class EventListener:
     will be filtered first, and then the filter function will be called
     second. The event filter function can assume that the format of the
     event is a known format.
+
+    .. note::
+        `QMPClient` indexes listeners by their `names`, so that events
+        are only offered to listeners that may accept them. The index
+        is updated whenever `names` changes.
+
+    .. note::
+        Events are delivered without deserializing their payload first;
+        only their name is known to be well-formed. If the server sends
+        a malformed event, `DeserializationError` is raised when its
+        payload is first accessed: by ``event_filter`` or `accept()`,
+        which then fails in the `QMPClient` reader, or by whoever
+        retrieves the event with `get()` or by iterating.
     """
     def __init__(
         self,
@@ -506,16 +597,32 @@ def __init__(
         # Intended as a historical record, NOT a processing queue or backlog.
         self._history: List[Message] = []
 
-        #: Primary event filter, based on one or more event names.
-        self.names: Set[str] = set()
+        # The clients this listener is registered with.
+        self._registrations: List['Events'] = []
+
+        self._names = _EventNames(self)
         if isinstance(names, str):
-            self.names.add(names)
+            self._names.add(names)
         elif names is not None:
-            self.names.update(names)
+            self._names.update(names)
 
         #: Optional, secondary event filter.
         self.event_filter: Optional[EventFilter] = event_filter
 
+    @property
+    def names(self) -> Set[str]:
+        """Primary event filter, based on one or more event names."""
+        return self._names
+
+    @names.setter
+    def names(self, names: Set[str]) -> None:
+        self._names = _EventNames(self, names)
+        self._names_changed()
+
+    def _names_changed(self) -> None:
+        for events in self._registrations:
+            events._reindex_listener(self)  # pylint: disable=protected-access
+
     def __repr__(self) -> str:
         args: List[str] = []
         if self.names:
@@ -582,6 +689,16 @@ async def put(self, event: Message) -> None:
         self._history.append(event)
         await self._queue.put(event)
 
+    def _put_nowait(self, event: Message) -> None:
+        """
+        Like `put()`, for listeners whose queue is unbounded.
+        """
+        if not self.accept(event):
+            return
+
+        self._history.append(event)
+        self._queue.put_nowait(event)
+
     async def get(self) -> Message:
         """
         Wait for the very next event in this stream.
@@ -652,6 +769,15 @@ class Events:
     def __init__(self) -> None:
         self._listeners: List[EventListener] = []
 
+        # Dispatch index: listeners by event name, and those that must
+        # see every event (no names, or a custom accept() method). Each
+        # entry records whether the listener can take the non-awaiting
+        # path.
+        self._named_listeners: Dict[str, List[Tuple[EventListener, bool]]] = {}
+        self._wildcard_listeners: List[Tuple[EventListener, bool]] = []
+        # Names each indexed listener was registered with, by id().
+        self._indexed_names: Dict[int, FrozenSet[str]] = {}
+
         #: Default, all-events `EventListener`. See `qmp.events` for more info.
         self.events: EventListener = EventListener()
         self.register_listener(self.events)
@@ -665,8 +791,48 @@ async def _event_dispatch(self, msg: Message) -> None:
 
         :param msg: The event to propagate.
         """
-        for listener in self._listeners:
-            await listener.put(msg)
+        name = msg['event']
+        named = self._named_listeners.get(name, ()) \
+            if isinstance(name, str) else ()
+
+        for listener, nowait in (*named, *self._wildcard_listeners):
+            if nowait:
+                listener._put_nowait(msg)  # pylint: disable=protected-access
+            else:
+                await listener.put(msg)
+
+    def _reindex_listener(self, listener: EventListener) -> None:
+        self._unindex_listener(listener)
+        self._index_listener(listener)
+
+    def _index_listener(self, listener: EventListener) -> None:
+        # pylint: disable=protected-access
+        nowait = (type(listener).put is EventListener.put
+                  and listener._queue.maxsize <= 0)
+        entry = (listener, nowait)
+        if listener.names and type(listener).accept is EventListener.accept:
+            names = frozenset(listener.names)
+            self._indexed_names[id(listener)] = names
+            for name in names:
+                self._named_listeners.setdefault(name, []).append(entry)
+        else:
+            self._wildcard_listeners.append(entry)
+
+    def _unindex_listener(self, listener: EventListener) -> None:
+        names = self._indexed_names.pop(id(listener), None)
+        if names is None:
+            self._wildcard_listeners = [
+                entry for entry in self._wildcard_listeners
+                if entry[0] is not listener
+            ]
+            return
+        for name in names:
+            entries = [entry for entry in self._named_listeners[name]
+                       if entry[0] is not listener]
+            if entries:
+                self._named_listeners[name] = entries
+            else:
+                del self._named_listeners[name]
 
     def register_listener(self, listener: EventListener) -> None:
         """
@@ -679,6 +845,9 @@ def register_listener(self, listener: EventListener) -> None:
             raise ListenerError("Attempted to re-register existing listener")
         self.logger.debug("Registering %s.", str(listener))
         self._listeners.append(listener)
+        self._index_listener(listener)
+        # pylint: disable=protected-access
+        listener._registrations.append(self)
 
     def remove_listener(self, listener: EventListener) -> None:
         """
@@ -696,6 +865,9 @@ def remove_listener(self, listener: EventListener) -> None:
         self.logger.debug("Removing %s.", str(listener))
         listener.clear()
         self._listeners.remove(listener)
+        self._unindex_listener(listener)
+        # pylint: disable=protected-access
+        listener._registrations.remove(self)
 
     @contextmanager
     def listen(self, *listeners: EventListener) -> Iterator[None]:
@@ -6,8 +6,9 @@
 """
 
 import json
-from json import JSONDecodeError
+import re
 from typing import (
+    Callable,
     Dict,
     Iterator,
     Mapping,
@@ -19,6 +20,37 @@
 from .error import ProtocolError
 
 
+try:
+    # Optional, faster JSON decoder.
+    import orjson  # pylint: disable=import-error
+    _default_decoder: Callable[[bytes], object] = orjson.loads
+except ImportError:
+    _default_decoder = json.loads
+
+
+# Start of a serialized QMP event, as emitted by QEMU: the "event" member,
+# optionally preceded by the flat "timestamp" object.  Anchored at the
+# opening brace so that only top-level members can match.
+_EVENT_PREFIX = re.compile(
+    rb'\s*\{\s*'
+    rb'(?:"timestamp"\s*:\s*\{[^{}"]*(?:"\w+"[^{}"]*)*\}\s*,\s*)?'
+    rb'"event"\s*:\s*"([^"\\]*)"'
+)
+
+
+def _peek_event(data: bytes) -> Optional[str]:
+    """
+    Return the event name of a serialized QMP event without parsing it.
+
+    :return: The event name, or `None` if ``data`` does not start like
+        an event. Messages with other member orders are not recognized.
+    """
+    match = _EVENT_PREFIX.match(data)
+    if match is None:
+        return None
+    return match.group(1).decode('utf-8')
+
+
 class Message(MutableMapping[str, object]):
     """
     Represents a single QMP protocol message.
@@ -58,6 +90,14 @@ class Message(MutableMapping[str, object]):
          "hello": "world"
        }
 
+    Messages created lazily from `bytes` (``eager=False``) are only
+    deserialized when first accessed. For events, the ``'event'`` member
+    is located with a cheap scan of the raw bytes so that events can be
+    routed by name without deserializing their payload.
+
+    JSON is decoded with `decoder`, which defaults to ``orjson.loads``
+    when the orjson package is installed and to `json.loads` otherwise.
+
     :param value: Initial value, if any.
     :param eager:
         When `True`, attempt to serialize or deserialize the initial value
@@ -67,16 +107,24 @@ class Message(MutableMapping[str, object]):
     """
     # pylint: disable=too-many-ancestors
 
+    #: Function used to deserialize JSON `bytes`. It must raise
+    #: `ValueError` (such as `json.JSONDecodeError`) on failure.
+    decoder: Callable[[bytes], object] = _default_decoder
+
     def __init__(self,
                  value: Union[bytes, Mapping[str, object]] = b'{}', *,
                  eager: bool = True):
         self._data: Optional[bytes] = None
         self._obj: Optional[Dict[str, object]] = None
+        # Event name found by scanning _data, while _obj is not parsed.
+        self._event: Optional[str] = None
 
         if isinstance(value, bytes):
             self._data = value
             if eager:
                 self._obj = self._deserialize(self._data)
+            else:
+                self._event = _peek_event(self._data)
         else:
             self._obj = dict(value)
             if eager:
@@ -89,6 +137,8 @@ def __init__(self,
     # keys, items, values, get, __eq__ and __ne__ for free.
 
     def __getitem__(self, key: str) -> object:
+        if key == 'event' and self._event is not None and self._obj is None:
+            return self._event
         return self._object[key]
 
     def __setitem__(self, key: str, value: object) -> None:
@@ -105,6 +155,16 @@ def __iter__(self) -> Iterator[str]:
     def __len__(self) -> int:
         return len(self._object)
 
+    @property
+    def peeked_event(self) -> Optional[str]:
+        """
+        The event name, if it was found without deserializing the message.
+
+        Only set for events created lazily from `bytes` whose payload
+        has not been accessed yet.
+        """
+        return self._event if self._obj is None else None
+
     # Dunder methods not related to MutableMapping:
 
     def __repr__(self) -> str:
@@ -162,8 +222,8 @@ def _deserialize(cls, data: bytes) -> Dict[str, object]:
         :return: A `dict` representing this QMP message.
         """
         try:
-            obj = json.loads(data)
-        except JSONDecodeError as err:
+            obj = cls.decoder(data)
+        except ValueError as err:
             emsg = "Failed to deserialize QMP message."
             raise DeserializationError(emsg, data) from err
         if not isinstance(obj, dict):
@@ -179,8 +239,9 @@ class DeserializationError(ProtocolError):
     A QMP message was not understood as JSON.
 
     When this Exception is raised, ``__cause__`` will be set to the
-    `json.JSONDecodeError` Exception, which can be interrogated for
-    further details.
+    Exception raised by `Message.decoder`, usually a
+    `json.JSONDecodeError`, which can be interrogated for further
+    details.
 
     :param error_message: Human-readable string describing the error.
     :param raw: The raw `bytes` that prompted the failure.
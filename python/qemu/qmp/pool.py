@@ -0,0 +1,409 @@
+"""
+QMP Connection Pool
+
+This module provides `QMPPool`, which manages many `QMPClient`
+connections on a single event loop, and `SyncQMPPool`, a synchronous
+facade that runs such a pool on a background thread.
+
+Each member of the pool is supervised by a task that connects to the
+server and, should the connection be lost, reconnects with an
+exponential backoff. Commands can be fanned out to any subset of the
+members, with a bound on how many are in flight at once; the outcome
+for each member is reported in a `PoolResult`.
+"""
+
+# This work is licensed under the terms of the GNU LGPL, version 2 or
+# later. See the COPYING file in the top-level directory.
+
+import asyncio
+import logging
+from ssl import SSLContext
+import threading
+from types import TracebackType
+from typing import (
+    Awaitable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Type,
+    TypeVar,
+)
+
+from .error import QMPError
+from .protocol import ConnectError, Runstate, SocketAddrT
+from .qmp_client import QMPClient
+from .util import exception_summary
+
+
+class PoolResult(NamedTuple):
+    """
+    The aggregated outcome of a command fanned out by `QMPPool`.
+
+    Every member the command was sent to appears in exactly one of the
+    two mappings.
+    """
+    #: Return values, by member name.
+    results: Dict[str, object]
+    #: Errors, by member name.
+    errors: Dict[str, Exception]
+
+
+class _Member:
+    """
+    A member of a `QMPPool`, and the state of its supervising task.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name: str, address: SocketAddrT,
+                 ssl: Optional[SSLContext]):
+        self.name = name
+        self.client = QMPClient(name)
+        self.address = address
+        self.ssl = ssl
+        self.connected = asyncio.Event()
+        self.last_error: Optional[Exception] = None
+        self.task: Optional['asyncio.Task[None]'] = None
+
+
+class QMPPool:
+    """
+    Manage a set of named `QMPClient` connections on one event loop.
+
+    :param max_concurrency:
+        Default limit on the number of commands in flight at once
+        when fanning out with `execute()`.
+    :param connect_timeout:
+        How long `execute()` waits for a member that is not currently
+        connected before reporting a `ConnectError` for it.
+    :param backoff:
+        Delay before the first reconnection attempt, in seconds.
+    :param max_backoff:
+        Upper bound for the reconnection delay, which doubles after
+        every failed attempt and every lost connection. It is only
+        reset once a connection has stayed up for this long, so that
+        a server that accepts connections and drops them right away
+        is not hammered.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self,
+                 max_concurrency: int = 32,
+                 connect_timeout: Optional[float] = 5.0,
+                 backoff: float = 0.1,
+                 max_backoff: float = 10.0):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._members: Dict[str, _Member] = {}
+
+    @property
+    def names(self) -> List[str]:
+        """The names of the pool members, in the order they were added."""
+        return list(self._members)
+
+    def __getitem__(self, name: str) -> QMPClient:
+        """Return the `QMPClient` of the member called ``name``."""
+        return self._members[name].client
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    async def __aenter__(self) -> 'QMPPool':
+        return self
+
+    async def __aexit__(self,
+                        exc_type: Optional[Type[BaseException]],
+                        exc_val: Optional[BaseException],
+                        exc_tb: Optional[TracebackType]) -> None:
+        await self.close()
+
+    def is_connected(self, name: str) -> bool:
+        """Return whether the member called ``name`` is connected."""
+        return self._members[name].client.runstate == Runstate.RUNNING
+
+    async def add(self, name: str, address: SocketAddrT,
+                  ssl: Optional[SSLContext] = None) -> QMPClient:
+        """
+        Add a member to the pool and start connecting to it.
+
+        This does not wait for the connection to be established; see
+        `wait_connected()`.
+
+        :param name: Unique name of the member, used as its nickname.
+        :param address:
+            Address to connect to; UNIX socket path or TCP address/port.
+        :param ssl: SSL context to use, if any.
+
+        :return: The `QMPClient` for the new member.
+        :raise QMPError: When ``name`` is already in use.
+        """
+        if name in self._members:
+            raise QMPError(f"'{name}' is already a member of the pool")
+        member = _Member(name, address, ssl)
+        self._members[name] = member
+        member.task = asyncio.get_running_loop().create_task(
+            self._supervise(member)
+        )
+        return member.client
+
+    async def remove(self, name: str) -> None:
+        """
+        Disconnect from a member and remove it from the pool.
+
+        :param name: Name of the member to remove.
+        """
+        member = self._members.pop(name)
+        await self._stop(member)
+
+    async def close(self) -> None:
+        """Disconnect from and remove all members of the pool."""
+        members = list(self._members.values())
+        self._members.clear()
+        await asyncio.gather(*(self._stop(member) for member in members))
+
+    async def wait_connected(self, names: Optional[Iterable[str]] = None,
+                             timeout: Optional[float] = None) -> None:
+        """
+        Wait until the given members are all connected.
+
+        :param names: Members to wait for; all of them by default.
+        :param timeout: Timeout in seconds, or ``None`` to wait forever.
+
+        :raise asyncio.TimeoutError:
+            When the members are not all connected within ``timeout``.
+        """
+        members = self._select(names)
+        await asyncio.wait_for(
+            asyncio.gather(*(m.connected.wait() for m in members)),
+            timeout
+        )
+
+    async def execute(self, cmd: str,
+                      arguments: Optional[Mapping[str, object]] = None,
+                      names: Optional[Iterable[str]] = None,
+                      timeout: Optional[float] = None,
+                      max_concurrency: Optional[int] = None) -> PoolResult:
+        """
+        Execute a QMP command on several members concurrently.
+
+        Members that are not connected are given `connect_timeout`
+        seconds to (re)connect. Errors are not raised, but collected
+        per member in the returned `PoolResult`; these are typically
+        `ExecuteError`, `ExecInterruptedError`, `ConnectError` or, when
+        ``timeout`` expires, `asyncio.TimeoutError`.
+
+        :param cmd: QMP command name.
+        :param arguments: Arguments (if any). Must be JSON-serializable.
+        :param names: Members to send the command to; all by default.
+        :param timeout:
+            Timeout in seconds for the command on each member, or
+            ``None`` to wait forever.
+        :param max_concurrency:
+            Limit on the commands in flight at once, overriding the
+            pool's default.
+
+        :return: Per-member return values and errors.
+        """
+        members = self._select(names)
+        sem = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        result = PoolResult({}, {})
+
+        async def _one(member: _Member) -> None:
+            async with sem:
+                try:
+                    await self._wait_member(member)
+                    result.results[member.name] = await asyncio.wait_for(
+                        member.client.execute(cmd, arguments), timeout
+                    )
+                except (QMPError, OSError, asyncio.TimeoutError) as err:
+                    result.errors[member.name] = err
+
+        await asyncio.gather(*(_one(member) for member in members))
+        return result
+
+    def _select(self, names: Optional[Iterable[str]]) -> List[_Member]:
+        if names is None:
+            return list(self._members.values())
+        return [self._members[name] for name in names]
+
+    async def _wait_member(self, member: _Member) -> None:
+        if member.connected.is_set():
+            return
+        try:
+            await asyncio.wait_for(member.connected.wait(),
+                                   self.connect_timeout)
+        except asyncio.TimeoutError as err:
+            raise ConnectError(
+                "Member is not connected",
+                member.last_error or err
+            ) from member.last_error
+
+    async def _supervise(self, member: _Member) -> None:
+        """
+        Keep ``member`` connected until the task is cancelled.
+        """
+        client = member.client
+        loop = asyncio.get_running_loop()
+        delay = self.backoff
+        while True:
+            try:
+                await client.connect(member.address, member.ssl)
+            except ConnectError as err:
+                member.last_error = err
+                self.logger.debug("%s: %s; retrying in %.2fs",
+                                  member.name, str(err), delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+                continue
+
+            member.last_error = None
+            member.connected.set()
+            connected_at = loop.time()
+            while client.runstate == Runstate.RUNNING:
+                await client.runstate_changed()
+            member.connected.clear()
+            if loop.time() - connected_at >= self.max_backoff:
+                delay = self.backoff
+
+            # Collect the error that terminated the session, if any.
+            try:
+                await client.disconnect()
+            except Exception as err:  # pylint: disable=broad-except
+                member.last_error = err
+                self.logger.info("%s: connection lost: %s",
+                                 member.name, exception_summary(err))
+
+            self.logger.debug("%s: reconnecting in %.2fs",
+                              member.name, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    async def _stop(self, member: _Member) -> None:
+        if member.task is not None:
+            member.task.cancel()
+            try:
+                await member.task
+            except asyncio.CancelledError:
+                pass
+        member.connected.clear()
+        try:
+            await member.client.disconnect()
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.debug("%s: error on disconnect: %s",
+                              member.name, exception_summary(err))
+
+
+class SyncQMPPool:
+    """
+    Synchronous facade for `QMPPool`.
+
+    The pool's event loop runs on a background thread that is started
+    on construction and stopped by `close()`; the methods of this class
+    block until the corresponding `QMPPool` operation has completed.
+    The parameters are those of `QMPPool`.
+    """
+
+    _T = TypeVar('_T')
+
+    def __init__(self,
+                 max_concurrency: int = 32,
+                 connect_timeout: Optional[float] = 5.0,
+                 backoff: float = 0.1,
+                 max_backoff: float = 10.0):
+        self._pool = QMPPool(max_concurrency, connect_timeout,
+                             backoff, max_backoff)
+        self._aloop = asyncio.new_event_loop()
+        self._thread: Optional[threading.Thread] = threading.Thread(
+            target=self._aloop.run_forever, name='qmp-pool', daemon=True
+        )
+        self._thread.start()
+
+    def _sync(self, future: Awaitable[_T],
+              timeout: Optional[float] = None) -> _T:
+        async def _wrap() -> SyncQMPPool._T:
+            return await future
+        return asyncio.run_coroutine_threadsafe(
+            _wrap(), self._aloop
+        ).result(timeout)
+
+    def __enter__(self) -> 'SyncQMPPool':
+        return self
+
+    def __exit__(self,
+                 exc_type: Optional[Type[BaseException]],
+                 exc_val: Optional[BaseException],
+                 exc_tb: Optional[TracebackType]) -> None:
+        self.close()
+
+    @property
+    def pool(self) -> QMPPool:
+        """
+        The underlying `QMPPool`.
+
+        It must only be used from coroutines running on its own loop.
+        """
+        return self._pool
+
+    @property
+    def names(self) -> List[str]:
+        """The names of the pool members, in the order they were added."""
+        return self._pool.names
+
+    def add(self, name: str, address: SocketAddrT,
+            ssl: Optional[SSLContext] = None) -> None:
+        """Add a member to the pool; see `QMPPool.add()`."""
+        self._sync(self._pool.add(name, address, ssl))
+
+    def remove(self, name: str) -> None:
+        """Remove a member from the pool; see `QMPPool.remove()`."""
+        self._sync(self._pool.remove(name))
+
+    def wait_connected(self, names: Optional[Iterable[str]] = None,
+                       timeout: Optional[float] = None) -> None:
+        """Wait for members to connect; see `QMPPool.wait_connected()`."""
+        self._sync(self._pool.wait_connected(names, timeout))
+
+    def execute(self, cmd: str,
+                arguments: Optional[Mapping[str, object]] = None,
+                names: Optional[Iterable[str]] = None,
+                timeout: Optional[float] = None,
+                max_concurrency: Optional[int] = None) -> PoolResult:
+        """Fan out a command; see `QMPPool.execute()`."""
+        return self._sync(self._pool.execute(
+            cmd, arguments, names, timeout, max_concurrency
+        ))
+
+    def cmd(self, cmd: str,
+            args: Optional[Mapping[str, object]] = None,
+            names: Optional[Iterable[str]] = None) -> PoolResult:
+        """
+        Fan out a command with the pool's default limits.
+
+        :param cmd: QMP command name.
+        :param args: Arguments (if any). Must be JSON-serializable.
+        :param names: Members to send the command to; all by default.
+        """
+        return self.execute(cmd, args, names)
+
+    def close(self) -> None:
+        """Disconnect from all members and stop the background thread."""
+        if self._thread is None:
+            return
+        try:
+            self._sync(self._pool.close())
+        finally:
+            self._aloop.call_soon_threadsafe(self._aloop.stop)
+            self._thread.join()
+            self._thread = None
+            self._aloop.close()
+
+    def __del__(self) -> None:
+        if self._thread is not None:
+            self.close()
@@ -231,6 +231,9 @@ class AsyncProtocol(Generic[T]):
     #: Logger object for debugging messages from this connection.
     logger = logging.getLogger(__name__)
 
+    # Maximum number of queued messages sent with a single write.
+    _send_batch_max = 256
+
     # -------------------------
     # Section: Public interface
     # -------------------------
@@ -932,15 +935,22 @@ async def _bh_loop_forever(self, async_fn: _TaskFN, name: str) -> None:
     @bottom_half
     async def _bh_send_message(self) -> None:
         """
-        Wait for an outgoing message, then send it.
+        Wait for outgoing messages, then send them.
+
+        Messages that are already queued when the first one is picked up
+        are sent together with `_send_many()`, up to `_send_batch_max`
+        messages at a time.
 
         Designed to be run in `_bh_loop_forever()`.
         """
-        msg = await self._outgoing.get()
+        msgs = [await self._outgoing.get()]
+        while len(msgs) < self._send_batch_max and not self._outgoing.empty():
+            msgs.append(self._outgoing.get_nowait())
         try:
-            await self._send(msg)
+            await self._send_many(msgs)
         finally:
-            self._outgoing.task_done()
+            for _ in msgs:
+                self._outgoing.task_done()
 
     @bottom_half
     async def _bh_recv_message(self) -> None:
@@ -970,7 +980,8 @@ def _cb_outbound(self, msg: T) -> T:
         :param msg: raw outbound message
         :return: final outbound message
         """
-        self.logger.debug("--> %s", str(msg))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("--> %s", str(msg))
         return msg
 
     @upper_half
@@ -990,7 +1001,8 @@ def _cb_inbound(self, msg: T) -> T:
         :param msg: raw inbound message
         :return: processed inbound message
         """
-        self.logger.debug("<-- %s", str(msg))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("<-- %s", str(msg))
         return msg
 
     @upper_half
@@ -1084,6 +1096,35 @@ async def _send(self, msg: T) -> None:
         msg = self._cb_outbound(msg)
         self._do_send(msg)
 
+    @upper_half
+    @bottom_half
+    def _do_send_many(self, msgs: List[T]) -> None:
+        """
+        Write several messages to the stream.
+
+        Very low-level; intended to only be called by `_send_many()`.
+        The default implementation calls `_do_send()` for each message;
+        subclasses may override it to coalesce them into a single write.
+        """
+        for msg in msgs:
+            self._do_send(msg)
+
+    @bottom_half
+    async def _send_many(self, msgs: List[T]) -> None:
+        """
+        Send several protocol messages, then wait for the stream to drain.
+
+        Each message is transformed according to `_cb_outbound()`.
+        Waiting for the stream writer to drain below its high-water mark
+        applies back-pressure to the writer task when the peer does not
+        keep up.
+
+        :raise OSError: For problems with the underlying stream.
+        """
+        self._do_send_many([self._cb_outbound(msg) for msg in msgs])
+        if self._writer is not None:
+            await self._writer.drain()
+
     @bottom_half
     async def _on_message(self, msg: T) -> None:
         """
@@ -12,10 +12,14 @@
 import socket
 import struct
 from typing import (
+    AsyncIterator,
     Dict,
+    Iterable,
     List,
     Mapping,
     Optional,
+    Set,
+    Tuple,
     Union,
     cast,
 )
@@ -185,6 +189,32 @@ def __init__(self, error_message: str, msg: Message, sent: Message):
         self.sent = sent
 
 
+class _Batch:
+    """
+    The commands of one `QMPClient.execute_many_as_completed()` call
+    that are awaiting a reply.
+
+    Their replies are all routed to one queue. At most ``window``
+    replies are queued, plus one `ExecInterruptedError` on
+    disconnection, so that the reader never blocks on it.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, window: int):
+        self.replies: 'asyncio.Queue[QMPClient._PendingT]' = \
+            asyncio.Queue(maxsize=window + 1)
+        # Execution ID -> (index in the batch, message)
+        self.in_flight: Dict[str, Tuple[int, Message]] = {}
+
+    def drop(self, pending: Dict[
+            Union[str, None],
+            'asyncio.Queue[QMPClient._PendingT]'
+    ]) -> None:
+        """Stop routing replies to the commands still in flight."""
+        for exec_id in self.in_flight:
+            pending.pop(exec_id, None)
+
+
 class QMPClient(AsyncProtocol[Message], Events):
     """Implements a QMP client connection.
 
@@ -277,6 +307,9 @@ def __init__(
             'asyncio.Queue[QMPClient._PendingT]'
         ] = {}
 
+        # Pipelined batches with commands in flight.
+        self._batches: Set[_Batch] = set()
+
     @property
     def greeting(self) -> Optional[Greeting]:
         """
@@ -302,6 +335,7 @@ async def _establish_session(self) -> None:
         """
         self._greeting = None
         self._pending = {}
+        self._batches = set()
 
         if self.await_greeting or self.negotiate:
             self._greeting = await self._get_greeting()
@@ -384,7 +418,9 @@ async def _bh_disconnect(self) -> None:
             keys = self._pending.keys()
             for key in keys:
                 self.logger.debug("Cancelling execution '%s'", key)
-                self._pending[key].put_nowait(
+            # Pipelined commands share a queue, which is interrupted once.
+            for queue in set(self._pending.values()):
+                queue.put_nowait(
                     ExecInterruptedError("Disconnected")
                 )
 
@@ -393,6 +429,10 @@ async def _bh_disconnect(self) -> None:
     @upper_half
     def _cleanup(self) -> None:
         super()._cleanup()
+        # Batches whose iterator was abandoned without being closed
+        for batch in self._batches:
+            batch.drop(self._pending)
+        self._batches.clear()
         assert not self._pending
 
     @bottom_half
@@ -444,10 +484,30 @@ async def _on_message(self, msg: Message) -> None:
         )
         self.logger.debug("Unroutable message: %s", str(msg))
 
+    @upper_half
+    @bottom_half
+    def _cb_inbound(self, msg: Message) -> Message:
+        if (msg.peeked_event is not None
+                and self.logger.isEnabledFor(logging.DEBUG)):
+            # Log events as received, without deserializing them.
+            self.logger.debug(
+                "<-- %s",
+                bytes(msg).decode('utf-8', errors='replace').rstrip())
+            return msg
+        return super()._cb_inbound(msg)
+
     @upper_half
     @bottom_half
     async def _do_recv(self) -> Message:
         """
+        Events are deserialized lazily: only their name is located, so
+        that they can be routed, and the rest of the message is parsed
+        when it is first accessed. A malformed event is therefore not
+        reported here; its `DeserializationError` is raised by whatever
+        first accesses its payload, such as an event filter or the
+        consumer of an `EventListener`. All other messages are still
+        deserialized here.
+
         :raise OSError: When a stream error is encountered.
         :raise EOFError: When the stream is at EOF.
         :raise ProtocolError:
@@ -457,7 +517,13 @@ async def _do_recv(self) -> Message:
         :return: A single QMP `Message`.
         """
         msg_bytes = await self._readline()
-        msg = Message(msg_bytes, eager=True)
+        # Events only need their name to be routed; their payload is
+        # deserialized when a listener first accesses it.
+        msg = Message(msg_bytes, eager=False)
+        if msg.peeked_event is None:
+            # Not an event: deserialize now, so that malformed messages
+            # are caught here rather than by whoever awaits the reply.
+            msg = Message(msg_bytes, eager=True)
         return msg
 
     @upper_half
@@ -471,6 +537,17 @@ def _do_send(self, msg: Message) -> None:
         assert self._writer is not None
         self._writer.write(bytes(msg))
 
+    @upper_half
+    @bottom_half
+    def _do_send_many(self, msgs: List[Message]) -> None:
+        """
+        :raise ValueError: JSON serialization failure
+        :raise TypeError: JSON serialization failure
+        :raise OSError: When a stream error is encountered.
+        """
+        assert self._writer is not None
+        self._writer.write(b''.join(bytes(msg) for msg in msgs))
+
     @upper_half
     def _get_exec_id(self) -> str:
         exec_id = f"__qmp#{self._execute_id:05d}"
@@ -631,7 +708,19 @@ async def execute_msg(self, msg: Message) -> object:
         # Exceptions but without modifying the caller's held copy.
         msg = Message(msg)
         reply = await self._execute(msg)
+        return self._reply_result(msg, reply)
+
+    @staticmethod
+    def _reply_result(msg: Message, reply: Message) -> object:
+        """
+        Return the value of an execution reply.
 
+        :param msg: The sent QMP `Message`.
+        :param reply: The reply received for it.
+
+        :raise ExecuteError: When the server returns an error response.
+        :raise BadReplyError: When the reply is malformed.
+        """
         if 'error' in reply:
             try:
                 error_response = ErrorResponse(reply)
@@ -651,6 +740,125 @@ async def execute_msg(self, msg: Message) -> object:
 
         return reply['return']
 
+    @upper_half
+    @require(Runstate.RUNNING)
+    async def execute_many_as_completed(
+        self,
+        msgs: Iterable[Message],
+        window: int = 64,
+    ) -> AsyncIterator[Tuple[int, object]]:
+        """
+        Pipeline QMP commands and yield their results as they complete.
+
+        Up to ``window`` commands are in flight at any time; commands
+        issued back-to-back are coalesced into a single write by the
+        writer task. Replies are correlated by their execution IDs.
+
+        Command failures do not stop the iteration: for such commands,
+        the `ExecuteError` or `BadReplyError` is yielded in place of the
+        return value.
+
+        Callers that may stop iterating early must close the iterator,
+        for example with ``contextlib.aclosing()``, so that the commands
+        still in flight are dropped and their replies discarded. Those of
+        an iterator that is neither consumed nor closed are only dropped
+        on disconnection.
+
+        :param msgs: QMP `Message` objects to execute, as created by
+            `make_execute_msg()`.
+        :param window: Maximum number of commands awaiting a reply.
+
+        :return: An async iterator of ``(index, result)`` pairs, where
+            ``index`` is the position of the command in ``msgs``.
+        :raise ValueError:
+            If a QMP `Message` does not have either the 'execute' or
+            'exec-oob' fields set, or ``window`` is not positive.
+        :raise ExecInterruptedError:
+            If the connection was disrupted before all replies were
+            received.
+        """
+        if window < 1:
+            raise ValueError("window must be positive")
+
+        batch = _Batch(window)
+        in_flight = batch.in_flight
+        todo = enumerate(msgs)
+        exhausted = False
+
+        self._batches.add(batch)
+        try:
+            while True:
+                while not exhausted and len(in_flight) < window:
+                    try:
+                        index, msg = next(todo)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if not ('execute' in msg or 'exec-oob' in msg):
+                        raise ValueError(
+                            "Requires 'execute' or 'exec-oob' message")
+                    msg = Message(msg)
+                    exec_id = self._get_exec_id()
+                    msg['id'] = exec_id
+                    self._pending[exec_id] = batch.replies
+                    in_flight[exec_id] = (index, msg)
+                    self._outgoing.put_nowait(msg)
+
+                if not in_flight:
+                    return
+
+                reply = await batch.replies.get()
+                if isinstance(reply, ExecInterruptedError):
+                    raise reply
+                exec_id = cast(str, reply['id'])
+                self._pending.pop(exec_id, None)
+                index, msg = in_flight.pop(exec_id)
+                result: object
+                try:
+                    result = self._reply_result(msg, reply)
+                except (ExecuteError, BadReplyError) as err:
+                    result = err
+                yield index, result
+        finally:
+            batch.drop(self._pending)
+            self._batches.discard(batch)
+
+    @upper_half
+    @require(Runstate.RUNNING)
+    async def execute_many(self, msgs: Iterable[Message],
+                           window: int = 64,
+                           return_exceptions: bool = False) -> List[object]:
+        """
+        Pipeline QMP commands and return their values in order.
+
+        See `execute_many_as_completed()` for how commands are sent.
+
+        :param msgs: QMP `Message` objects to execute, as created by
+            `make_execute_msg()`.
+        :param window: Maximum number of commands awaiting a reply.
+        :param return_exceptions:
+            If `True`, command failures are returned in place of the
+            corresponding values. Otherwise, the error of the first
+            failed command is raised once all replies have arrived.
+
+        :return: The return values of the commands, in order.
+        :raise ExecuteError: When the server returns an error response.
+        :raise ExecInterruptedError:
+            If the connection was disrupted before all replies were
+            received.
+        """
+        results: Dict[int, object] = {}
+        async for index, result in self.execute_many_as_completed(
+                msgs, window):
+            results[index] = result
+
+        ordered = [results[i] for i in range(len(results))]
+        if not return_exceptions:
+            for result in ordered:
+                if isinstance(result, QMPError):
+                    raise result
+        return ordered
+
     @classmethod
     def make_execute_msg(cls, cmd: str,
                          arguments: Optional[Mapping[str, object]] = None,
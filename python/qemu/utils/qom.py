@@ -31,9 +31,8 @@
 ##
 
 import argparse
-from typing import List
 
-from .qom_common import QOMCommand
+from .qom_common import QOMCache, QOMCommand, QOMSnapshot
 
 
 try:
@@ -223,34 +222,29 @@ def __init__(self, args: argparse.Namespace):
         super().__init__(args)
         self.path = args.path
 
-    def _list_nodes(self, paths: List[str]) -> None:
-        all_paths_props = self.qom_list_get(paths)
-        i = 0
+    def _list_nodes(self, snapshot: QOMSnapshot, path: str) -> None:
+        print(path)
+        if path == '/':
+            path = ''
+        newpaths = []
 
-        for props in all_paths_props:
-            path = paths[i]
-            i = i + 1
-            print(path)
-            if path == '/':
-                path = ''
-            newpaths = []
-
-            for item in props.properties:
-                if item.child:
-                    newpaths += [f"{path}/{item.name}"]
-                else:
-                    value = item.value
-                    if value is None:
-                        value = "<EXCEPTION: property could not be read>"
-                    print(f"  {item.name}: {value} ({item.type})")
+        for item in snapshot.objects.get(path or '/', []):
+            if item.child:
+                newpaths += [f"{path}/{item.name}"]
+            else:
+                value = item.value
+                if value is None:
+                    value = "<EXCEPTION: property could not be read>"
+                print(f"  {item.name}: {value} ({item.type})")
 
-            print('')
+        print('')
 
-            if newpaths:
-                self._list_nodes(newpaths)
+        for newpath in newpaths:
+            self._list_nodes(snapshot, newpath)
 
     def run(self) -> int:
-        self._list_nodes([self.path])
+        snapshot = QOMCache(self.qmp.cmd).crawl(self.path)
+        self._list_nodes(snapshot, self.path)
         return 0
 
 
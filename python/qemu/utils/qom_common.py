@@ -16,18 +16,23 @@
 ##
 
 import argparse
+import json
 import os
 import sys
+import time
 from typing import (
+    IO,
     Any,
+    Callable,
     Dict,
+    Iterable,
     List,
     Optional,
     Type,
     TypeVar,
 )
 
-from qemu.qmp import QMPError
+from qemu.qmp import ExecuteError, QMPError
 from qemu.qmp.legacy import QEMUMonitorProtocol
 
 
@@ -111,6 +116,229 @@ def make(cls, value: Dict[str, Any]) -> 'ObjectPropertiesValues':
         return cls(props)
 
 
+class QOMSnapshot:
+    """
+    A serialisable record of (part of) the QOM tree of a running QEMU.
+
+    It holds the properties of the objects that were listed, by path,
+    and the replies to other commands that were recorded along the way,
+    so that tools can work on it after QEMU is gone.
+    """
+    def __init__(self) -> None:
+        #: Properties and their values, by object path.
+        self.objects: Dict[str, List[ObjectPropertyValue]] = {}
+        #: Replies to the commands sent through `QOMCache.cmd`.
+        self.replies: Dict[str, object] = {}
+        #: Free-form information about where the snapshot was taken.
+        self.info: Dict[str, object] = {}
+
+    @staticmethod
+    def reply_key(cmd: str, args: Dict[str, object]) -> str:
+        """The key of the reply to a command in `replies`."""
+        return json.dumps([cmd, args], sort_keys=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the snapshot as JSON-serialisable data."""
+        return {
+            'info': self.info,
+            'objects': {
+                path: [{'name': p.name, 'type': p.type, 'value': p.value}
+                       for p in props]
+                for path, props in self.objects.items()
+            },
+            'replies': self.replies,
+        }
+
+    @classmethod
+    def from_dict(cls, value: Dict[str, Any]) -> 'QOMSnapshot':
+        """Build a QOMSnapshot from data returned by `to_dict`."""
+        snapshot = cls()
+        snapshot.info = dict(value.get('info', {}))
+        snapshot.objects = {
+            path: [ObjectPropertyValue.make(p) for p in props]
+            for path, props in value.get('objects', {}).items()
+        }
+        snapshot.replies = dict(value.get('replies', {}))
+        return snapshot
+
+    def dump(self, file: IO[str]) -> None:
+        """Write the snapshot to a file, as JSON."""
+        json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, file: IO[str]) -> 'QOMSnapshot':
+        """Read a snapshot written by `dump`."""
+        return cls.from_dict(json.load(file))
+
+
+class QOMCache:
+    """
+    Cached, batched access to the QOM tree.
+
+    Objects are listed with ``qom-list-get``, several at once when
+    crawling, and their properties are kept for ``ttl`` seconds. Paths
+    that turned out not to be objects are remembered as well. Every
+    path looked at is given a stable inode number.
+
+    :param cmd: Function sending a QMP command, such as
+                `QEMUMonitorProtocol.cmd`; or None to only answer from
+                ``snapshot``, e.g. one loaded from a file.
+    :param ttl: How long listings stay valid, in seconds; None to keep
+                them until `invalidate` is called.
+    :param batch_size: How many objects a single ``qom-list-get`` lists
+                       at most.
+    :param snapshot: A snapshot to start from, and to record into.
+    """
+    def __init__(self, cmd: Optional[Callable[..., Any]],
+                 ttl: Optional[float] = 1.0,
+                 batch_size: int = 64,
+                 snapshot: Optional[QOMSnapshot] = None):
+        self._cmd = cmd
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.snapshot = snapshot if snapshot is not None else QOMSnapshot()
+        # When the listing of a path was fetched; entries from the
+        # snapshot we started from are not in there, and never expire.
+        self._fetched: Dict[str, float] = {}
+        self._missing: Dict[str, float] = {}
+        self._ino_map: Dict[str, int] = {}
+
+    def ino(self, path: str) -> int:
+        """Get an inode number for a given QOM path."""
+        ino = self._ino_map.get(path)
+        if ino is None:
+            ino = self._ino_map[path] = len(self._ino_map) + 1
+        return ino
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """
+        Forget the listing of an object, or of all objects.
+
+        Replies recorded by `cmd` are kept.
+        """
+        if self._cmd is None:
+            return
+        if path is None:
+            self.snapshot.objects.clear()
+            self._fetched.clear()
+            self._missing.clear()
+        else:
+            self.snapshot.objects.pop(path, None)
+            self._fetched.pop(path, None)
+            self._missing.pop(path, None)
+
+    def cmd(self, cmd: str, **args: Any) -> Any:
+        """
+        Send a command, recording its reply in the snapshot.
+
+        This is meant for commands returning static information, such as
+        ``qom-list-types``: their replies are cached until the snapshot
+        is discarded.
+
+        :raise QMPError: When working offline and the reply to the
+                         command was not recorded.
+        """
+        key = self.snapshot.reply_key(cmd, args)
+        if key not in self.snapshot.replies:
+            if self._cmd is None:
+                raise QMPError(f"No reply to '{cmd}' in the snapshot")
+            self.snapshot.replies[key] = self._cmd(cmd, **args)
+        return self.snapshot.replies[key]
+
+    def _expired(self, fetched: Optional[float], now: float) -> bool:
+        return (fetched is not None and self.ttl is not None
+                and now - fetched > self.ttl)
+
+    def _list_get(self, paths: List[str]) -> None:
+        assert self._cmd is not None
+        now = time.monotonic()
+        try:
+            rsp = self._cmd('qom-list-get', paths=paths)
+        except ExecuteError:
+            if len(paths) == 1:
+                self.snapshot.objects.pop(paths[0], None)
+                self._missing[paths[0]] = now
+                return
+            # Some object went away since we learnt about it; find out
+            # which, one by one.
+            for path in paths:
+                self._list_get([path])
+            return
+        assert isinstance(rsp, list)
+        for path, value in zip(paths, rsp):
+            self.snapshot.objects[path] = \
+                ObjectPropertiesValues.make(value).properties
+            self._fetched[path] = now
+            self._missing.pop(path, None)
+
+    def fetch(self, paths: Iterable[str]) -> None:
+        """
+        Make sure the listings of several objects are in the cache.
+
+        The objects that are not cached, or whose listing expired, are
+        listed in batches of at most ``batch_size``.
+        """
+        if self._cmd is None:
+            return
+        now = time.monotonic()
+        todo = []
+        for path in paths:
+            if path in self.snapshot.objects:
+                if not self._expired(self._fetched.get(path), now):
+                    continue
+            elif path in self._missing:
+                if not self._expired(self._missing[path], now):
+                    continue
+            todo.append(path)
+        for i in range(0, len(todo), self.batch_size):
+            self._list_get(todo[i:i + self.batch_size])
+
+    def properties(self, path: str) -> Optional[List[ObjectPropertyValue]]:
+        """
+        :return: The properties of the object at ``path``, or None if
+                 there is no such object.
+        """
+        self.fetch([path])
+        return self.snapshot.objects.get(path)
+
+    def lookup(self, path: str) -> Optional[ObjectPropertyValue]:
+        """
+        Look up a ``<object path>/<property>`` path in its parent's
+        listing.
+
+        :return: The property, or None if there is no such property.
+        """
+        parent, prop = path.rsplit('/', 1)
+        props = self.properties(parent or '/')
+        if props is None:
+            return None
+        for item in props:
+            if item.name == prop:
+                return item
+        return None
+
+    def crawl(self, path: str = '/') -> QOMSnapshot:
+        """
+        List all the objects below ``path``, a tree level at a time.
+
+        :return: The snapshot, now containing the whole subtree.
+        :raise QMPError: When there is no object at ``path``.
+        """
+        if self.properties(path) is None:
+            raise QMPError(f"No QOM object at '{path}'")
+        level = [path]
+        while level:
+            self.fetch(level)
+            children = []
+            for parent in level:
+                prefix = '' if parent == '/' else parent
+                for item in self.snapshot.objects.get(parent, ()):
+                    if item.child:
+                        children.append(f"{prefix}/{item.name}")
+            level = children
+        return self.snapshot
+
+
 CommandT = TypeVar('CommandT', bound='QOMCommand')
 
 
@@ -7,7 +7,7 @@
 This script requires the 'fusepy' python package.
 
 
-usage: qom-fuse [-h] [--socket SOCKET] <mount>
+usage: qom-fuse [-h] [--socket SOCKET] [--ttl TTL] <mount>
 
 Mount a QOM tree as a FUSE filesystem
 
@@ -19,6 +19,8 @@
   --socket SOCKET, -s SOCKET
                         QMP socket path or address (addr:port). May also be
                         set via QMP_SOCKET environment variable.
+  --ttl TTL             How long listings of QOM objects are cached, in
+                        seconds (default: 1.0)
 """
 ##
 # Copyright IBM, Corp. 2012
@@ -38,7 +40,6 @@
 import sys
 from typing import (
     IO,
-    Dict,
     Iterator,
     Mapping,
     Optional,
@@ -50,7 +51,7 @@
 
 from qemu.qmp import ExecuteError
 
-from .qom_common import QOMCommand
+from .qom_common import QOMCache, QOMCommand
 
 
 fuse.fuse_python_api = (0, 2)
@@ -75,12 +76,18 @@ def configure_parser(cls, parser: argparse.ArgumentParser) -> None:
             action='store',
             help="Mount point",
         )
+        parser.add_argument(
+            '--ttl',
+            type=float,
+            default=1.0,
+            help="How long listings of QOM objects are cached, in seconds"
+            " (default: %(default)s)",
+        )
 
     def __init__(self, args: argparse.Namespace):
         super().__init__(args)
         self.mount = args.mount
-        self.ino_map: Dict[str, int] = {}
-        self.ino_count = 1
+        self.cache = QOMCache(self.qmp.cmd, ttl=args.ttl)
 
     def run(self) -> int:
         print(f"Mounting QOMFS to '{self.mount}'", file=sys.stderr)
@@ -89,45 +96,23 @@ def run(self) -> int:
 
     def get_ino(self, path: str) -> int:
         """Get an inode number for a given QOM path."""
-        if path in self.ino_map:
-            return self.ino_map[path]
-        self.ino_map[path] = self.ino_count
-        self.ino_count += 1
-        return self.ino_map[path]
+        return self.cache.ino(path)
 
     def is_object(self, path: str) -> bool:
         """Is the given QOM path an object?"""
-        try:
-            self.qom_list(path)
+        if path == '/':
             return True
-        except ExecuteError:
-            return False
+        item = self.cache.lookup(path)
+        return item is not None and item.child
 
     def is_property(self, path: str) -> bool:
         """Is the given QOM path a property?"""
-        path, prop = path.rsplit('/', 1)
-        if path == '':
-            path = '/'
-        try:
-            for item in self.qom_list(path):
-                if item.name == prop:
-                    return True
-            return False
-        except ExecuteError:
-            return False
+        return self.cache.lookup(path) is not None
 
     def is_link(self, path: str) -> bool:
         """Is the given QOM path a link?"""
-        path, prop = path.rsplit('/', 1)
-        if path == '':
-            path = '/'
-        try:
-            for item in self.qom_list(path):
-                if item.name == prop and item.link:
-                    return True
-            return False
-        except ExecuteError:
-            return False
+        item = self.cache.lookup(path)
+        return item is not None and item.type.startswith('link<')
 
     def read(self, path: str, size: int, offset: int, fh: IO[bytes]) -> bytes:
         if not self.is_property(path):
@@ -201,7 +186,10 @@ def getattr(self, path: str,
         return value
 
     def readdir(self, path: str, fh: IO[bytes]) -> Iterator[str]:
+        props = self.cache.properties(path)
+        if props is None:
+            raise FuseOSError(ENOENT)
         yield '.'
         yield '..'
-        for item in self.qom_list(path):
+        for item in props:
             yield item.name
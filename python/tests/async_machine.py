@@ -0,0 +1,178 @@
+import asyncio
+import os
+import signal
+import sys
+from tempfile import TemporaryDirectory
+
+import avocado
+
+from qemu.machine.async_machine import AsyncQEMUMachine
+from qemu.machine.machine import (
+    AbnormalShutdown,
+    QEMUMachineError,
+    VMLaunchFailure,
+)
+from qemu.qmp import ExecuteError
+
+
+# A stand-in for the QEMU binary, serving QMP on the monitor socket
+# that AsyncQEMUMachine passes to it.
+FAKE_QEMU = r'''
+import json
+import socket
+import sys
+import time
+
+args = sys.argv[1:]
+print('fake-qemu: started', flush=True)
+if '-fake-exit-early' in args:
+    print('fake-qemu: exiting early', flush=True)
+    sys.exit(1)
+
+chardev = args[args.index('-chardev') + 1]
+fd = int(dict(opt.split('=') for opt in chardev.split(',')[1:])['fd'])
+sock = socket.socket(fileno=fd)
+
+
+def send(msg, cmd=None):
+    if cmd is not None and 'id' in cmd:
+        msg['id'] = cmd['id']
+    sock.sendall(json.dumps(msg).encode() + b'\n')
+
+
+def commands():
+    # Like QEMU, do not expect the commands to be separated by newlines
+    decoder = json.JSONDecoder()
+    buf = ''
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return
+        buf += data.decode()
+        while buf.strip():
+            try:
+                cmd, end = decoder.raw_decode(buf.lstrip())
+            except ValueError:
+                break
+            buf = buf.lstrip()[end:]
+            yield cmd
+
+
+send({'QMP': {'version': {'qemu': {'micro': 0, 'minor': 0, 'major': 9},
+                          'package': ''},
+              'capabilities': []}})
+for cmd in commands():
+    name = cmd['execute']
+    arguments = cmd.get('arguments', {})
+    if name == 'fail':
+        send({'error': {'class': 'GenericError', 'desc': 'failed'}}, cmd)
+        continue
+    if name == 'emit':
+        for event in arguments['events']:
+            send(dict(event, timestamp={'seconds': 0, 'microseconds': 0}))
+    send({'return': arguments if name == 'echo' else {}}, cmd)
+    if name == 'quit' and '-fake-ignore-quit' not in args:
+        print('fake-qemu: quit', flush=True)
+        sys.exit(0)
+
+if '-fake-ignore-quit' in args:
+    # Hang, like a QEMU that fails to quit, until killed
+    time.sleep(3600)
+'''
+
+
+class Machine(avocado.Test):
+
+    def setUp(self):
+        self._tmp = TemporaryDirectory()
+        binary = os.path.join(self._tmp.name, 'fake-qemu')
+        with open(binary, 'w', encoding='utf-8') as f:
+            f.write(FAKE_QEMU)
+        self.vm = AsyncQEMUMachine(binary, wrapper=[sys.executable],
+                                   base_temp_dir=self._tmp.name,
+                                   qmp_timer=10)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    async def testLaunch(self):
+        await self.vm.launch()
+        self.assertTrue(self.vm.is_running())
+        self.assertIsNotNone(self.vm.get_pid())
+        temp_dir = self.vm.temp_dir
+        self.assertTrue(os.path.isdir(temp_dir))
+
+        with self.assertRaises(QEMUMachineError):
+            await self.vm.launch()
+
+        await self.vm.shutdown()
+        self.assertFalse(self.vm.is_running())
+        self.assertEqual(self.vm.exitcode(), 0)
+        self.assertIn('fake-qemu: quit', self.vm.get_log())
+        self.assertFalse(os.path.exists(temp_dir))
+
+    async def testContextManager(self):
+        async with self.vm as vm:
+            await vm.launch()
+            self.assertTrue(vm.is_running())
+        self.assertFalse(self.vm.is_running())
+        self.assertEqual(self.vm.exitcode(), 0)
+
+    async def testCmd(self):
+        async with self.vm as vm:
+            await vm.launch()
+            self.assertEqual(await vm.cmd('echo', foo_bar=1), {'foo-bar': 1})
+            self.assertEqual(await vm.cmd('echo', conv_keys=False, foo_bar=1),
+                             {'foo_bar': 1})
+            self.assertEqual(await vm.cmd('echo', {'foo_bar': 1}),
+                             {'foo_bar': 1})
+            with self.assertRaises(ExecuteError):
+                await vm.cmd('fail')
+
+    async def testEvents(self):
+        async with self.vm as vm:
+            await vm.launch()
+            await vm.cmd('emit', events=[
+                {'event': 'FIRST', 'data': {}},
+                {'event': 'SECOND', 'data': {}},
+                {'event': 'THIRD', 'data': {'x': 1}},
+            ])
+
+            # Events that do not match are kept for later waits
+            event = await vm.events_wait([('THIRD', {'data': {'x': 2}}),
+                                          ('THIRD', {'data': {'x': 1}})])
+            self.assertEqual(event['event'], 'THIRD')
+            event = await vm.event_wait('FIRST')
+            self.assertEqual(event['event'], 'FIRST')
+            self.assertEqual([e['event'] for e in vm.get_qmp_events()],
+                             ['SECOND'])
+
+            with self.assertRaises(asyncio.TimeoutError):
+                await vm.event_wait('SECOND', timeout=0.1)
+
+    async def testLaunchFailure(self):
+        self.vm.add_args('-fake-exit-early')
+        with self.assertRaises(VMLaunchFailure) as context:
+            await self.vm.launch()
+        self.assertEqual(context.exception.exitcode, 1)
+        self.assertIn('-fake-exit-early', context.exception.command)
+        self.assertIn('fake-qemu: exiting early', context.exception.output)
+        self.assertFalse(self.vm.is_running())
+
+        # The failed launch was cleaned up, so the VM can be launched again
+        self.vm.args.remove('-fake-exit-early')
+        await self.vm.launch()
+        await self.vm.shutdown()
+
+    async def testAbnormalShutdown(self):
+        self.vm.add_args('-fake-ignore-quit')
+        await self.vm.launch()
+        with self.assertRaises(AbnormalShutdown):
+            await self.vm.shutdown(timeout=0.5)
+        self.assertEqual(self.vm.exitcode(), -signal.SIGKILL)
+
+    async def testKill(self):
+        await self.vm.launch()
+        await self.vm.kill()
+        self.assertEqual(self.vm.exitcode(), -signal.SIGKILL)
+        self.assertIn('fake-qemu: started', self.vm.get_log())
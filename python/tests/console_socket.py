@@ -0,0 +1,149 @@
+import os
+import re
+import socket
+from tempfile import TemporaryDirectory
+import threading
+import time
+
+import avocado
+
+from qemu.machine.console_socket import ConsoleSocket
+
+
+class Console(avocado.Test):
+    """
+    Tests of a ConsoleSocket on one end of a socket pair, with the test
+    playing the char device on the other end.
+    """
+
+    drain = True
+
+    def setUp(self):
+        self._tmp = TemporaryDirectory()
+        self.log_path = os.path.join(self._tmp.name, 'console.log')
+        ours, peer = socket.socketpair()
+        self.peer = peer
+        self.console = ConsoleSocket(sock_fd=ours.detach(),
+                                     file=self.log_path, drain=self.drain)
+
+    def tearDown(self):
+        self.console.close()
+        self.peer.close()
+        self._tmp.cleanup()
+
+    def send_later(self, *chunks, delay=0.05):
+        """Send chunks from another thread, pausing before each."""
+        def _send():
+            for chunk in chunks:
+                time.sleep(delay)
+                self.peer.sendall(chunk)
+        thread = threading.Thread(target=_send)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def testReaduntil(self):
+        self.send_later(b'login', b': root\n', b'Password:')
+        self.assertEqual(self.console.readuntil(b'login: '), b'login: ')
+        self.assertEqual(self.console.readuntil(b'Password:'),
+                         b'root\nPassword:')
+
+    def testReaduntilSplit(self):
+        # The pattern arrives a byte at a time, after a longer prefix
+        self.send_later(b'x' * 100, *[bytes([c]) for c in b'abcabd'],
+                        delay=0.01)
+        self.assertEqual(self.console.readuntil(b'abd'),
+                         b'x' * 100 + b'abcabd')
+
+    def testReaduntilRegex(self):
+        pattern = re.compile(rb'ready \d+\n')
+        self.send_later(b'not ready\nre', b'ady 1', b'2', b'\nrest')
+        self.assertEqual(self.console.readuntil(pattern),
+                         b'not ready\nready 12\n')
+        self.assertEqual(self.console.recv(4), b'rest')
+
+    def testReaduntilMaxLen(self):
+        pattern = re.compile(rb'<[a-z]*>')
+        self.send_later(b'<abc', b'def>', b'<gh', b'>')
+        # Only the end of the data already searched is searched again
+        self.assertEqual(self.console.readuntil(pattern, max_len=4),
+                         b'<abcdef><gh>')
+
+    def testReaduntilTimeout(self):
+        self.peer.sendall(b'partial')
+        with self.assertRaises(socket.timeout):
+            self.console.readuntil(b'complete', timeout=0.1)
+        # The data is left for later reads
+        self.send_later(b' complete')
+        self.assertEqual(self.console.readuntil(b'complete'),
+                         b'partial complete')
+
+    def testRecv(self):
+        self.peer.sendall(b'abc')
+        self.send_later(b'def')
+        self.assertEqual(self.console.recv(1, socket.MSG_PEEK), b'a')
+        if self.drain:
+            # Waits for the whole buffer, unlike the socket
+            self.assertEqual(self.console.recv(6), b'abcdef')
+        else:
+            self.assertEqual(self.console.recv(6), b'abc')
+
+    def testEOF(self):
+        self.peer.sendall(b'bye')
+        self.peer.shutdown(socket.SHUT_WR)
+        with self.assertRaises(EOFError):
+            self.console.readuntil(b'never')
+        self.assertEqual(self.console.recv(16), b'bye')
+        self.assertEqual(self.console.recv(16), b'')
+
+    def testLogfile(self):
+        self.send_later(b'line 1\n', b'line 2\n')
+        self.console.readuntil(b'line 2\n')
+        self.console.close()
+        with open(self.log_path, 'rb') as f:
+            self.assertEqual(f.read(), b'line 1\nline 2\n')
+
+    def testClose(self):
+        if not self.drain:
+            self.cancel('no drain thread')
+        # The drain thread is waiting for data; close() wakes it up
+        thread = self.console._drain_thread
+        self.assertTrue(thread.is_alive())
+        self.console.close()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.console._drain_thread)
+
+    def testCloseWhileWaiting(self):
+        if not self.drain:
+            self.cancel('no drain thread')
+
+        def _close():
+            time.sleep(0.05)
+            self.console.close()
+        thread = threading.Thread(target=_close)
+        thread.start()
+        self.addCleanup(thread.join)
+        with self.assertRaises(EOFError):
+            self.console.readuntil(b'never', timeout=5)
+
+    def testDrain(self):
+        if not self.drain:
+            self.cancel('no drain thread')
+        # The socket is drained even when nobody reads from the console
+        self.peer.sendall(b'x' * (1 << 20))
+        deadline = time.monotonic() + 5
+        while os.path.getsize(self.log_path) < 1 << 20:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(self.console.recv(1 << 20), b'x' * (1 << 20))
+
+
+class UndrainedConsole(Console):
+
+    drain = False
+
+    def testRecvAfterReaduntil(self):
+        self.peer.sendall(b'prompt> leftover')
+        self.assertEqual(self.console.readuntil(b'> '), b'prompt> ')
+        self.assertEqual(self.console.recv(4), b'left')
+        self.assertEqual(self.console.recv(4, socket.MSG_PEEK), b'over')
+        self.assertEqual(self.console.recv(64), b'over')
@@ -0,0 +1,162 @@
+from collections import deque
+
+import avocado
+
+from qemu.machine import QEMUMachine
+from qemu.machine.event_cache import (
+    EventCache,
+    EventFilter,
+    compile_match,
+    event_match,
+)
+
+
+def make_event(name, **data):
+    return {'event': name, 'data': data}
+
+
+class NullQMP:
+    """
+    NullQMP is a test mockup of QEMUMonitorProtocol's event interface.
+
+    Events to be received are queued with 'incoming'; pull_event()
+    returns None, as with a zero timeout, once they are exhausted.
+    """
+    def __init__(self):
+        self.incoming = deque()
+
+    def pull_event(self, wait=False):
+        # pylint: disable=unused-argument
+        if self.incoming:
+            return self.incoming.popleft()
+        return None
+
+    def get_events(self, wait=False):
+        # pylint: disable=unused-argument
+        events = list(self.incoming)
+        self.incoming.clear()
+        return events
+
+
+class CountingFilter(EventFilter):
+    """EventFilter counting the cached events it is checked against."""
+    def __init__(self, events):
+        super().__init__(events)
+        self.checked = 0
+
+    def match_named(self, name, event):
+        self.checked += 1
+        return super().match_named(name, event)
+
+
+class Match(avocado.Test):
+
+    def testCompiledMatch(self):
+        events = [
+            None, 5, 'foo', [1, 2], {},
+            {'foo': {'bar': 1}},
+            {'foo': 5, 'bar': None},
+            {'foo': {'bar': 1, 'rab': 2}},
+            {'foo': 'abc'},
+            {'foo': [1, 2]},
+            {'foo': {'a': 1, 'b': 2, 'c': 3}},
+        ]
+        matches = [
+            None, 5, 'foo', {},
+            {'foo': None},
+            {'foo': 5},
+            {'foo': {'abc': None}},
+            {'foo': {'rab': 2}},
+            {'foo': {'bar': 1}, 'bar': None},
+            {'foo': 'abc'},
+            {'foo': 'ab'},
+            {'foo': {}},
+        ]
+        for event in events:
+            for match in matches:
+                with self.subTest(event=event, match=match):
+                    self.assertEqual(compile_match(match)(event),
+                                     event_match(event, match))
+
+    def testFilter(self):
+        events = EventFilter([
+            ('BLOCK_JOB_READY', {'data': {'device': 'job0'}}),
+            ('JOB_STATUS_CHANGE', {'data': {'id': 'job0'}}),
+            ('JOB_STATUS_CHANGE', {'data': {'id': 'job1'}}),
+        ])
+        self.assertTrue(events(make_event('BLOCK_JOB_READY', device='job0')))
+        self.assertFalse(events(make_event('BLOCK_JOB_READY', device='job1')))
+        self.assertTrue(events(make_event('JOB_STATUS_CHANGE', id='job1')))
+        self.assertFalse(events(make_event('BLOCK_JOB_ERROR', device='job0')))
+        self.assertFalse(events({'data': {'device': 'job0'}}))
+        self.assertFalse(events({'event': None, 'data': {'device': 'job0'}}))
+
+
+class Cache(avocado.Test):
+
+    def testOrder(self):
+        cache = EventCache()
+        events = [make_event(f'EV{i % 3}', n=i) for i in range(9)]
+        for event in events:
+            cache.append(event)
+
+        self.assertIs(cache.take(EventFilter([('EV1', {'data': {'n': 4}}),
+                                              ('EV2', None)])),
+                      events[2])
+        self.assertIs(cache.take(EventFilter([('EV1', {'data': {'n': 4}})])),
+                      events[4])
+        self.assertIsNone(cache.take(EventFilter([('EV1', {'data': {'n': 4}}),
+                                                  ('EV3', None)])))
+        self.assertIs(cache.popleft(), events[0])
+        self.assertEqual(len(cache), 6)
+        self.assertEqual(cache.drain(),
+                         [events[i] for i in (1, 3, 5, 6, 7, 8)])
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.popleft())
+
+    def testMaxlen(self):
+        cache = EventCache(maxlen=2)
+        events = [make_event(f'EV{i % 2}', n=i) for i in range(7)]
+        for event in events:
+            cache.append(event)
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.drain(), events[3:])
+
+    def testStress(self):
+        """
+        Waiting for an event does not get slower as unrelated events
+        pile up in the cache.
+        """
+        vm = QEMUMachine('/dev/null')
+        qmp = NullQMP()
+        vm._qmp_connection = qmp  # pylint: disable=protected-access
+
+        events = CountingFilter([
+            ('BLOCK_JOB_COMPLETED', {'data': {'device': 'job0'}}),
+            ('JOB_STATUS_CHANGE', {'data': {'id': 'job0'}}),
+        ])
+        noise = ('BLOCK_JOB_READY', 'MIGRATION', 'RESUME', 'STOP')
+
+        for i in range(100000):
+            qmp.incoming.append(make_event(noise[i % len(noise)], n=i))
+            if i % 100 == 0:
+                qmp.incoming.append(make_event('JOB_STATUS_CHANGE',
+                                               id='job1', n=i))
+        qmp.incoming.append(make_event('JOB_STATUS_CHANGE', id='job0', n=-1))
+        event = vm.events_wait(events, timeout=0)
+        self.assertEqual(event['data']['n'], -1)
+        self.assertEqual(events.checked, 0)
+
+        # Every wait only looks at the 1000 cached JOB_STATUS_CHANGE
+        # events, and not at the 100k others.
+        for i in range(100):
+            qmp.incoming.append(make_event('JOB_STATUS_CHANGE',
+                                           id='job0', n=i))
+            qmp.incoming.append(make_event('RESUME', n=i))
+            events.checked = 0
+            event = vm.events_wait(events, timeout=0)
+            self.assertEqual(event['data']['n'], i)
+            self.assertEqual(events.checked, 1000)
+
+        self.assertEqual(len(vm.get_qmp_events()), 101100)
+        self.assertIsNone(vm.get_qmp_event())
@@ -0,0 +1,220 @@
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+
+import avocado
+
+from qemu.machine import MachinePool
+from qemu.machine.machine import QEMUMachineError
+
+
+class StandInMachine:
+    """
+    StandInMachine is a test mockup of the QEMUMachine methods used by
+    MachinePool.
+
+    Each instance records the QMP commands it is sent.  Migrating to a
+    file writes the file, and migrating from one checks that it exists;
+    either completes unless 'fail_migration' is set, or never ends if
+    'hang_migration' is.
+    """
+    fail_migration = False
+    hang_migration = False
+
+    def __init__(self, history):
+        self.history = history
+        self.args = []
+        self.cmds = []
+        self.launched = False
+        self.shut_down = False
+        self._events = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def add_args(self, *args):
+        self.args.extend(args)
+
+    def launch(self):
+        assert not self.launched
+        self.launched = True
+        self.history.append(('launch', self))
+
+    def shutdown(self, hard=False):
+        # pylint: disable=unused-argument
+        if self.launched and not self.shut_down:
+            self.shut_down = True
+            self.history.append(('shutdown', self))
+
+    def cmd(self, cmd, **args):
+        assert self.launched and not self.shut_down
+        self.cmds.append(cmd)
+        if cmd in ('migrate', 'migrate-incoming'):
+            path = args['uri'][len('file:'):]
+            if cmd == 'migrate':
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write('snapshot')
+            else:
+                assert os.path.exists(path)
+            status = 'failed' if self.fail_migration else 'completed'
+            if not self.hang_migration:
+                self._events.append({'event': 'MIGRATION',
+                                     'data': {'status': status}})
+        if cmd == 'query-migrate':
+            return {'status': 'active' if self.hang_migration else 'failed'}
+        return {}
+
+    def events_wait(self, events, timeout=60.0):
+        # pylint: disable=unused-argument
+        if not self._events:
+            raise asyncio.TimeoutError
+        return self._events.pop(0)
+
+
+class Pool(avocado.Test):
+
+    def setUp(self):
+        self._tmp = TemporaryDirectory()
+        self.history = []
+        self.args = []
+        self.machines = []
+        self.booted = []
+        self.pool = MachinePool(self.factory, size=2, boot=self.booted.append,
+                                base_temp_dir=self._tmp.name)
+
+    def tearDown(self):
+        self.pool.close()
+        self._tmp.cleanup()
+
+    def factory(self):
+        vm = StandInMachine(self.history)
+        vm.add_args(*self.args)
+        self.machines.append(vm)
+        return vm
+
+    def assertRestored(self, vm):
+        self.assertEqual(vm.args, ['-snapshot', '-incoming', 'defer'])
+        self.assertIn('migrate-incoming', vm.cmds)
+        self.assertTrue(vm.launched)
+        self.assertFalse(vm.shut_down)
+
+    def testSnapshot(self):
+        snapshot = self.pool.snapshot
+        self.assertTrue(snapshot.startswith(self._tmp.name))
+        self.assertTrue(os.path.exists(snapshot))
+        self.assertEqual(self.pool.snapshot, snapshot)
+
+        # The template VM is booted once, then stopped and shut down
+        template, = self.machines
+        self.assertEqual(self.booted, [template])
+        self.assertEqual(template.args, ['-snapshot'])
+        self.assertEqual(template.cmds,
+                         ['migrate-set-capabilities', 'stop', 'migrate'])
+        self.assertTrue(template.shut_down)
+
+    def testAcquire(self):
+        # An empty pool restores a VM on the spot, and does not refill
+        vm = self.pool.acquire()
+        self.assertEqual(len(self.machines), 2)
+        self.assertRestored(vm)
+        self.assertEqual(vm.cmds[-1], 'cont')
+
+        vm = self.pool.acquire(resume=False)
+        self.assertEqual(len(self.machines), 3)
+        self.assertRestored(vm)
+        self.assertNotEqual(vm.cmds[-1], 'cont')
+
+    def testFill(self):
+        self.pool.fill()
+        template, *ready = self.machines
+        self.assertEqual(len(ready), 2)
+        for vm in ready:
+            self.assertRestored(vm)
+        self.assertEqual(self.booted, [template])
+
+        # Acquiring from a full pool launches nothing
+        vm = self.pool.acquire()
+        self.assertIn(vm, ready)
+        self.assertEqual(len(self.machines), 3)
+
+    def testRelease(self):
+        self.pool.fill()
+        vm = self.pool.acquire()
+        del self.history[:]
+
+        # The VM has run, so it is shut down and replaced
+        self.pool.release(vm)
+        self.assertTrue(vm.shut_down)
+        self.assertEqual(self.history, [('shutdown', vm),
+                                        ('launch', self.machines[-1])])
+        self.assertEqual(len(self.machines), 4)
+        self.assertRestored(self.machines[-1])
+        self.assertNotIn(vm, (self.pool.acquire(), self.pool.acquire()))
+
+    def testMachine(self):
+        with self.pool.machine() as vm:
+            self.assertRestored(vm)
+        self.assertTrue(vm.shut_down)
+        # Leaving the context refilled the pool
+        self.assertEqual(len(self.machines), 4)
+
+        with self.assertRaises(RuntimeError):
+            with self.pool.machine() as vm:
+                raise RuntimeError()
+        self.assertTrue(vm.shut_down)
+
+    def testMigrationFailed(self):
+        snapshot = self.pool.snapshot
+        StandInMachine.fail_migration = True
+        try:
+            with self.assertRaises(QEMUMachineError) as context:
+                self.pool.acquire()
+        finally:
+            StandInMachine.fail_migration = False
+        self.assertIn("failed: {'status': 'failed'}", str(context.exception))
+        self.assertTrue(self.machines[-1].shut_down)
+        self.assertTrue(os.path.exists(snapshot))
+
+    def testMigrationTimeout(self):
+        snapshot = self.pool.snapshot
+        StandInMachine.hang_migration = True
+        try:
+            with self.assertRaises(QEMUMachineError) as context:
+                self.pool.acquire()
+        finally:
+            StandInMachine.hang_migration = False
+        self.assertIn("timed out: {'status': 'active'}",
+                      str(context.exception))
+        self.assertTrue(self.machines[-1].shut_down)
+        self.assertTrue(os.path.exists(snapshot))
+
+    def testDisks(self):
+        self.args = ['-drive', 'file=disk.img',
+                     '-blockdev', 'driver=file,filename=a.img,read-only=on',
+                     '-blockdev', '{"driver": "file", "filename": "b.img", '
+                                  '"read-only": true}']
+        vm = self.pool.acquire()
+        self.assertEqual(vm.args[len(self.args):],
+                         ['-snapshot', '-incoming', 'defer'])
+
+        # Writable blockdevs are not covered by -snapshot
+        for blockdev in ('driver=file,filename=c.img',
+                         '{"driver": "file", "filename": "c.img"}'):
+            self.args = ['-blockdev', blockdev]
+            with self.assertRaises(QEMUMachineError):
+                self.pool.acquire()
+
+    def testClose(self):
+        self.pool.fill()
+        snapshot = self.pool.snapshot
+        self.pool.close()
+        self.assertTrue(all(vm.shut_down for vm in self.machines))
+        self.assertFalse(os.path.exists(os.path.dirname(snapshot)))
+
+        # The pool can be used again, with a new snapshot
+        vm = self.pool.acquire()
+        self.assertRestored(vm)
+        self.assertEqual(len(self.booted), 2)
@@ -1,12 +1,22 @@
 import asyncio
-from contextlib import contextmanager
+from contextlib import aclosing, contextmanager
+import json
 import os
 import socket
 from tempfile import TemporaryDirectory
 
 import avocado
 
-from qemu.qmp import ConnectError, Runstate
+from qemu.qmp import (
+    ConnectError,
+    EventListener,
+    ExecInterruptedError,
+    ExecuteError,
+    QMPClient,
+    Runstate,
+)
+from qemu.qmp.message import DeserializationError, Message, _peek_event
+from qemu.qmp.pool import QMPPool, SyncQMPPool
 from qemu.qmp.protocol import AsyncProtocol, StateError
 
 
@@ -109,6 +119,139 @@ async def send_msg(self, msg: str) -> None:
         await self._outgoing.put(msg)
 
 
+class BatchLineProtocol(LineProtocol):
+    """
+    LineProtocol that records the batches of messages it writes.
+    """
+    def __init__(self, name=None):
+        super().__init__(name)
+        self.tx_batches = []
+
+    def _do_send_many(self, msgs) -> None:
+        self.tx_batches.append(list(msgs))
+        super()._do_send_many(msgs)
+
+
+class FakeQMPServer:
+    """
+    A minimal QMP server on a UNIX socket, for testing QMPClient.
+
+    After the greeting, each command is answered with what `handler`
+    returns for it; by default, commands return their arguments. A
+    handler may return None to leave a command unanswered.
+
+    Replies are held back until no command has arrived for `hold_time`
+    seconds, then sent newest first, so that clients see them out of
+    order. `max_outstanding` records the most commands that awaited a
+    reply at once.
+    """
+    GREETING = {
+        'QMP': {
+            'version': {
+                'qemu': {'micro': 0, 'minor': 0, 'major': 9},
+                'package': '',
+            },
+            'capabilities': [],
+        },
+    }
+
+    def __init__(self, path, hold_time=0.01):
+        self.path = path
+        self.hold_time = hold_time
+        self.handler = self.echo
+        self.commands = []
+        self.max_outstanding = 0
+        self.sessions = 0
+        self._server = None
+        self._writer = None
+
+    @staticmethod
+    def echo(cmd):
+        return {'return': cmd.get('arguments', {})}
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._session,
+                                                       self.path)
+
+    async def stop(self):
+        """Stop listening and drop the current client, if any."""
+        self._server.close()
+        await self._server.wait_closed()
+        await self.hangup()
+
+    async def hangup(self):
+        """Drop the current client, if any."""
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._writer = None
+
+    def send(self, msg):
+        """Send a message, given as a dict or as raw bytes."""
+        if not isinstance(msg, bytes):
+            msg = json.dumps(msg).encode()
+        self._writer.write(msg + b'\n')
+
+    def _reply(self, cmd):
+        if cmd.get('execute') == 'qmp_capabilities':
+            reply = {'return': {}}
+        else:
+            reply = self.handler(cmd)
+        if reply is None:
+            return
+        if 'id' in cmd:
+            reply = dict(reply, id=cmd['id'])
+        self.send(reply)
+
+    async def _session(self, reader, writer):
+        self.sessions += 1
+        self._writer = writer
+        self.send(self.GREETING)
+        decoder = json.JSONDecoder()
+        buf = ''
+        held = []
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    reader.read(65536), self.hold_time if held else None)
+            except asyncio.TimeoutError:
+                for cmd in reversed(held):
+                    self._reply(cmd)
+                held = []
+                continue
+            except ConnectionError:
+                break
+            if not data:
+                break
+            buf += data.decode()
+            while True:
+                buf = buf.lstrip()
+                try:
+                    cmd, end = decoder.raw_decode(buf)
+                except ValueError:
+                    # Empty or incomplete command
+                    break
+                buf = buf[end:]
+                if cmd.get('execute') != 'qmp_capabilities':
+                    self.commands.append(cmd)
+                held.append(cmd)
+                self.max_outstanding = max(self.max_outstanding, len(held))
+        writer.close()
+
+
+async def wait_until(predicate, timeout=5.0):
+    """
+    Wait until predicate() is true, polling it.
+    """
+    async def _poll():
+        while not predicate():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(_poll(), timeout)
+
+
 def run_as_task(coro, allow_cancellation=False):
     """
     Run a given coroutine as a task.
@@ -594,3 +737,503 @@ async def testSmoke(self):
             # give the server a chance to start listening [...]
             await asyncio.sleep(0)
             await self.proto.connect(sock)
+
+    @TestBase.async_test
+    async def testSendBatch(self):
+        """Test that queued messages are written together."""
+        self.server = BatchLineProtocol(type(self).__name__ + '-server')
+        self.server._send_batch_max = 2
+        with TemporaryDirectory(suffix='.qmp') as tmpdir:
+            sock = os.path.join(tmpdir, type(self.proto).__name__ + ".sock")
+            server_task = asyncio.create_task(
+                self.server.start_server_and_accept(sock))
+            await asyncio.sleep(0)
+            await self.proto.connect(sock)
+            await server_task
+
+            for msg in ('a', 'b', 'c'):
+                self.server._outgoing.put_nowait(msg)
+            await self.server._outgoing.join()
+
+            self.assertEqual(self.server.tx_batches, [['a', 'b'], ['c']])
+
+
+class QMPSession(TestBase):
+    """
+    Base class for tests of a QMPClient connected to a FakeQMPServer.
+    """
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmpdir = TemporaryDirectory(suffix='.qmp')
+        self.proto = QMPClient(type(self).__name__)
+        self.server = FakeQMPServer(os.path.join(self.tmpdir.name, 'sock'))
+        self.runstate_watcher = None
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmpdir.cleanup()
+
+    async def _asyncSetUp(self):
+        await super()._asyncSetUp()
+        await self.server.start()
+        await self.proto.connect(self.server.path)
+
+    async def _asyncTearDown(self):
+        await self.proto.disconnect()
+        await self.server.stop()
+        await super()._asyncTearDown()
+
+    def _msgs(self, count):
+        return [self.proto.make_execute_msg('test', {'n': i})
+                for i in range(count)]
+
+
+class ExecuteMany(QMPSession):
+
+    @staticmethod
+    def _fail_on(n):
+        def handler(cmd):
+            if cmd['arguments']['n'] == n:
+                return {'error': {'class': 'GenericError',
+                                  'desc': f'failed {n}'}}
+            return FakeQMPServer.echo(cmd)
+        return handler
+
+    @TestBase.async_test
+    async def testOrdered(self):
+        """Test that results come back in order despite reordered replies"""
+        results = await self.proto.execute_many(self._msgs(5))
+        self.assertEqual(results, [{'n': i} for i in range(5)])
+        self.assertEqual(len(self.server.commands), 5)
+
+    @TestBase.async_test
+    async def testAsCompleted(self):
+        """Test that results are yielded in the order replies arrive"""
+        pairs = [pair async for pair in
+                 self.proto.execute_many_as_completed(self._msgs(5))]
+        self.assertEqual(pairs, [(i, {'n': i}) for i in reversed(range(5))])
+
+    @TestBase.async_test
+    async def testWindow(self):
+        """Test that no more than 'window' commands are in flight"""
+        results = await self.proto.execute_many(self._msgs(12), window=3)
+        self.assertEqual(results, [{'n': i} for i in range(12)])
+        self.assertEqual(self.server.max_outstanding, 3)
+
+    @TestBase.async_test
+    async def testBadWindow(self):
+        with self.assertRaises(ValueError):
+            await self.proto.execute_many(self._msgs(1), window=0)
+
+    @TestBase.async_test
+    async def testErrorReturned(self):
+        """Test an error reply partway through a batch, returned in place"""
+        self.server.handler = self._fail_on(2)
+        results = await self.proto.execute_many(self._msgs(5),
+                                                return_exceptions=True)
+        self.assertIsInstance(results[2], ExecuteError)
+        self.assertEqual(str(results[2]), 'failed 2')
+        del results[2]
+        self.assertEqual(results, [{'n': i} for i in (0, 1, 3, 4)])
+
+    @TestBase.async_test
+    async def testErrorRaised(self):
+        """Test an error reply partway through a batch, raised"""
+        self.server.handler = self._fail_on(2)
+        with self.assertRaises(ExecuteError) as context:
+            await self.proto.execute_many(self._msgs(5), window=2)
+        self.assertEqual(context.exception.sent['arguments'], {'n': 2})
+
+        # The whole batch was executed and the client is still usable
+        self.assertEqual(len(self.server.commands), 5)
+        self.assertEqual(await self.proto.execute('test', {'n': 5}),
+                         {'n': 5})
+
+    @TestBase.async_test
+    async def testErrorAsCompleted(self):
+        """Test an error reply partway through a batch, as completed"""
+        self.server.handler = self._fail_on(0)
+        results = dict([pair async for pair in
+                        self.proto.execute_many_as_completed(self._msgs(3))])
+        self.assertIsInstance(results.pop(0), ExecuteError)
+        self.assertEqual(results, {1: {'n': 1}, 2: {'n': 2}})
+
+    @TestBase.async_test
+    async def testStopEarly(self):
+        """Test closing the iterator before all replies have arrived"""
+        async with aclosing(self.proto.execute_many_as_completed(
+                self._msgs(5))) as results:
+            async for index, _ in results:
+                self.assertEqual(index, 4)
+                break
+        self.assertEqual(self.proto._pending, {})
+
+        # Replies to the dropped commands are discarded
+        self.assertEqual(await self.proto.execute('test', {'n': 5}),
+                         {'n': 5})
+
+    @TestBase.async_test
+    async def testAbandonedDisconnect(self):
+        """Test disconnecting while an iterator is neither done nor closed"""
+        results = self.proto.execute_many_as_completed(self._msgs(5))
+        self.assertEqual(await results.__anext__(), (4, {'n': 4}))
+        self.assertNotEqual(self.proto._pending, {})
+
+        await self.proto.disconnect()
+        self.assertEqual(self.proto._pending, {})
+        await results.aclose()
+
+
+class LazyEvents(avocado.Test):
+
+    def testPeekEvent(self):
+        self.assertEqual(_peek_event(b'{"event": "STOP", "data": {}}'),
+                         'STOP')
+        self.assertEqual(_peek_event(b' { "event" : "STOP" } '), 'STOP')
+
+    def testPeekEventTimestampFirst(self):
+        """Test the member order QEMU emits events in"""
+        self.assertEqual(
+            _peek_event(b'{"timestamp": {"seconds": 1, "microseconds": 2},'
+                        b' "event": "STOP", "data": {"a": 1}}'),
+            'STOP')
+
+    def testPeekEventOtherOrders(self):
+        """Test that other member orders are not recognized as events"""
+        for data in (b'{"data": {"event": "NOPE"}, "event": "STOP"}',
+                     b'{"return": {"event": "STOP"}, "id": "1"}',
+                     b'{"timestamp": {"a": {"b": 1}}, "event": "STOP"}',
+                     b'{"event": "ST\\"OP"}',
+                     b'{"id": "1", "event": "STOP"}'):
+            self.assertIsNone(_peek_event(data), data)
+
+    def testLazyMessage(self):
+        """Test that a lazy event is parsed only when its payload is used"""
+        data = b'{"event": "STOP", "data": {"a": 1}}'
+        msg = Message(data, eager=False)
+        self.assertEqual(msg.peeked_event, 'STOP')
+        self.assertIn('event', msg)
+        self.assertEqual(msg['event'], 'STOP')
+        self.assertEqual(msg.peeked_event, 'STOP')
+
+        self.assertEqual(msg['data'], {'a': 1})
+        self.assertIsNone(msg.peeked_event)
+        self.assertEqual(bytes(msg), data)
+
+    def testLazyMalformed(self):
+        """Test that a malformed lazy event fails when its payload is used"""
+        msg = Message(b'{"event": "STOP", "data": {"a": ]}', eager=False)
+        self.assertEqual(msg['event'], 'STOP')
+        with self.assertRaises(DeserializationError):
+            _ = msg['data']
+
+    def testNotLazy(self):
+        """Test that messages that are not events are parsed when read"""
+        msg = Message(b'{"id": "1", "event": "STOP"}', eager=False)
+        self.assertIsNone(msg.peeked_event)
+        self.assertEqual(msg['event'], 'STOP')
+
+
+class EventDelivery(QMPSession):
+
+    @TestBase.async_test
+    async def testMalformedEvent(self):
+        """Test that a malformed event fails only where it is used"""
+        logname = self.proto.logger.name
+        with self.proto.listener('STOP') as listener:
+            # Logging the event must not deserialize it either
+            with self.assertLogs(logname, level='DEBUG') as context:
+                self.server.send(b'{"event": "STOP", "data": {"a": ]}')
+                event = await listener.get()
+            self.assertIn(f'DEBUG:{logname}:<-- {{"event": "STOP", '
+                          '"data": {"a": ]}', context.output)
+            self.assertEqual(event['event'], 'STOP')
+            with self.assertRaises(DeserializationError):
+                _ = event['data']
+
+        # The client is unaffected
+        self.assertEqual(await self.proto.execute('test', {'n': 1}),
+                         {'n': 1})
+
+
+class CountingListener(EventListener):
+    """
+    EventListener with a custom accept() that records the events offered.
+    """
+    def __init__(self, names=None):
+        super().__init__(names)
+        self.offered = []
+
+    def accept(self, event):
+        self.offered.append(event['event'])
+        return super().accept(event)
+
+
+class EventIndex(avocado.Test):
+
+    def setUp(self):
+        self.client = QMPClient(type(self).__name__)
+
+    async def _dispatch(self, *names):
+        for name in names:
+            await self.client._event_dispatch(Message({'event': name}))
+
+    @staticmethod
+    def _heard(listener):
+        return [event['event'] for event in listener.clear()]
+
+    async def testNamed(self):
+        """Test that events only reach listeners for their name"""
+        stop = EventListener('STOP')
+        resume = EventListener(('RESUME', 'RESET'))
+        with self.client.listen(stop, resume):
+            self.assertEqual(
+                self.client._named_listeners,
+                {'STOP': [(stop, True)],
+                 'RESUME': [(resume, True)],
+                 'RESET': [(resume, True)]})
+            await self._dispatch('STOP', 'RESUME', 'OTHER', 'RESET')
+            self.assertEqual(self._heard(stop), ['STOP'])
+            self.assertEqual(self._heard(resume), ['RESUME', 'RESET'])
+        self.assertEqual(self.client._named_listeners, {})
+        self.assertEqual(self._heard(self.client.events),
+                         ['STOP', 'RESUME', 'OTHER', 'RESET'])
+
+    async def testWildcard(self):
+        """Test that listeners with a custom accept() see every event"""
+        listener = CountingListener('STOP')
+        with self.client.listen(listener):
+            self.assertIn((listener, True), self.client._wildcard_listeners)
+            await self._dispatch('STOP', 'OTHER')
+            self.assertEqual(listener.offered, ['STOP', 'OTHER'])
+            self.assertEqual(self._heard(listener), ['STOP'])
+        self.assertNotIn((listener, True), self.client._wildcard_listeners)
+
+    async def testNowait(self):
+        """Test which listeners take the non-awaiting path"""
+        class PutListener(EventListener):
+            async def put(self, event):
+                self.put_called = True
+                await super().put(event)
+
+        plain = EventListener('STOP')
+        bounded = EventListener('STOP')
+        bounded._queue = asyncio.Queue(maxsize=1)
+        custom = PutListener('STOP')
+        with self.client.listen(plain, bounded, custom):
+            self.assertEqual(self.client._named_listeners['STOP'],
+                             [(plain, True), (bounded, False),
+                              (custom, False)])
+            await self._dispatch('STOP')
+            self.assertTrue(custom.put_called)
+            for listener in (plain, bounded, custom):
+                self.assertEqual(self._heard(listener), ['STOP'])
+
+    async def testNamesChanged(self):
+        """Test that changing the names of a listener updates the index"""
+        listener = EventListener('STOP')
+        with self.client.listen(listener):
+            listener.names.add('RESUME')
+            listener.names.discard('STOP')
+            await self._dispatch('STOP', 'RESUME')
+            self.assertEqual(self._heard(listener), ['RESUME'])
+
+            listener.names |= {'RESET'}
+            listener.names -= {'RESUME'}
+            await self._dispatch('RESUME', 'RESET')
+            self.assertEqual(self._heard(listener), ['RESET'])
+
+            listener.names = {'STOP'}
+            await self._dispatch('RESET', 'STOP')
+            self.assertEqual(self._heard(listener), ['STOP'])
+            self.assertEqual(set(self.client._named_listeners), {'STOP'})
+
+            # No names: listen to everything
+            listener.names.clear()
+            await self._dispatch('RESET', 'STOP')
+            self.assertEqual(self._heard(listener), ['RESET', 'STOP'])
+
+        # Changes after removal do not register the listener again
+        listener.names.add('STOP')
+        await self._dispatch('STOP')
+        self.assertEqual(self._heard(listener), [])
+        self.assertEqual(self.client._named_listeners, {})
+        self.assertNotIn((listener, True), self.client._wildcard_listeners)
+
+
+class Pool(avocado.Test):
+
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmpdir = TemporaryDirectory(suffix='.qmp')
+        self.servers = {}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _server(self, name):
+        path = os.path.join(self.tmpdir.name, name)
+        self.servers[name] = FakeQMPServer(path)
+        return self.servers[name]
+
+    async def _start(self, pool, *names):
+        for name in names:
+            server = self._server(name)
+            await server.start()
+            await pool.add(name, server.path)
+        await pool.wait_connected(timeout=5)
+
+    async def _stop_servers(self):
+        for server in self.servers.values():
+            await server.stop()
+
+    async def testExecute(self):
+        """Test fanning out a command"""
+        async with QMPPool() as pool:
+            await self._start(pool, 'a', 'b', 'c')
+            result = await pool.execute('test', {'n': 1}, names=['a', 'c'])
+            self.assertEqual(result.results, {'a': {'n': 1}, 'c': {'n': 1}})
+            self.assertEqual(result.errors, {})
+        await self._stop_servers()
+
+    async def testErrors(self):
+        """Test that errors are collected per member"""
+        async with QMPPool(connect_timeout=0.1) as pool:
+            await self._start(pool, 'ok', 'failing', 'silent')
+            self.servers['failing'].handler = lambda cmd: {
+                'error': {'class': 'GenericError', 'desc': 'failed'}}
+            self.servers['silent'].handler = lambda cmd: None
+            await pool.add('absent',
+                           os.path.join(self.tmpdir.name, 'absent'))
+
+            result = await pool.execute('test', {'n': 1}, timeout=0.5)
+            self.assertEqual(result.results, {'ok': {'n': 1}})
+            self.assertEqual(set(result.errors),
+                             {'failing', 'silent', 'absent'})
+            self.assertIsInstance(result.errors['failing'], ExecuteError)
+            self.assertIsInstance(result.errors['silent'],
+                                  asyncio.TimeoutError)
+            self.assertIsInstance(result.errors['absent'], ConnectError)
+            # Why the last connection attempt failed
+            last_error = result.errors['absent'].exc
+            self.assertIsInstance(last_error, ConnectError)
+            self.assertIsInstance(last_error.exc, OSError)
+        await self._stop_servers()
+
+    async def testConcurrency(self):
+        """Test that max_concurrency bounds the commands in flight"""
+        names = ['vm0', 'vm1', 'vm2', 'vm3', 'vm4']
+        async with QMPPool() as pool:
+            await self._start(pool, *names)
+            for server in self.servers.values():
+                server.handler = lambda cmd: None
+
+            def received():
+                return [cmd for server in self.servers.values()
+                        for cmd in server.commands]
+
+            task = asyncio.create_task(
+                pool.execute('test', max_concurrency=2))
+            for count in (2, 4, 5):
+                await wait_until(lambda: len(received()) == count)
+                # Give the pool a chance to exceed the limit
+                await asyncio.sleep(0.05)
+                self.assertEqual(len(received()), count)
+                for server in self.servers.values():
+                    for cmd in server.commands:
+                        if not cmd.get('answered'):
+                            cmd['answered'] = True
+                            server.send({'return': {}, 'id': cmd['id']})
+
+            result = await task
+            self.assertEqual(set(result.results), set(names))
+        await self._stop_servers()
+
+    async def testReconnect(self):
+        """Test that members reconnect after losing the connection"""
+        async with QMPPool(backoff=0.01) as pool:
+            await self._start(pool, 'vm')
+            server = self.servers['vm']
+            server.handler = lambda cmd: None
+            task = asyncio.create_task(pool.execute('test'))
+            await wait_until(lambda: server.commands)
+            await server.hangup()
+
+            result = await task
+            self.assertIsInstance(result.errors['vm'], ExecInterruptedError)
+
+            server.handler = server.echo
+            await wait_until(lambda: server.sessions == 2)
+            result = await pool.execute('test', {'n': 2})
+            self.assertEqual(result.results, {'vm': {'n': 2}})
+        await self._stop_servers()
+
+    async def testBackoff(self):
+        """Test that the reconnection delay doubles up to max_backoff"""
+        server = self._server('vm')
+        logname = QMPPool.logger.name
+        async with QMPPool(backoff=0.01, max_backoff=0.04) as pool:
+            with self.assertLogs(logname, level='DEBUG') as context:
+                await pool.add('vm', server.path)
+                await wait_until(lambda: len(context.output) >= 5)
+            delays = [line.rsplit(' ', 1)[1] for line in context.output[:5]]
+            self.assertEqual(delays,
+                             ['0.01s', '0.02s', '0.04s', '0.04s', '0.04s'])
+            self.assertFalse(pool.is_connected('vm'))
+
+            await server.start()
+            await pool.wait_connected(timeout=5)
+            self.assertTrue(pool.is_connected('vm'))
+        await self._stop_servers()
+
+    async def testFlapping(self):
+        """Test the delay before reconnecting after a lost connection"""
+        logname = QMPPool.logger.name
+        async with QMPPool(backoff=0.01, max_backoff=0.5) as pool:
+            await self._start(pool, 'vm')
+            server = self.servers['vm']
+
+            def delays(output):
+                return [line.rsplit(' ', 1)[1] for line in output
+                        if 'reconnecting' in line]
+
+            # A server that drops connections right away
+            with self.assertLogs(logname, level='DEBUG') as context:
+                for sessions in range(2, 6):
+                    await server.hangup()
+                    await wait_until(lambda n=sessions: (
+                        server.sessions == n and pool.is_connected('vm')))
+            self.assertEqual(delays(context.output),
+                             ['0.01s', '0.02s', '0.04s', '0.08s'])
+
+            # A connection that stayed up resets the delay
+            await asyncio.sleep(0.5)
+            with self.assertLogs(logname, level='DEBUG') as context:
+                await server.hangup()
+                await wait_until(lambda: server.sessions == 6)
+            self.assertEqual(delays(context.output), ['0.01s'])
+        await self._stop_servers()
+
+    def testSync(self):
+        """Test the synchronous facade"""
+        with SyncQMPPool() as pool:
+            # Run the servers on the loop of the pool
+            for name in ('a', 'b'):
+                server = self._server(name)
+                pool._sync(server.start())
+                pool.add(name, server.path)
+            pool.wait_connected(timeout=5)
+            self.assertEqual(pool.names, ['a', 'b'])
+
+            result = pool.cmd('test', {'n': 1, 'names': 'x'})
+            self.assertEqual(result.results,
+                             {'a': {'n': 1, 'names': 'x'},
+                              'b': {'n': 1, 'names': 'x'}})
+            result = pool.cmd('test', names=['a'])
+            self.assertEqual(result.results, {'a': {}})
+            result = pool.execute('test', {'n': 2}, names=['b'])
+            self.assertEqual(result.results, {'b': {'n': 2}})
+
+            pool.remove('a')
+            self.assertEqual(pool.names, ['b'])
+            pool._sync(self._stop_servers())
@@ -0,0 +1,232 @@
+import io
+from unittest import mock
+
+import avocado
+
+from qemu.qmp import ExecuteError, QMPError
+from qemu.qmp.message import Message
+from qemu.qmp.models import ErrorResponse
+from qemu.utils.qom_common import QOMCache, QOMSnapshot
+
+
+def prop(name, type_, value=None):
+    item = {'name': name, 'type': type_}
+    if value is not None:
+        item['value'] = value
+    return item
+
+
+TREE = {
+    '/': [prop('type', 'string', 'container'),
+          prop('machine', 'child<pc-machine>')],
+    '/machine': [prop('type', 'string', 'pc-machine'),
+                 prop('unattached', 'child<container>'),
+                 prop('peripheral', 'child<container>'),
+                 prop('kernel', 'string', '')],
+    '/machine/unattached': [prop('device[0]', 'child<cpu>')],
+    '/machine/unattached/device[0]': [prop('realized', 'bool', True)],
+    '/machine/peripheral': [],
+}
+
+
+class StubQMP:
+    """
+    StubQMP is a test mockup of `QEMUMonitorProtocol.cmd` for a QOM tree.
+
+    Like QEMU, ``qom-list-get`` fails as a whole if any of the paths is
+    not an object.  Every command sent is recorded in 'sent'.
+    """
+    def __init__(self, tree):
+        self.tree = dict(tree)
+        self.sent = []
+
+    def __call__(self, cmd, **args):
+        self.sent.append((cmd, args))
+        if cmd == 'qom-list-get':
+            for path in args['paths']:
+                if path not in self.tree:
+                    msg = Message({'execute': cmd, 'arguments': args})
+                    error = Message({'error': {
+                        'class': 'DeviceNotFound',
+                        'desc': f"Device '{path}' not found",
+                    }})
+                    raise ExecuteError(ErrorResponse(error), msg, error)
+            return [{'properties': self.tree[path]}
+                    for path in args['paths']]
+        if cmd == 'qom-list-types':
+            return [{'name': 'pc-machine'}]
+        raise AssertionError(f"unexpected command {cmd}")
+
+    def listed(self):
+        return [args['paths'] for cmd, args in self.sent
+                if cmd == 'qom-list-get']
+
+
+class Clock:
+    """A stand-in for the time module, whose clock only moves on demand."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Cache(avocado.Test):
+
+    def setUp(self):
+        self.qmp = StubQMP(TREE)
+        self.clock = Clock()
+        patcher = mock.patch('qemu.utils.qom_common.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testProperties(self):
+        cache = QOMCache(self.qmp)
+        props = cache.properties('/machine')
+        self.assertEqual([p.name for p in props],
+                         ['type', 'unattached', 'peripheral', 'kernel'])
+        self.assertEqual(props[0].value, 'pc-machine')
+        self.assertTrue(props[1].child)
+        self.assertEqual(cache.lookup('/machine/kernel').value, '')
+        self.assertIsNone(cache.lookup('/machine/absent'))
+        self.assertEqual(cache.lookup('/machine').type, 'child<pc-machine>')
+        self.assertEqual(self.qmp.listed(), [['/machine'], ['/']])
+
+    def testTTL(self):
+        cache = QOMCache(self.qmp, ttl=1.0)
+        cache.properties('/machine')
+        self.clock.now += 1.0
+        cache.properties('/machine')
+        self.assertEqual(len(self.qmp.listed()), 1)
+
+        self.clock.now += 0.5
+        cache.properties('/machine')
+        self.assertEqual(len(self.qmp.listed()), 2)
+
+        # Without a TTL, listings stay until invalidated
+        cache.ttl = None
+        self.clock.now += 100
+        cache.properties('/machine')
+        self.assertEqual(len(self.qmp.listed()), 2)
+        cache.invalidate('/machine')
+        cache.properties('/machine')
+        self.assertEqual(len(self.qmp.listed()), 3)
+
+    def testNegative(self):
+        cache = QOMCache(self.qmp, ttl=1.0)
+        self.assertIsNone(cache.properties('/absent'))
+        self.assertIsNone(cache.properties('/absent'))
+        self.assertEqual(self.qmp.listed(), [['/absent']])
+
+        # The object appears; the cache only notices once the miss expires
+        self.qmp.tree['/absent'] = []
+        self.assertIsNone(cache.properties('/absent'))
+        self.clock.now += 2
+        self.assertEqual(cache.properties('/absent'), [])
+        self.assertEqual(len(self.qmp.listed()), 2)
+
+        # And the other way round
+        del self.qmp.tree['/absent']
+        self.clock.now += 2
+        self.assertIsNone(cache.properties('/absent'))
+        self.assertNotIn('/absent', cache.snapshot.objects)
+
+    def testFallback(self):
+        cache = QOMCache(self.qmp)
+        cache.fetch(['/', '/gone', '/machine'])
+        self.assertEqual(self.qmp.listed(), [['/', '/gone', '/machine'],
+                                             ['/'], ['/gone'], ['/machine']])
+        self.assertEqual(sorted(cache.snapshot.objects), ['/', '/machine'])
+        self.assertIsNone(cache.properties('/gone'))
+        self.assertEqual(len(self.qmp.listed()), 4)
+
+    def testBatches(self):
+        cache = QOMCache(self.qmp, batch_size=2)
+        paths = sorted(TREE)
+        cache.fetch(paths[:1])
+        cache.fetch(paths)
+        self.assertEqual(self.qmp.listed(),
+                         [paths[:1], paths[1:3], paths[3:5]])
+
+    def testCrawl(self):
+        cache = QOMCache(self.qmp, batch_size=2)
+        snapshot = cache.crawl()
+        self.assertEqual(sorted(snapshot.objects), sorted(TREE))
+        # A tree level at a time, in batches
+        self.assertEqual(self.qmp.listed(), [
+            ['/'],
+            ['/machine'],
+            ['/machine/unattached', '/machine/peripheral'],
+            ['/machine/unattached/device[0]'],
+        ])
+
+        cache = QOMCache(StubQMP(TREE))
+        snapshot = cache.crawl('/machine/unattached')
+        self.assertEqual(sorted(snapshot.objects),
+                         ['/machine/unattached',
+                          '/machine/unattached/device[0]'])
+        with self.assertRaises(QMPError):
+            cache.crawl('/absent')
+
+    def testCmd(self):
+        cache = QOMCache(self.qmp)
+        self.assertEqual(cache.cmd('qom-list-types', abstract=True),
+                         [{'name': 'pc-machine'}])
+        cache.cmd('qom-list-types', abstract=True)
+        cache.invalidate()
+        cache.cmd('qom-list-types', abstract=True)
+        self.assertEqual(self.qmp.sent,
+                         [('qom-list-types', {'abstract': True})])
+
+        cache.cmd('qom-list-types', abstract=False)
+        self.assertEqual(len(self.qmp.sent), 2)
+
+    def testOffline(self):
+        cache = QOMCache(self.qmp)
+        cache.crawl('/machine/unattached')
+        cache.cmd('qom-list-types')
+
+        offline = QOMCache(None, snapshot=cache.snapshot)
+        self.clock.now += 100
+        offline.invalidate()
+        self.assertTrue(offline.lookup('/machine/unattached/device[0]/'
+                                       'realized').value)
+        self.assertIsNone(offline.properties('/machine'))
+        self.assertEqual(offline.cmd('qom-list-types'),
+                         [{'name': 'pc-machine'}])
+        with self.assertRaises(QMPError):
+            offline.cmd('qom-list-types', abstract=True)
+
+
+class Snapshot(avocado.Test):
+
+    def testRoundTrip(self):
+        cache = QOMCache(StubQMP(TREE))
+        snapshot = cache.crawl()
+        cache.cmd('qom-list-types', abstract=True)
+        snapshot.info['version'] = '9.0.0'
+
+        for copy in (QOMSnapshot.from_dict(snapshot.to_dict()),
+                     self.dumped(snapshot)):
+            self.assertEqual(copy.to_dict(), snapshot.to_dict())
+            self.assertEqual(copy.info, {'version': '9.0.0'})
+            props = copy.objects['/machine/unattached/device[0]']
+            self.assertEqual((props[0].name, props[0].type, props[0].value),
+                             ('realized', 'bool', True))
+            self.assertEqual(
+                copy.replies[QOMSnapshot.reply_key('qom-list-types',
+                                                   {'abstract': True})],
+                [{'name': 'pc-machine'}])
+
+    def testEmpty(self):
+        snapshot = QOMSnapshot.from_dict({})
+        self.assertEqual(snapshot.to_dict(),
+                         {'info': {}, 'objects': {}, 'replies': {}})
+        self.assertEqual(self.dumped(snapshot).to_dict(), snapshot.to_dict())
+
+    @staticmethod
+    def dumped(snapshot):
+        file = io.StringIO()
+        snapshot.dump(file)
+        file.seek(0)
+        return QOMSnapshot.load(file)
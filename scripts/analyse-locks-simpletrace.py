@@ -9,7 +9,7 @@
 import argparse
 import numpy as np
 
-class MutexAnalyser(simpletrace.Analyzer):
+class MutexAnalyser(simpletrace.Analyzer2):
     "A simpletrace Analyser for checking locks."
 
     def __init__(self):
@@ -20,45 +20,88 @@ def __init__(self):
 
     def _get_mutex(self, mutex):
         if not mutex in self.mutex_records:
+            # lock_time/locked_time are None until seen in this slice of
+            # the trace; events that need them are kept pending for merge()
             self.mutex_records[mutex] = {"locks": 0,
-                                         "lock_time": 0,
+                                         "lock_time": None,
                                          "acquire_times": [],
                                          "locked": 0,
-                                         "locked_time": 0,
+                                         "locked_time": None,
                                          "held_times": [],
-                                         "unlocked": 0}
+                                         "unlocked": 0,
+                                         "pending_locked": None,
+                                         "pending_unlock": None}
 
         return self.mutex_records[mutex]
 
-    def qemu_mutex_lock(self, timestamp, mutex, filename, line):
+    def qemu_mutex_lock(self, mutex, filename, line, *, timestamp_ns, **kwargs):
         self.locks += 1
         rec = self._get_mutex(mutex)
         rec["locks"] += 1
-        rec["lock_time"] = timestamp[0]
+        rec["lock_time"] = timestamp_ns
         rec["lock_loc"] = (filename, line)
 
-    def qemu_mutex_locked(self, timestamp, mutex, filename, line):
+    def qemu_mutex_locked(self, mutex, filename, line, *, timestamp_ns, **kwargs):
         self.locked += 1
         rec = self._get_mutex(mutex)
         rec["locked"] += 1
-        rec["locked_time"] = timestamp[0]
-        acquire_time = rec["locked_time"] - rec["lock_time"]
+        if rec["lock_time"] is None:
+            if rec["pending_locked"] is None:
+                rec["pending_locked"] = timestamp_ns
+        else:
+            rec["acquire_times"].append(timestamp_ns - rec["lock_time"])
+        rec["locked_time"] = timestamp_ns
         rec["locked_loc"] = (filename, line)
-        rec["acquire_times"].append(acquire_time)
 
-    def qemu_mutex_unlock(self, timestamp, mutex, filename, line):
+    def qemu_mutex_unlock(self, mutex, filename, line, *, timestamp_ns, **kwargs):
         self.unlocks += 1
         rec = self._get_mutex(mutex)
         rec["unlocked"] += 1
-        held_time = timestamp[0] - rec["locked_time"]
-        rec["held_times"].append(held_time)
+        if rec["locked_time"] is None:
+            if rec["pending_unlock"] is None:
+                rec["pending_unlock"] = timestamp_ns
+        else:
+            rec["held_times"].append(timestamp_ns - rec["locked_time"])
         rec["unlock_loc"] = (filename, line)
 
+    def merge(self, other):
+        self.locks += other.locks
+        self.locked += other.locked
+        self.unlocks += other.unlocks
+
+        for mutex, orec in other.mutex_records.items():
+            rec = self._get_mutex(mutex)
+
+            # Resolve events of @other whose lock/locked came before it
+            if orec["pending_locked"] is not None:
+                if rec["lock_time"] is not None:
+                    rec["acquire_times"].append(orec["pending_locked"] - rec["lock_time"])
+                elif rec["pending_locked"] is None:
+                    rec["pending_locked"] = orec["pending_locked"]
+            if orec["pending_unlock"] is not None:
+                if rec["locked_time"] is not None:
+                    rec["held_times"].append(orec["pending_unlock"] - rec["locked_time"])
+                elif rec["pending_unlock"] is None:
+                    rec["pending_unlock"] = orec["pending_unlock"]
+
+            for key in ("locks", "locked", "unlocked"):
+                rec[key] += orec[key]
+            rec["acquire_times"].extend(orec["acquire_times"])
+            rec["held_times"].extend(orec["held_times"])
+            for key in ("lock_time", "locked_time"):
+                if orec[key] is not None:
+                    rec[key] = orec[key]
+            for key in ("lock_loc", "locked_loc", "unlock_loc"):
+                if key in orec:
+                    rec[key] = orec[key]
+
 
 def get_args():
     "Grab options"
     parser = argparse.ArgumentParser()
     parser.add_argument("--output", "-o", type=str, help="Render plot to file")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of worker processes (default 1)")
     parser.add_argument("events", type=str, help='trace file read from')
     parser.add_argument("tracefile", type=str, help='trace file read from')
     return parser.parse_args()
@@ -67,8 +110,12 @@ def get_args():
     args = get_args()
 
     # Gather data from the trace
-    analyser = MutexAnalyser()
-    simpletrace.process(args.events, args.tracefile, analyser)
+    if args.jobs > 1:
+        analyser = simpletrace.process_sharded(args.events, args.tracefile,
+                                               MutexAnalyser, jobs=args.jobs)
+    else:
+        analyser = MutexAnalyser()
+        simpletrace.process(args.events, args.tracefile, analyser)
 
     print ("Total locks: %d, locked: %d, unlocked: %d" %
            (analyser.locks, analyser.locked, analyser.unlocks))
@@ -22,8 +22,10 @@
 import math
 import argparse
 import collections
+import concurrent.futures
 import struct
 import sys
+from array import array
 
 
 def mkdir_p(path):
@@ -33,6 +35,72 @@ def mkdir_p(path):
         pass
 
 
+def bitmap_runs(bitmap, num_pages):
+    """Return (first_page, num_pages) for each run of set bits in bitmap,
+    where bit N is bit N % 8 of byte N // 8."""
+    words = array('Q', bytes(bitmap) + bytes(-len(bitmap) % 8))
+    if sys.byteorder == 'big':
+        words.byteswap()
+
+    runs = []
+    start = None
+    all_ones = (1 << 64) - 1
+    for i, word in enumerate(words):
+        base = i * 64
+        if word == 0:
+            if start is not None:
+                runs.append((start, base - start))
+                start = None
+        elif word == all_ones:
+            if start is None:
+                start = base
+        else:
+            for bit in range(64):
+                if (word >> bit) & 1:
+                    if start is None:
+                        start = base + bit
+                elif start is not None:
+                    runs.append((start, base + bit - start))
+                    start = None
+    if start is not None:
+        runs.append((start, len(words) * 64 - start))
+
+    # Ignore any padding bits past the end of the RAM block
+    result = []
+    for first, count in runs:
+        if first >= num_pages:
+            break
+        result.append((first, min(count, num_pages - first)))
+    return result
+
+def copy_range(src_fd, src_offset, dst_fd, dst_offset, length,
+               block_size = 64 * 1024 * 1024):
+    """Copy length bytes between two file descriptors, in large blocks."""
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    while length > 0:
+        n = min(length, block_size)
+        copied = 0
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, n,
+                                            src_offset, dst_offset)
+            except OSError:
+                # e.g. not supported between these file systems
+                use_copy_file_range = False
+        if not copied:
+            data = os.pread(src_fd, n, src_offset)
+            if not data:
+                raise Exception("Unexpected end of migration stream at 0x%x"
+                                % src_offset)
+            copied = len(data)
+            view = memoryview(data)
+            done = 0
+            while done < copied:
+                done += os.pwrite(dst_fd, view[done:], dst_offset + done)
+        src_offset += copied
+        dst_offset += copied
+        length -= copied
+
 class MigrationFile(object):
     def __init__(self, filename):
         self.filename = filename
@@ -129,6 +197,9 @@ def __init__(self, file, version_id, ramargs, section_key):
         self.write_memory = ramargs['write_memory']
         self.ignore_shared = ramargs['ignore_shared']
         self.mapped_ram = ramargs['mapped_ram']
+        self.jobs = ramargs.get('jobs')
+        self.executor = None
+        self.copies = []
         self.sizeinfo = collections.OrderedDict()
         self.data = collections.OrderedDict()
         self.data['section sizes'] = self.sizeinfo
@@ -166,7 +237,9 @@ def parseMappedRamBlob(self, len):
             # for it.
             return
 
-        if self.dump_memory or self.write_memory:
+        if self.write_memory and not self.dump_memory:
+            self.extractMappedRam(bitmap_offset, pages_offset, len)
+        elif self.dump_memory or self.write_memory:
             num_pages = len // page_size
 
             self.file.seek(bitmap_offset, os.SEEK_SET)
@@ -199,6 +272,41 @@ def parseMappedRamBlob(self, len):
 
         self.file.seek(pages_offset + len, os.SEEK_SET)
 
+    def extractMappedRam(self, bitmap_offset, pages_offset, len):
+        # Only pages that are set in the bitmap are present in the file;
+        # the others are zero, and are left as holes in the output file,
+        # which has already been truncated to the size of the RAM block.
+        page_size = self.TARGET_PAGE_SIZE
+        num_pages = len // page_size
+
+        self.file.seek(bitmap_offset, os.SEEK_SET)
+        bitmap = self.file.readvar(size=int(math.ceil(num_pages / 8)))
+        runs = bitmap_runs(bitmap, num_pages)
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.jobs)
+        self.copies.append(self.executor.submit(
+            self.copyRuns, self.files[self.name].fileno(), pages_offset, runs))
+
+    def copyRuns(self, dst_fd, pages_offset, runs):
+        src_fd = self.file.file.fileno()
+        page_size = self.TARGET_PAGE_SIZE
+        for first, count in runs:
+            copy_range(src_fd, pages_offset + first * page_size,
+                       dst_fd, first * page_size, count * page_size)
+
+    def finishCopies(self):
+        # Wait for the RAM blocks being extracted in the background
+        if self.executor is None:
+            return
+        try:
+            for future in self.copies:
+                future.result()
+        finally:
+            self.copies = []
+            self.executor.shutdown()
+            self.executor = None
+
     def read(self):
         # Read all RAM sections
         while True:
@@ -265,12 +373,15 @@ def read(self):
 
             # End of RAM section
             if flags & self.RAM_SAVE_FLAG_EOS:
+                self.finishCopies()
                 break
 
             if flags != 0:
                 raise Exception("Unknown RAM flags: %x" % flags)
 
     def __del__(self):
+        if self.executor is not None:
+            self.finishCopies()
         if self.write_memory:
             for key in self.files:
                 self.files[key].close()
@@ -687,7 +798,7 @@ def __init__(self, filename):
         self.vmsd_json = ""
 
     def read(self, desc_only = False, dump_memory = False,
-             write_memory = False):
+             write_memory = False, jobs = None):
         # Read in the whole file
         file = MigrationFile(self.filename)
         self.vmsd_json = file.read_migration_debug_json()
@@ -716,6 +827,7 @@ def read(self, desc_only = False, dump_memory = False,
         ramargs['write_memory'] = write_memory
         ramargs['ignore_shared'] = False
         ramargs['mapped_ram'] = False
+        ramargs['jobs'] = jobs
         self.section_classes[('ram',0)][1] = ramargs
 
         while True:
@@ -788,6 +900,7 @@ def default(self, o):
 parser.add_argument("-m", "--memory", help='dump RAM contents as well', action='store_true')
 parser.add_argument("-d", "--dump", help='what to dump ("state" or "desc")', default='state')
 parser.add_argument("-x", "--extract", help='extract contents into individual files', action='store_true')
+parser.add_argument("-j", "--jobs", help='number of RAM blocks to extract in parallel (mapped-ram only)', type=int)
 args = parser.parse_args()
 
 jsonenc = JSONEncoder(indent=4, separators=(',', ': '))
@@ -807,7 +920,7 @@ def default(self, o):
         f.write(jsonenc.encode(dump.vmsd_desc))
         f.close()
 
-        dump.read(write_memory = True)
+        dump.read(write_memory = True, jobs = args.jobs)
         dict = dump.getDict()
         print("state.json")
         f = open("state.json", "w")
@@ -4,6 +4,7 @@
 #
 """Delete stale assets from the download cache of the functional tests"""
 
+import fcntl
 import os
 import stat
 import sys
@@ -23,9 +24,45 @@
 
 os.chdir(cache_dir)
 
-for file in cache_dir.iterdir():
+# Files next to an asset, with the same name and these suffixes
+SIDECARS = (".stamp", ".verified")
+
+
+def remove(file):
+    print(f"Removing {cache_dir}/{file.name}.")
+    file.chmod(stat.S_IWRITE)
+    file.unlink()
+
+
+def remove_partial(file):
+    """Remove a partial download, unless it is being downloaded to"""
+    with file.open("ab") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        remove(file)
+
+
+for file in sorted(cache_dir.iterdir()):
     # Only consider the files that use a sha256 as filename:
-    if len(file.name) != 64:
+    if len(file.stem) != 64:
+        continue
+
+    if file.suffix == ".download":
+        # Partial downloads are kept to be resumed; expire them after a
+        # week without progress
+        if time.time() - file.stat().st_mtime > 7 * 24 * 60 * 60:
+            remove_partial(file)
+        continue
+
+    if file.suffix in SIDECARS:
+        # Left behind by an asset that is gone
+        if file.exists() and not file.with_suffix("").exists():
+            remove(file)
+        continue
+
+    if file.suffix:
         continue
 
     try:
@@ -40,6 +77,8 @@
 
     # Delete files older than half of a year (183 days * 24h * 60m * 60s)
     if age > 15811200:
-        print(f"Removing {cache_dir}/{file.name}.")
-        file.chmod(stat.S_IWRITE)
-        file.unlink()
+        remove(file)
+        for suffix in SIDECARS:
+            sidecar = file.with_suffix(suffix)
+            if sidecar.exists():
+                remove(sidecar)
@@ -37,6 +37,7 @@
     qemu_dir = path.abspath(path.dirname(path.dirname(__file__)))
     sys.path.append(path.join(qemu_dir, 'python'))
     from qemu.machine import QEMUMachine
+    from qemu.utils.qom_common import QOMCache, QOMSnapshot
 except ModuleNotFoundError as exc:
     print(f"Module '{exc.name}' not found.")
     print("Try export PYTHONPATH=top-qemu-dir/python or run from top-qemu-dir")
@@ -58,8 +59,8 @@
 #   'x86_64-cpu', method of 'x86_64-cpu' will be used for '486-x86_64-cpu')
 
 class Driver():
-    def __init__(self, vm: QEMUMachine, name: str, abstract: bool) -> None:
-        self.vm = vm
+    def __init__(self, qom: QOMCache, name: str, abstract: bool) -> None:
+        self.qom = qom
         self.name = name
         self.abstract = abstract
         self.parent: Optional[Driver] = None
@@ -86,8 +87,8 @@ def set_implementations(self, implementations: List['Driver']) -> None:
 
 
 class QEMUObject(Driver):
-    def __init__(self, vm: QEMUMachine, name: str) -> None:
-        super().__init__(vm, name, True)
+    def __init__(self, qom: QOMCache, name: str) -> None:
+        super().__init__(qom, name, True)
 
     def set_implementations(self, implementations: List[Driver]) -> None:
         self.implementations = implementations
@@ -103,14 +104,14 @@ def set_implementations(self, implementations: List[Driver]) -> None:
 
 
 class QEMUDevice(QEMUObject):
-    def __init__(self, vm: QEMUMachine) -> None:
-        super().__init__(vm, 'device')
+    def __init__(self, qom: QOMCache) -> None:
+        super().__init__(qom, 'device')
         self.cached: Dict[str, List[Dict[str, Any]]] = {}
 
     def get_prop(self, driver: str, prop_name: str) -> str:
         if driver not in self.cached:
-            self.cached[driver] = self.vm.cmd('device-list-properties',
-                                              typename=driver)
+            self.cached[driver] = self.qom.cmd('device-list-properties',
+                                               typename=driver)
         for prop in self.cached[driver]:
             if prop['name'] == prop_name:
                 return str(prop.get('default-value', 'No default value'))
@@ -119,8 +120,8 @@ def get_prop(self, driver: str, prop_name: str) -> str:
 
 
 class QEMUx86CPU(QEMUObject):
-    def __init__(self, vm: QEMUMachine) -> None:
-        super().__init__(vm, 'x86_64-cpu')
+    def __init__(self, qom: QOMCache) -> None:
+        super().__init__(qom, 'x86_64-cpu')
         self.cached: Dict[str, Dict[str, Any]] = {}
 
     def get_prop(self, driver: str, prop_name: str) -> str:
@@ -130,7 +131,7 @@ def get_prop(self, driver: str, prop_name: str) -> str:
         # crop last 11 chars '-x86_64-cpu'
         name = driver[:-11]
         if name not in self.cached:
-            self.cached[name] = self.vm.cmd(
+            self.cached[name] = self.qom.cmd(
                 'query-cpu-model-expansion', type='full',
                 model={'name': name})['model']['props']
         return str(self.cached[name].get(prop_name, 'Unknown property'))
@@ -139,14 +140,14 @@ def get_prop(self, driver: str, prop_name: str) -> str:
 # Now it's stub, because all memory_backend types don't have default values
 # but this behaviour can be changed
 class QEMUMemoryBackend(QEMUObject):
-    def __init__(self, vm: QEMUMachine) -> None:
-        super().__init__(vm, 'memory-backend')
+    def __init__(self, qom: QOMCache) -> None:
+        super().__init__(qom, 'memory-backend')
         self.cached: Dict[str, List[Dict[str, Any]]] = {}
 
     def get_prop(self, driver: str, prop_name: str) -> str:
         if driver not in self.cached:
-            self.cached[driver] = self.vm.cmd('qom-list-properties',
-                                              typename=driver)
+            self.cached[driver] = self.qom.cmd('qom-list-properties',
+                                               typename=driver)
         for prop in self.cached[driver]:
             if prop['name'] == prop_name:
                 return str(prop.get('default-value', 'No default value'))
@@ -154,41 +155,56 @@ def get_prop(self, driver: str, prop_name: str) -> str:
         return 'Unknown property'
 
 
-def new_driver(vm: QEMUMachine, name: str, is_abstr: bool) -> Driver:
+def new_driver(qom: QOMCache, name: str, is_abstr: bool) -> Driver:
     if name == 'object':
-        return QEMUObject(vm, 'object')
+        return QEMUObject(qom, 'object')
     elif name == 'device':
-        return QEMUDevice(vm)
+        return QEMUDevice(qom)
     elif name == 'x86_64-cpu':
-        return QEMUx86CPU(vm)
+        return QEMUx86CPU(qom)
     elif name == 'memory-backend':
-        return QEMUMemoryBackend(vm)
+        return QEMUMemoryBackend(qom)
     else:
-        return Driver(vm, name, is_abstr)
+        return Driver(qom, name, is_abstr)
 # End of methods definition
 
 
 class VMPropertyGetter:
     """It implements the relationship between drivers and how to get their
     properties"""
-    def __init__(self, vm: QEMUMachine) -> None:
+    def __init__(self, qom: QOMCache) -> None:
         self.drivers: Dict[str, Driver] = {}
 
-        qom_all_types = vm.cmd('qom-list-types', abstract=True)
-        self.drivers = {t['name']: new_driver(vm, t['name'],
+        qom_all_types = qom.cmd('qom-list-types', abstract=True)
+        self.drivers = {t['name']: new_driver(qom, t['name'],
                                               t.get('abstract', False))
                         for t in qom_all_types}
 
+        subtypes: Dict[str, List[Driver]] = {}
         for t in qom_all_types:
             drv = self.drivers[t['name']]
             if 'parent' in t:
                 drv.parent = self.drivers[t['parent']]
+                subtypes.setdefault(t['parent'], []).append(drv)
 
+        # Rather than asking QEMU for the implementations of each driver,
+        # collect the non-abstract subtypes from the type hierarchy we
+        # already have. Interfaces are not part of it, so ask about those.
+        interface = self.drivers.get('interface')
         for drv in self.drivers.values():
-            imps = vm.cmd('qom-list-types', implements=drv.name)
+            if interface is not None and drv.is_child_of(interface):
+                imps = [self.drivers[imp['name']] for imp in
+                        qom.cmd('qom-list-types', implements=drv.name)]
+            else:
+                imps = []
+                todo = [drv]
+                while todo:
+                    cur = todo.pop()
+                    if not cur.abstract:
+                        imps.append(cur)
+                    todo.extend(subtypes.get(cur.name, []))
             # only implementations inherit property getter
-            drv.set_implementations([self.drivers[imp['name']]
-                                     for imp in imps])
+            drv.set_implementations(imps)
 
     def get_prop(self, driver: str, prop: str) -> str:
         # wrong driver name or disabled in config driver
@@ -238,14 +254,14 @@ def __init__(self, raw_mt_dict: Dict[str, Any],
 class Configuration():
     """Class contains all necessary components to generate table and is used
     to compare different binaries"""
-    def __init__(self, vm: QEMUMachine,
+    def __init__(self, qom: QOMCache,
                  req_mt: List[str], all_mt: bool) -> None:
-        self._vm = vm
-        self._binary = vm.binary
+        self.qom = qom
+        self._binary = qom.snapshot.info['binary']
         self._qemu_args = args.qemu_args.split(' ')
 
-        self._qemu_drivers = VMPropertyGetter(vm)
-        self.req_mt = get_req_mt(self._qemu_drivers, vm, req_mt, all_mt)
+        self._qemu_drivers = VMPropertyGetter(qom)
+        self.req_mt = get_req_mt(self._qemu_drivers, qom, req_mt, all_mt)
 
     def get_implementations(self, driver_name: str) -> List[str]:
         return self._qemu_drivers.get_implementations(driver_name)
@@ -327,6 +343,15 @@ def parse_args() -> Namespace:
                         default=[default_qemu_binary],
                         help='list of qemu binaries that will be compared. '
                              f'Deafult: {default_qemu_binary}')
+    parser.add_argument('--save-snapshot', metavar='FILE', nargs="*",
+                        type=str,
+                        help='save what was queried from each binary to '
+                             'these files, to compare them later with '
+                             '--snapshot. Use it with --all to be able to '
+                             'compare any of the machine types')
+    parser.add_argument('--snapshot', metavar='FILE', nargs="*", type=str,
+                        help='compare snapshots saved with --save-snapshot '
+                             'instead of running qemu binaries')
 
     mt_args_group = parser.add_mutually_exclusive_group()
     mt_args_group.add_argument('--all', action='store_true',
@@ -336,7 +361,11 @@ def parse_args() -> Namespace:
                                help='list of Machine Types '
                                     'that will be compared')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.save_snapshot is not None and \
+            len(args.save_snapshot) != len(args.qemu_binary):
+        parser.error('--save-snapshot needs one file per qemu binary')
+    return args
 
 
 def mt_comp(mt: Machine) -> Tuple[str, int, int, int]:
@@ -353,10 +382,10 @@ def mt_comp(mt: Machine) -> Tuple[str, int, int, int]:
 
 
 def get_mt_definitions(qemu_drivers: VMPropertyGetter,
-                       vm: QEMUMachine) -> List[Machine]:
+                       qom: QOMCache) -> List[Machine]:
     """Constructs list of machine definitions (primarily compat_props) via
     info from QEMU"""
-    raw_mt_defs = vm.cmd('query-machines', compat_props=True)
+    raw_mt_defs = qom.cmd('query-machines', compat_props=True)
     mt_defs = []
     for raw_mt in raw_mt_defs:
         mt_defs.append(Machine(raw_mt, qemu_drivers))
@@ -365,10 +394,10 @@ def get_mt_definitions(qemu_drivers: VMPropertyGetter,
     return mt_defs
 
 
-def get_req_mt(qemu_drivers: VMPropertyGetter, vm: QEMUMachine,
+def get_req_mt(qemu_drivers: VMPropertyGetter, qom: QOMCache,
                req_mt: Optional[List[str]], all_mt: bool) -> List[Machine]:
     """Returns list of requested by user machines"""
-    mt_defs = get_mt_definitions(qemu_drivers, vm)
+    mt_defs = get_mt_definitions(qemu_drivers, qom)
     if all_mt:
         return mt_defs
 
@@ -470,17 +499,41 @@ def print_table(table: pd.DataFrame, table_format: str) -> None:
                                      disable_numparse=True))
 
 
+def load_snapshot(filename: str) -> QOMCache:
+    with open(filename, encoding='utf-8') as file:
+        return QOMCache(None, snapshot=QOMSnapshot.load(file))
+
+
+def save_snapshot(qom: QOMCache, filename: str) -> None:
+    with open(filename, 'w', encoding='utf-8') as file:
+        qom.snapshot.dump(file)
+
+
 if __name__ == '__main__':
     args = parse_args()
     with ExitStack() as stack:
-        vms = [stack.enter_context(QEMUMachine(binary=binary, qmp_timer=15,
-               args=args.qemu_args.split(' '))) for binary in args.qemu_binary]
-
         configurations = []
-        for vm in vms:
-            vm.launch()
-            configurations.append(Configuration(vm, args.mt, args.all))
+        if args.snapshot is not None:
+            for filename in args.snapshot:
+                configurations.append(Configuration(load_snapshot(filename),
+                                                    args.mt, args.all))
+        else:
+            vms = [stack.enter_context(QEMUMachine(binary=binary,
+                                                   qmp_timer=15,
+                   args=args.qemu_args.split(' ')))
+                   for binary in args.qemu_binary]
+
+            for vm in vms:
+                vm.launch()
+                qom = QOMCache(vm.cmd)
+                qom.snapshot.info['binary'] = vm.binary
+                configurations.append(Configuration(qom, args.mt, args.all))
 
         comp_table = fill_prop_table(configurations, args.raw)
+
+        if args.save_snapshot is not None:
+            for config, filename in zip(configurations, args.save_snapshot):
+                save_snapshot(config.qom, filename)
+
         if not comp_table.empty:
             print_table(comp_table, args.format)
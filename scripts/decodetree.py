@@ -23,28 +23,54 @@
 import io
 import os
 import re
+import shlex
 import sys
 import getopt
 
-insnwidth = 32
-bitop_width = 32
-insnmask = 0xffffffff
-variablewidth = False
-fields = {}
-arguments = {}
-formats = {}
-allpatterns = []
-anyextern = False
-testforerror = False
-
-translate_prefix = 'trans'
-translate_scope = 'static '
-input_file = ''
-output_file = None
-output_fd = None
-output_null = False
-insntype = 'uint32_t'
-decode_function = 'decode'
+def reset_globals():
+    """Reset the state of the generator for a new decoder"""
+    global insnwidth
+    global bitop_width
+    global insnmask
+    global variablewidth
+    global fields
+    global arguments
+    global formats
+    global allpatterns
+    global anyextern
+    global testforerror
+    global translate_prefix
+    global translate_scope
+    global input_file
+    global output_file
+    global output_fd
+    global output_null
+    global insntype
+    global decode_function
+
+    insnwidth = 32
+    bitop_width = 32
+    insnmask = 0xffffffff
+    variablewidth = False
+    fields = {}
+    arguments = {}
+    formats = {}
+    allpatterns = []
+    anyextern = False
+    testforerror = False
+
+    translate_prefix = 'trans'
+    translate_scope = 'static '
+    input_file = ''
+    output_file = None
+    output_fd = None
+    output_null = False
+    insntype = 'uint32_t'
+    decode_function = 'decode'
+# end reset_globals
+
+
+reset_globals()
 
 # An identifier for C.
 re_C_ident = '[a-zA-Z][a-zA-Z0-9_]*'
@@ -55,6 +81,22 @@
 re_fmt_ident = '@[a-zA-Z0-9_]*'
 re_pat_ident = '[a-zA-Z0-9_]*'
 
+# Compiled forms of the token syntax, for the parser.
+re_arg_tok = re.compile(re_arg_ident)
+re_fld_tok = re.compile(re_fld_ident)
+re_fmt_tok = re.compile(re_fmt_ident)
+re_pat_tok = re.compile(re_pat_ident)
+re_C_tok = re.compile(re_C_ident)
+re_typed_arg_tok = re.compile(re_C_ident + ':' + re_C_ident)
+re_named_sfld_tok = re.compile(re_C_ident + ':s[0-9]+')
+re_named_ufld_tok = re.compile(re_C_ident + ':[0-9]+')
+re_sfld_tok = re.compile('[0-9]+:s[0-9]+')
+re_ufld_tok = re.compile('[0-9]+:[0-9]+')
+re_fld_import_tok = re.compile(re_C_ident + '=' + re_fld_ident)
+re_const_tok = re.compile(re_C_ident + '=[+-]?[0-9]+')
+re_bits_tok = re.compile('[01.-]+')
+re_fld_width_tok = re.compile(re_C_ident + ':s?[0-9]+')
+
 # Local implementation of a topological sort. We use the same API that
 # the Python graphlib does, so that when QEMU moves forward to a
 # baseline of Python 3.9 or newer this code can all be dropped and
@@ -129,11 +171,13 @@ def static_order(self):
         return r
 # end TopologicalSorter
 
-def error_with_file(file, lineno, *args):
-    """Print an error message from file:line and args and exit."""
-    global output_file
-    global output_fd
+class DecodeError(Exception):
+    """Exception raised for an error in the input or the options"""
+    pass
+
 
+def error_with_file(file, lineno, *args):
+    """Raise DecodeError with a message from file:line and args."""
     # For the test suite expected-errors case, don't print the
     # string "error: ", so they don't turn up as false positives
     # if you grep the meson logs for strings like that.
@@ -145,13 +189,7 @@ def error_with_file(file, lineno, *args):
         prefix += f'{lineno}:'
     if prefix:
         prefix += ' '
-    print(prefix, end=end, file=sys.stderr)
-    print(*args, file=sys.stderr)
-
-    if output_file and output_fd:
-        output_fd.close()
-        os.remove(output_file)
-    exit(0 if testforerror else 1)
+    raise DecodeError(prefix + end + ' '.join(str(a) for a in args))
 # end error_with_file
 
 
@@ -166,6 +204,19 @@ def output(*args):
         output_fd.write(a)
 
 
+def close_output(failed):
+    """Close the output; remove the output file if FAILED is true."""
+    if not output_fd:
+        return
+    if output_file or output_null:
+        output_fd.close()
+        if failed and output_file:
+            os.remove(output_file)
+    else:
+        # Leave sys.stdout open for the next decoder
+        output_fd.detach().flush()
+
+
 def output_autogen():
     output('/* This file is autogenerated by scripts/decodetree.py.  */\n\n')
 
@@ -862,7 +913,6 @@ def parse_field(lineno, name, toks):
     """Parse one instruction field from TOKS at LINENO"""
     global fields
     global insnwidth
-    global re_C_ident
 
     # A "simple" field will have only one entry;
     # a "multifield" will have several.
@@ -870,14 +920,14 @@ def parse_field(lineno, name, toks):
     width = 0
     func = None
     for t in toks:
-        if re.match('^!function=', t):
+        if t.startswith('!function='):
             if func:
                 error(lineno, 'duplicate function')
             func = t.split('=')
             func = func[1]
             continue
 
-        if re.fullmatch(re_C_ident + ':s[0-9]+', t):
+        if re_named_sfld_tok.fullmatch(t):
             # Signed named field
             subtoks = t.split(':')
             n = subtoks[0]
@@ -886,7 +936,7 @@ def parse_field(lineno, name, toks):
             subs.append(f)
             width += le
             continue
-        if re.fullmatch(re_C_ident + ':[0-9]+', t):
+        if re_named_ufld_tok.fullmatch(t):
             # Unsigned named field
             subtoks = t.split(':')
             n = subtoks[0]
@@ -896,11 +946,11 @@ def parse_field(lineno, name, toks):
             width += le
             continue
 
-        if re.fullmatch('[0-9]+:s[0-9]+', t):
+        if re_sfld_tok.fullmatch(t):
             # Signed field extract
             subtoks = t.split(':s')
             sign = True
-        elif re.fullmatch('[0-9]+:[0-9]+', t):
+        elif re_ufld_tok.fullmatch(t):
             # Unsigned field extract
             subtoks = t.split(':')
             sign = False
@@ -943,20 +993,19 @@ def parse_field(lineno, name, toks):
 def parse_arguments(lineno, name, toks):
     """Parse one argument set from TOKS at LINENO"""
     global arguments
-    global re_C_ident
     global anyextern
 
     flds = []
     types = []
     extern = False
     for n in toks:
-        if re.fullmatch('!extern', n):
+        if n == '!extern':
             extern = True
             anyextern = True
             continue
-        if re.fullmatch(re_C_ident + ':' + re_C_ident, n):
+        if re_typed_arg_tok.fullmatch(n):
             (n, t) = n.split(':')
-        elif re.fullmatch(re_C_ident, n):
+        elif re_C_tok.fullmatch(n):
             t = 'int'
         else:
             error(lineno, f'invalid argument set token "{n}"')
@@ -1046,10 +1095,6 @@ def parse_generic(lineno, parent_pat, name, toks):
     global arguments
     global formats
     global allpatterns
-    global re_arg_ident
-    global re_fld_ident
-    global re_fmt_ident
-    global re_C_ident
     global insnwidth
     global insnmask
     global variablewidth
@@ -1065,7 +1110,7 @@ def parse_generic(lineno, parent_pat, name, toks):
     fmt = None
     for t in toks:
         # '&Foo' gives a format an explicit argument set.
-        if re.fullmatch(re_arg_ident, t):
+        if re_arg_tok.fullmatch(t):
             tt = t[1:]
             if arg:
                 error(lineno, 'multiple argument sets')
@@ -1076,7 +1121,7 @@ def parse_generic(lineno, parent_pat, name, toks):
             continue
 
         # '@Foo' gives a pattern an explicit format.
-        if re.fullmatch(re_fmt_ident, t):
+        if re_fmt_tok.fullmatch(t):
             tt = t[1:]
             if fmt:
                 error(lineno, 'multiple formats')
@@ -1087,19 +1132,19 @@ def parse_generic(lineno, parent_pat, name, toks):
             continue
 
         # '%Foo' imports a field.
-        if re.fullmatch(re_fld_ident, t):
+        if re_fld_tok.fullmatch(t):
             tt = t[1:]
             flds = add_field_byname(lineno, flds, tt, tt)
             continue
 
         # 'Foo=%Bar' imports a field with a different name.
-        if re.fullmatch(re_C_ident + '=' + re_fld_ident, t):
+        if re_fld_import_tok.fullmatch(t):
             (fname, iname) = t.split('=%')
             flds = add_field_byname(lineno, flds, fname, iname)
             continue
 
         # 'Foo=number' sets an argument field to a constant value
-        if re.fullmatch(re_C_ident + '=[+-]?[0-9]+', t):
+        if re_const_tok.fullmatch(t):
             (fname, value) = t.split('=')
             value = int(value)
             flds = add_field(lineno, flds, fname, ConstField(value))
@@ -1107,7 +1152,7 @@ def parse_generic(lineno, parent_pat, name, toks):
 
         # Pattern of 0s, 1s, dots and dashes indicate required zeros,
         # required ones, or dont-cares.
-        if re.fullmatch('[01.-]+', t):
+        if re_bits_tok.fullmatch(t):
             shift = len(t)
             fms = t.replace('0', '1')
             fms = fms.replace('.', '0')
@@ -1124,7 +1169,7 @@ def parse_generic(lineno, parent_pat, name, toks):
             fixedmask = (fixedmask << shift) | fms
             undefmask = (undefmask << shift) | ubm
         # Otherwise, fieldname:fieldwidth
-        elif re.fullmatch(re_C_ident + ':s?[0-9]+', t):
+        elif re_fld_width_tok.fullmatch(t):
             (fname, flen) = t.split(':')
             sign = False
             if flen[0] == 's':
@@ -1227,10 +1272,6 @@ def parse_generic(lineno, parent_pat, name, toks):
 
 def parse_file(f, parent_pat):
     """Parse all of the patterns within a file"""
-    global re_arg_ident
-    global re_fld_ident
-    global re_fmt_ident
-    global re_pat_ident
 
     # Read all of the lines of the file.  Concatenate lines
     # ending in backslash; discard empty lines and comments.
@@ -1323,13 +1364,13 @@ def parse_file(f, parent_pat):
             continue
 
         # Determine the type of object needing to be parsed.
-        if re.fullmatch(re_fld_ident, name):
+        if re_fld_tok.fullmatch(name):
             parse_field(start_lineno, name[1:], toks)
-        elif re.fullmatch(re_arg_ident, name):
+        elif re_arg_tok.fullmatch(name):
             parse_arguments(start_lineno, name[1:], toks)
-        elif re.fullmatch(re_fmt_ident, name):
+        elif re_fmt_tok.fullmatch(name):
             parse_generic(start_lineno, None, name[1:], toks)
-        elif re.fullmatch(re_pat_ident, name):
+        elif re_pat_tok.fullmatch(name):
             parse_generic(start_lineno, parent_pat, name, toks)
         else:
             error(lineno, f'invalid token "{name}"')
@@ -1494,163 +1535,206 @@ def prop_size(tree):
 # end prop_size
 
 
-def main():
-    global arguments
-    global formats
-    global allpatterns
-    global translate_scope
-    global translate_prefix
-    global output_fd
-    global output_file
-    global output_null
-    global input_file
-    global insnwidth
-    global insntype
-    global insnmask
-    global decode_function
-    global bitop_width
-    global variablewidth
-    global anyextern
-    global testforerror
+class DecodeTree:
+    """
+    Generate decoders, given the command line arguments that
+    decodetree.py would be invoked with for each of them.
+
+    One object can generate any number of decoders, one after the
+    other, which saves starting a process for each of them.
+    """
 
-    decode_scope = 'static '
-
-    long_opts = ['decode=', 'translate=', 'output=', 'insnwidth=',
-                 'static-decode=', 'varinsnwidth=', 'test-for-error',
-                 'output-null']
-    try:
-        (opts, args) = getopt.gnu_getopt(sys.argv[1:], 'o:vw:', long_opts)
-    except getopt.GetoptError as err:
-        error(0, err)
-    for o, a in opts:
-        if o in ('-o', '--output'):
-            output_file = a
-        elif o == '--decode':
-            decode_function = a
-            decode_scope = ''
-        elif o == '--static-decode':
-            decode_function = a
-        elif o == '--translate':
-            translate_prefix = a
-            translate_scope = ''
-        elif o in ('-w', '--insnwidth', '--varinsnwidth'):
-            if o == '--varinsnwidth':
-                variablewidth = True
-            insnwidth = int(a)
-            if insnwidth == 16:
-                insntype = 'uint16_t'
-                insnmask = 0xffff
-            elif insnwidth == 64:
-                insntype = 'uint64_t'
-                insnmask = 0xffffffffffffffff
-                bitop_width = 64
-            elif insnwidth != 32:
-                error(0, 'cannot handle insns of width', insnwidth)
-        elif o == '--test-for-error':
-            testforerror = True
-        elif o == '--output-null':
-            output_null = True
+    def __init__(self):
+        self.failures = 0
+
+    def run(self, argv):
+        """Generate the decoder described by ARGV; return the exit status"""
+        reset_globals()
+        try:
+            self.__generate(argv)
+        except DecodeError as e:
+            print(e, file=sys.stderr)
+            close_output(True)
+            status = 0 if testforerror else 1
         else:
-            assert False, 'unhandled option'
+            close_output(False)
+            status = 1 if testforerror else 0
+        if status:
+            self.failures += 1
+        return status
 
-    if len(args) < 1:
-        error(0, 'missing input file')
+    @staticmethod
+    def __generate(argv):
+        global arguments
+        global formats
+        global allpatterns
+        global translate_scope
+        global translate_prefix
+        global output_fd
+        global output_file
+        global output_null
+        global input_file
+        global insnwidth
+        global insntype
+        global insnmask
+        global decode_function
+        global bitop_width
+        global variablewidth
+        global anyextern
+        global testforerror
 
-    toppat = ExcMultiPattern(0)
+        decode_scope = 'static '
 
-    for filename in args:
-        input_file = filename
-        f = open(filename, 'rt', encoding='utf-8')
-        parse_file(f, toppat)
-        f.close()
+        long_opts = ['decode=', 'translate=', 'output=', 'insnwidth=',
+                     'static-decode=', 'varinsnwidth=', 'test-for-error',
+                     'output-null']
+        try:
+            (opts, args) = getopt.gnu_getopt(argv, 'o:vw:', long_opts)
+        except getopt.GetoptError as err:
+            error(0, err)
+        for o, a in opts:
+            if o in ('-o', '--output'):
+                output_file = a
+            elif o == '--decode':
+                decode_function = a
+                decode_scope = ''
+            elif o == '--static-decode':
+                decode_function = a
+            elif o == '--translate':
+                translate_prefix = a
+                translate_scope = ''
+            elif o in ('-w', '--insnwidth', '--varinsnwidth'):
+                if o == '--varinsnwidth':
+                    variablewidth = True
+                insnwidth = int(a)
+                if insnwidth == 16:
+                    insntype = 'uint16_t'
+                    insnmask = 0xffff
+                elif insnwidth == 64:
+                    insntype = 'uint64_t'
+                    insnmask = 0xffffffffffffffff
+                    bitop_width = 64
+                elif insnwidth != 32:
+                    error(0, 'cannot handle insns of width', insnwidth)
+            elif o == '--test-for-error':
+                testforerror = True
+            elif o == '--output-null':
+                output_null = True
+            else:
+                assert False, 'unhandled option'
 
-    # We do not want to compute masks for toppat, because those masks
-    # are used as a starting point for build_tree.  For toppat, we must
-    # insist that decode begins from naught.
-    for i in toppat.pats:
-        i.prop_masks()
+        if len(args) < 1:
+            error(0, 'missing input file')
 
-    toppat.build_tree()
-    toppat.prop_format()
+        toppat = ExcMultiPattern(0)
 
-    if variablewidth:
-        for i in toppat.pats:
-            i.prop_width()
-        stree = build_size_tree(toppat.pats, 8, 0, 0)
-        prop_size(stree)
-
-    if output_null:
-        output_fd = open(os.devnull, 'wt', encoding='utf-8', errors="ignore")
-    elif output_file:
-        output_fd = open(output_file, 'wt', encoding='utf-8')
-    else:
-        output_fd = io.TextIOWrapper(sys.stdout.buffer,
-                                     encoding=sys.stdout.encoding,
-                                     errors="ignore")
-
-    output_autogen()
-    for n in sorted(arguments.keys()):
-        f = arguments[n]
-        f.output_def()
-
-    # A single translate function can be invoked for different patterns.
-    # Make sure that the argument sets are the same, and declare the
-    # function only once.
-    #
-    # If we're sharing formats, we're likely also sharing trans_* functions,
-    # but we can't tell which ones.  Prevent issues from the compiler by
-    # suppressing redundant declaration warnings.
-    if anyextern:
-        output("#pragma GCC diagnostic push\n",
-               "#pragma GCC diagnostic ignored \"-Wredundant-decls\"\n",
-               "#ifdef __clang__\n"
-               "#  pragma GCC diagnostic ignored \"-Wtypedef-redefinition\"\n",
-               "#endif\n\n")
-
-    out_pats = {}
-    for i in allpatterns:
-        if i.name in out_pats:
-            p = out_pats[i.name]
-            if i.base.base != p.base.base:
-                error(0, i.name, ' has conflicting argument sets')
-        else:
-            i.output_decl()
-            out_pats[i.name] = i
-    output('\n')
+        for filename in args:
+            input_file = filename
+            f = open(filename, 'rt', encoding='utf-8')
+            parse_file(f, toppat)
+            f.close()
 
-    if anyextern:
-        output("#pragma GCC diagnostic pop\n\n")
+        # We do not want to compute masks for toppat, because those masks
+        # are used as a starting point for build_tree.  For toppat, we must
+        # insist that decode begins from naught.
+        for i in toppat.pats:
+            i.prop_masks()
 
-    for n in sorted(formats.keys()):
-        f = formats[n]
-        f.output_extract()
+        toppat.build_tree()
+        toppat.prop_format()
 
-    output(decode_scope, 'bool ', decode_function,
-           '(DisasContext *ctx, ', insntype, ' insn)\n{\n')
+        if variablewidth:
+            for i in toppat.pats:
+                i.prop_width()
+            stree = build_size_tree(toppat.pats, 8, 0, 0)
+            prop_size(stree)
 
-    i4 = str_indent(4)
+        if output_null:
+            output_fd = open(os.devnull, 'wt', encoding='utf-8', errors="ignore")
+        elif output_file:
+            output_fd = open(output_file, 'wt', encoding='utf-8')
+        else:
+            output_fd = io.TextIOWrapper(sys.stdout.buffer,
+                                         encoding=sys.stdout.encoding,
+                                         errors="ignore")
 
-    if len(allpatterns) != 0:
-        output(i4, 'union {\n')
+        output_autogen()
         for n in sorted(arguments.keys()):
             f = arguments[n]
-            output(i4, i4, f.struct_name(), ' f_', f.name, ';\n')
-        output(i4, '} u;\n\n')
-        toppat.output_code(4, False, 0, 0)
-
-    output(i4, 'return false;\n')
-    output('}\n')
-
-    if variablewidth:
-        output('\n', decode_scope, insntype, ' ', decode_function,
-               '_load(DisasContext *ctx)\n{\n',
-               '    ', insntype, ' insn = 0;\n\n')
-        stree.output_code(4, 0, 0, 0)
+            f.output_def()
+
+        # A single translate function can be invoked for different patterns.
+        # Make sure that the argument sets are the same, and declare the
+        # function only once.
+        #
+        # If we're sharing formats, we're likely also sharing trans_* functions,
+        # but we can't tell which ones.  Prevent issues from the compiler by
+        # suppressing redundant declaration warnings.
+        if anyextern:
+            output("#pragma GCC diagnostic push\n",
+                   "#pragma GCC diagnostic ignored \"-Wredundant-decls\"\n",
+                   "#ifdef __clang__\n"
+                   "#  pragma GCC diagnostic ignored \"-Wtypedef-redefinition\"\n",
+                   "#endif\n\n")
+
+        out_pats = {}
+        for i in allpatterns:
+            if i.name in out_pats:
+                p = out_pats[i.name]
+                if i.base.base != p.base.base:
+                    error(0, i.name, ' has conflicting argument sets')
+            else:
+                i.output_decl()
+                out_pats[i.name] = i
+        output('\n')
+
+        if anyextern:
+            output("#pragma GCC diagnostic pop\n\n")
+
+        for n in sorted(formats.keys()):
+            f = formats[n]
+            f.output_extract()
+
+        output(decode_scope, 'bool ', decode_function,
+               '(DisasContext *ctx, ', insntype, ' insn)\n{\n')
+
+        i4 = str_indent(4)
+
+        if len(allpatterns) != 0:
+            output(i4, 'union {\n')
+            for n in sorted(arguments.keys()):
+                f = arguments[n]
+                output(i4, i4, f.struct_name(), ' f_', f.name, ';\n')
+            output(i4, '} u;\n\n')
+            toppat.output_code(4, False, 0, 0)
+
+        output(i4, 'return false;\n')
         output('}\n')
 
-    if output_file:
-        output_fd.close()
-    exit(1 if testforerror else 0)
+        if variablewidth:
+            output('\n', decode_scope, insntype, ' ', decode_function,
+                   '_load(DisasContext *ctx)\n{\n',
+                   '    ', insntype, ' insn = 0;\n\n')
+            stree.output_code(4, 0, 0, 0)
+            output('}\n')
+# end DecodeTree
+
+
+def main():
+    decodetree = DecodeTree()
+
+    # With --batch=MANIFEST, each line of MANIFEST holds the arguments
+    # for one decoder, quoted like in a shell.
+    if len(sys.argv) == 2 and sys.argv[1].startswith('--batch='):
+        with open(sys.argv[1][len('--batch='):], 'rt',
+                  encoding='utf-8') as f:
+            for line in f:
+                argv = shlex.split(line, comments=True)
+                if argv:
+                    decodetree.run(argv)
+        exit(1 if decodetree.failures else 0)
+
+    exit(decodetree.run(sys.argv[1:]))
 # end main
 
 
@@ -2,16 +2,50 @@
 # See the COPYING file in the top-level directory.
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple,
+)
 
 from .commands import gen_commands
+from .error import QAPIError
 from .events import gen_events
 from .features import gen_features
+from .gen import output_writer, write_generated
 from .introspect import gen_introspect
 from .schema import QAPISchema
 from .types import gen_types
 from .visit import gen_visit
 
 
+# The generators QAPICBackend.generate() runs in forked processes
+_generators: List[Callable[[], None]] = []
+
+
+def _run_generator(
+        index: int) -> Tuple[List[Tuple[str, str]], Optional[str]]:
+    """
+    Run a generator of `_generators`, capturing the files it writes.
+
+    :param index: The generator's index in `_generators`.
+    :return: The pathnames and contents of the files, and the error
+        message if the generator failed.
+    """
+    outputs: List[Tuple[str, str]] = []
+    try:
+        with output_writer(lambda pathname, text:
+                           outputs.append((pathname, text))):
+            _generators[index]()
+    except QAPIError as err:
+        # QAPIError doesn't survive pickling, pass on its message only
+        return outputs, str(err)
+    return outputs, None
+
+
 class QAPIBackend(ABC):
     # pylint: disable=too-few-public-methods
 
@@ -37,8 +71,16 @@ def generate(self,
 
 
 class QAPICBackend(QAPIBackend):
+    """
+    The C code generator.
+
+    :param jobs: The number of processes to run generators in.
+    """
     # pylint: disable=too-few-public-methods
 
+    def __init__(self, jobs: int = 1):
+        self._jobs = jobs
+
     def generate(self,
                  schema: QAPISchema,
                  output_dir: str,
@@ -57,9 +99,51 @@ def generate(self,
 
         :raise QAPIError: On failures.
         """
-        gen_types(schema, output_dir, prefix, builtins)
-        gen_features(schema, output_dir, prefix)
-        gen_visit(schema, output_dir, prefix, builtins)
-        gen_commands(schema, output_dir, prefix, gen_tracing)
-        gen_events(schema, output_dir, prefix)
-        gen_introspect(schema, output_dir, prefix, unmask)
+        generators: List[Callable[[], None]] = [
+            lambda: gen_types(schema, output_dir, prefix, builtins),
+            lambda: gen_features(schema, output_dir, prefix),
+            lambda: gen_visit(schema, output_dir, prefix, builtins),
+            lambda: gen_commands(schema, output_dir, prefix, gen_tracing),
+            lambda: gen_events(schema, output_dir, prefix),
+            lambda: gen_introspect(schema, output_dir, prefix, unmask),
+        ]
+
+        # The processes inherit the checked schema by forking.  Where
+        # that isn't possible, generate serially.
+        if (self._jobs <= 1
+                or 'fork' not in multiprocessing.get_all_start_methods()):
+            for generator in generators:
+                generator()
+            return
+        self._generate_parallel(generators)
+
+    def _generate_parallel(self,
+                           generators: List[Callable[[], None]]) -> None:
+        """
+        Run generators in forked processes.
+
+        Generation is parallel only between generators, not between
+        modules, since a generator's output for one module depends on
+        the modules it visited before.  The files are written here, in
+        the order the generators would write them when run one after
+        the other.
+
+        :param generators: The generators to run.
+
+        :raise QAPIError: When a generator fails.
+        """
+        global _generators  # pylint: disable=global-statement
+        _generators = generators
+        try:
+            with ProcessPoolExecutor(
+                    max_workers=min(self._jobs, len(generators)),
+                    mp_context=multiprocessing.get_context('fork')
+            ) as executor:
+                for outputs, error in executor.map(_run_generator,
+                                                   range(len(generators))):
+                    for pathname, text in outputs:
+                        write_generated(pathname, text)
+                    if error is not None:
+                        raise QAPIError(error)
+        finally:
+            _generators = []
@@ -0,0 +1,194 @@
+#
+# QAPI generator cache
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+QAPI generator cache
+
+Remembers what a run of the generator produced.  A cache entry is keyed
+by the generator's code, its options and the main schema file; it
+records the SHA-256 of every module the schema consists of and of every
+file that was generated.  The contents of the generated files are kept
+once per digest.
+
+When none of the modules changed, the outputs are restored from the
+cache without parsing the schema.  Outputs whose size and modification
+time are what the cache recorded are not even read.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+
+from .gen import write_output
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_digest(fname: str) -> Optional[str]:
+    try:
+        with open(fname, 'rb') as fp:
+            return _digest(fp.read())
+    except OSError:
+        return None
+
+
+def _code_digest() -> str:
+    hasher = hashlib.sha256()
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(pkg_dir)):
+        if name.endswith('.py'):
+            hasher.update(name.encode('utf-8') + b'\0')
+            with open(os.path.join(pkg_dir, name), 'rb') as fp:
+                hasher.update(fp.read())
+    return hasher.hexdigest()
+
+
+def _stat(pathname: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(pathname)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _write_atomic(pathname: str, data: bytes) -> None:
+    dirname = os.path.dirname(pathname)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, pathname)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class QAPIGenCache:
+    """
+    The cache entry for one invocation of the generator.
+
+    Use `check()` to find out whether the entry is up to date.  If it
+    is, `restore()` it.  Else run the generator with `write()` as
+    output writer (see `gen.output_writer()`) and `save()` the entry
+    when done.
+
+    :param cache_dir: The directory to keep the cache in.
+    :param schema_fname: The main schema file.
+    :param options: The options that affect the generated code.
+    """
+    def __init__(self,
+                 cache_dir: str,
+                 schema_fname: str,
+                 options: Dict[str, object]):
+        key = json.dumps({'code': _code_digest(),
+                          'schema': os.path.abspath(schema_fname),
+                          'options': options},
+                         sort_keys=True)
+        self._entry_fname = os.path.join(
+            cache_dir, _digest(key.encode('utf-8')) + '.json')
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+
+        # module file name -> digest
+        self._old_inputs: Dict[str, str] = {}
+        # output pathname -> [digest, size, mtime_ns]
+        self._old_outputs: Dict[str, List[object]] = {}
+        self._outputs: Dict[str, List[object]] = {}
+        #: The number of outputs whose file had to be (re)written.
+        self.written = 0
+
+        try:
+            with open(self._entry_fname, encoding='utf-8') as fp:
+                entry = json.load(fp)
+            self._old_inputs = dict(entry['inputs'])
+            self._old_outputs = dict(entry['outputs'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._old_inputs = {}
+            self._old_outputs = {}
+
+    @property
+    def outputs(self) -> int:
+        """The number of outputs written or restored so far."""
+        return len(self._outputs)
+
+    def _object(self, digest: object) -> str:
+        return os.path.join(self._objects_dir, str(digest))
+
+    def check(self) -> Optional[str]:
+        """
+        Check whether the cache entry is up to date.
+
+        :return: `None` if it is, else why it is not.
+        """
+        if not self._old_inputs:
+            return "not cached"
+        for fname, digest in self._old_inputs.items():
+            if _file_digest(fname) != digest:
+                return f"'{os.path.relpath(fname)}' changed"
+        for output_digest, *_ in self._old_outputs.values():
+            if not os.path.exists(self._object(output_digest)):
+                return "cached output missing"
+        return None
+
+    def restore(self) -> None:
+        """Bring the outputs up to date from the cache."""
+        for pathname, (digest, *stat) in self._old_outputs.items():
+            if _stat(pathname) == stat:
+                self._outputs[pathname] = [digest, *stat]
+                continue
+            with open(self._object(digest), 'rb') as fp:
+                self.write(pathname, fp.read().decode('utf-8'))
+        if self._outputs != self._old_outputs:
+            self._save(self._old_inputs)
+
+    def write(self, pathname: str, text: str) -> None:
+        """
+        Write a generated file and record it in the cache.
+
+        The file is left alone when the cache knows it to hold `text`.
+
+        :param pathname: The file to write.
+        :param text: Its contents.
+        """
+        pathname = os.path.abspath(pathname)
+        data = text.encode('utf-8')
+        digest = _digest(data)
+        old = self._old_outputs.get(pathname)
+        if (old is None or old[0] != digest
+                or _stat(pathname) != old[1:]):
+            if write_output(pathname, text):
+                self.written += 1
+        self._outputs[pathname] = [digest, *(_stat(pathname) or [])]
+        if not os.path.exists(self._object(digest)):
+            _write_atomic(self._object(digest), data)
+
+    def save(self, inputs: Sequence[str]) -> None:
+        """
+        Save the cache entry after a successful run of the generator.
+
+        :param inputs: The file names of the schema's modules.
+        """
+        digests = {}
+        for fname in inputs:
+            digest = _file_digest(fname)
+            if digest is None:
+                return
+            digests[os.path.abspath(fname)] = digest
+        self._save(digests)
+
+    def _save(self, inputs: Dict[str, str]) -> None:
+        entry = {'inputs': inputs, 'outputs': self._outputs}
+        _write_atomic(self._entry_fname,
+                      json.dumps(entry, indent=1).encode('utf-8'))
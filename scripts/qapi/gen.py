@@ -14,6 +14,7 @@
 import re
 import sys
 from typing import (
+    Callable,
     Dict,
     Iterator,
     Optional,
@@ -74,21 +75,69 @@ def write(self, output_dir: str) -> None:
         # already generated for the main schema.
         if self.fname.startswith('../'):
             return
-        pathname = os.path.join(output_dir, self.fname)
-        odir = os.path.dirname(pathname)
-
-        if odir:
-            os.makedirs(odir, exist_ok=True)
-
-        # use os.open for O_CREAT to create and read a non-existent file
-        fd = os.open(pathname, os.O_RDWR | os.O_CREAT, 0o666)
-        with os.fdopen(fd, 'r+', encoding='utf-8') as fp:
-            text = self.get_content()
-            oldtext = fp.read(len(text) + 1)
-            if text != oldtext:
-                fp.seek(0)
-                fp.truncate(0)
-                fp.write(text)
+        write_generated(os.path.join(output_dir, self.fname),
+                        self.get_content())
+
+
+def write_output(pathname: str, text: str) -> bool:
+    """
+    Write a generated file unless it already has the desired contents.
+
+    Leaving unchanged files alone preserves their timestamp, so that
+    build tools don't needlessly rebuild what depends on them.
+
+    :param pathname: The file to write.
+    :param text: Its contents.
+    :return: `True` if the file was written.
+    """
+    odir = os.path.dirname(pathname)
+
+    if odir:
+        os.makedirs(odir, exist_ok=True)
+
+    # use os.open for O_CREAT to create and read a non-existent file
+    fd = os.open(pathname, os.O_RDWR | os.O_CREAT, 0o666)
+    with os.fdopen(fd, 'r+', encoding='utf-8') as fp:
+        oldtext = fp.read(len(text) + 1)
+        if text == oldtext:
+            return False
+        fp.seek(0)
+        fp.truncate(0)
+        fp.write(text)
+    return True
+
+
+# Called by write_generated() with the pathname and contents of each output
+_output_writer: Callable[[str, str], object] = write_output
+
+
+def write_generated(pathname: str, text: str) -> None:
+    """
+    Write a generated file with the writer set by `output_writer()`,
+    by default `write_output()`.
+
+    :param pathname: The file to write.
+    :param text: Its contents.
+    """
+    _output_writer(pathname, text)
+
+
+@contextmanager
+def output_writer(writer: Callable[[str, str], object]) -> Iterator[None]:
+    """
+    A with-statement context manager that redirects the writing of
+    generated files.
+
+    :param writer: Called with the pathname and the contents of every
+        file `write_generated()` writes, in place of `write_output()`.
+    """
+    global _output_writer  # pylint: disable=global-statement
+    saved = _output_writer
+    _output_writer = writer
+    try:
+        yield
+    finally:
+        _output_writer = saved
 
 
 def _wrap_ifcond(ifcond: QAPISchemaIfCond, before: str, after: str) -> str:
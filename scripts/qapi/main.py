@@ -9,12 +9,15 @@
 
 import argparse
 from importlib import import_module
+import os
 import sys
 from typing import Optional
 
 from .backend import QAPIBackend, QAPICBackend
+from .cache import QAPIGenCache
 from .common import must_match
 from .error import QAPIError
+from .gen import output_writer, write_output
 from .schema import QAPISchema
 
 
@@ -25,9 +28,9 @@ def invalid_prefix_char(prefix: str) -> Optional[str]:
     return None
 
 
-def create_backend(path: str) -> QAPIBackend:
+def create_backend(path: str, jobs: int = 1) -> QAPIBackend:
     if path is None:
-        return QAPICBackend()
+        return QAPICBackend(jobs)
 
     module_path, dot, class_name = path.rpartition('.')
     if not dot:
@@ -85,6 +88,11 @@ def main() -> int:
     parser.add_argument('--suppress-tracing', action='store_true',
                         help="suppress adding trace events to qmp marshals")
 
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="run up to JOBS code generators in parallel")
+    parser.add_argument('--cache-dir', action='store',
+                        help="cache generated code in directory CACHE_DIR")
+
     parser.add_argument('schema', action='store')
     args = parser.parse_args()
 
@@ -94,15 +102,44 @@ def main() -> int:
         print(f"{sys.argv[0]}: {msg}", file=sys.stderr)
         return 1
 
+    for opt, val in (('--cache-dir', args.cache_dir),
+                     ('--jobs', args.jobs != 1)):
+        if val and args.backend:
+            print(f"{sys.argv[0]}: {opt} cannot be used with --backend",
+                  file=sys.stderr)
+            return 1
+
     try:
+        cache = None
+        miss = None
+        if args.cache_dir:
+            cache = QAPIGenCache(
+                args.cache_dir, args.schema,
+                {'output_dir': os.path.abspath(args.output_dir),
+                 'prefix': args.prefix,
+                 'unmask': args.unmask,
+                 'builtins': args.builtins,
+                 'gen_tracing': not args.suppress_tracing})
+            miss = cache.check()
+            if miss is None:
+                cache.restore()
+                print(f"{sys.argv[0]}: cache hit, "
+                      f"{cache.written} of {cache.outputs} outputs written")
+                return 0
+
         schema = QAPISchema(args.schema)
-        backend = create_backend(args.backend)
-        backend.generate(schema,
-                         output_dir=args.output_dir,
-                         prefix=args.prefix,
-                         unmask=args.unmask,
-                         builtins=args.builtins,
-                         gen_tracing=not args.suppress_tracing)
+        backend = create_backend(args.backend, args.jobs)
+        with output_writer(cache.write if cache else write_output):
+            backend.generate(schema,
+                             output_dir=args.output_dir,
+                             prefix=args.prefix,
+                             unmask=args.unmask,
+                             builtins=args.builtins,
+                             gen_tracing=not args.suppress_tracing)
+        if cache:
+            cache.save(schema.module_fnames())
+            print(f"{sys.argv[0]}: cache miss ({miss}), "
+                  f"{cache.written} of {cache.outputs} outputs written")
     except QAPIError as err:
         print(err, file=sys.stderr)
         return 1
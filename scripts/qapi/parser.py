@@ -12,6 +12,7 @@
 # This work is licensed under the terms of the GNU GPL, version 2.
 # See the COPYING file in the top-level directory.
 
+import bisect
 import enum
 import os
 import re
@@ -22,6 +23,7 @@
     List,
     Mapping,
     Match,
+    NoReturn,
     Optional,
     Set,
     Union,
@@ -97,12 +99,16 @@ def __init__(self,
         self.src = ''
 
         # Lexer state (see `accept` for details):
-        self.info = QAPISourceInfo(self._fname, incl_info)
+        self._info = QAPISourceInfo(self._fname, incl_info)
+        self._line = 1
         self.tok: Union[None, str] = None
         self.pos = 0
         self.cursor = 0
         self.val: Optional[Union[bool, str]] = None
         self.line_pos = 0
+        # Buffer indexes where lines start, and where the next line starts
+        self._line_starts = [0]
+        self._next_line_pos = 0
 
         # Parser output:
         self.exprs: List[QAPIExpression] = []
@@ -129,6 +135,7 @@ def _parse(self) -> None:
             self.src = fp.read()
         if self.src == '' or self.src[-1] != '\n':
             self.src += '\n'
+        self._line_starts += [m.end() for m in re.finditer('\n', self.src)]
 
         # Prime the lexer:
         self.accept()
@@ -295,67 +302,104 @@ def accept(self, skip_comment: bool = True) -> None:
             ``.tok`` and ``.val`` will both be None at EOF.
         """
         while True:
-            self.tok = self.src[self.cursor]
-            self.pos = self.cursor
-            self.cursor += 1
+            match = self._token_re.match(self.src, self.cursor)
+            assert match and match.lastgroup
+            kind = match.lastgroup
+            pos = match.start(kind)
+            if kind == 'eof':
+                # Point to the newline the source ends with
+                pos -= 1
+            self._set_pos(pos)
+            self.cursor = match.end()
             self.val = None
 
-            if self.tok == '#':
-                if self.src[self.cursor] == '#':
-                    # Start of doc comment
-                    skip_comment = False
-                self.cursor = self.src.find('\n', self.cursor)
-                if not skip_comment:
-                    self.val = self.src[self.pos:self.cursor]
+            if kind == 'punct':
+                self.tok = match.group(kind)
+                return
+            if kind == 'comment':
+                self.tok = '#'
+                if not skip_comment or self.src.startswith('##', self.pos):
+                    self.val = match.group(kind)
                     return
-            elif self.tok in '{}:,[]':
+            elif kind == 'string':
+                self.tok = "'"
+                self.val = match.group(kind)[1:-1].replace('\\\\', '\\')
                 return
-            elif self.tok == "'":
-                # Note: we accept only printable ASCII
-                string = ''
-                esc = False
-                while True:
-                    ch = self.src[self.cursor]
-                    self.cursor += 1
-                    if ch == '\n':
-                        raise QAPIParseError(self, "missing terminating \"'\"")
-                    if esc:
-                        # Note: we recognize only \\ because we have
-                        # no use for funny characters in strings
-                        if ch != '\\':
-                            raise QAPIParseError(self,
-                                                 "unknown escape \\%s" % ch)
-                        esc = False
-                    elif ch == '\\':
-                        esc = True
-                        continue
-                    elif ch == "'":
-                        self.val = string
-                        return
-                    if ord(ch) < 32 or ord(ch) >= 127:
-                        raise QAPIParseError(
-                            self, "funny character in string")
-                    string += ch
-            elif self.src.startswith('true', self.pos):
-                self.val = True
-                self.cursor += 3
+            elif kind in ('true', 'false'):
+                self.tok = kind[0]
+                self.val = kind == 'true'
                 return
-            elif self.src.startswith('false', self.pos):
-                self.val = False
-                self.cursor += 4
+            elif kind == 'eof':
+                self.tok = None
                 return
-            elif self.tok == '\n':
-                if self.cursor == len(self.src):
-                    self.tok = None
-                    return
-                self.info = self.info.next_line()
-                self.line_pos = self.cursor
-            elif not self.tok.isspace():
-                # Show up to next structural, whitespace or quote
-                # character
-                match = must_match('[^[\\]{}:,\\s\']+',
-                                   self.src[self.cursor-1:])
-                raise QAPIParseError(self, "stray '%s'" % match.group(0))
+            else:
+                self._lex_error()
+
+    # Matches the next token, skipping whitespace.  The token is the group
+    # named after its kind.  Bad tokens end up in group 'error'.
+    _token_re = re.compile(r"""
+        \s*
+        (?:
+            (?P<punct>[{}:,[\]])
+          | (?P<comment>\#[^\n]*)
+          # Note: we accept only printable ASCII, and recognize only \\
+          # because we have no use for funny characters in strings
+          | (?P<string>'(?:[\x20-&(-[\]-~]|\\\\)*')
+          | (?P<true>true)
+          | (?P<false>false)
+          | (?P<eof>\Z)
+          | (?P<error>)
+        )""", re.VERBOSE)
+
+    def _set_pos(self, pos: int) -> None:
+        """
+        Set ``.pos``, and update ``.line_pos`` and ``.info`` to match.
+
+        :param pos: A buffer index no less than the current ``.line_pos``.
+        """
+        self.pos = pos
+        if self.line_pos <= pos < self._next_line_pos:
+            return
+        self._line = bisect.bisect_right(self._line_starts, pos)
+        self.line_pos = self._line_starts[self._line - 1]
+        self._next_line_pos = self._line_starts[self._line]
+
+    @property
+    def info(self) -> QAPISourceInfo:
+        """
+        The source location of the current token.
+
+        Created only when asked for, because the locations of most
+        lines are never used.
+        """
+        if self._info.line != self._line:
+            self._info = self._info.next_line(self._line - self._info.line)
+        return self._info
+
+    def _lex_error(self) -> NoReturn:
+        """Raise the error for the bad token at ``.pos``."""
+        if self.src[self.pos] != "'":
+            # Show up to next structural, whitespace or quote
+            # character
+            match = must_match('[^[\\]{}:,\\s\']+', self.src[self.pos:])
+            raise QAPIParseError(self, "stray '%s'" % match.group(0))
+
+        esc = False
+        for ch in self.src[self.pos + 1:]:
+            if ch == '\n':
+                raise QAPIParseError(self, "missing terminating \"'\"")
+            if esc:
+                if ch != '\\':
+                    raise QAPIParseError(self, "unknown escape \\%s" % ch)
+                esc = False
+            elif ch == '\\':
+                esc = True
+                continue
+            elif ch == "'":
+                break
+            if ord(ch) < 32 or ord(ch) >= 127:
+                raise QAPIParseError(self, "funny character in string")
+        raise AssertionError("valid string not matched by _token_re")
 
     def get_members(self) -> Dict[str, object]:
         expr: Dict[str, object] = {}
@@ -1223,6 +1223,12 @@ def module_by_fname(self, fname: str) -> QAPISchemaModule:
         name = self._module_name(fname)
         return self._module_dict[name]
 
+    def module_fnames(self) -> List[str]:
+        """Return the file names of the schema's user modules."""
+        return [os.path.join(self._schema_dir, name)
+                for name in self._module_dict
+                if QAPISchemaModule.is_user_module(name)]
+
     def _def_include(self, expr: QAPIExpression) -> None:
         include = expr['include']
         assert expr.doc is None
@@ -9,7 +9,6 @@
 # This work is licensed under the terms of the GNU GPL, version 2.
 # See the COPYING file in the top-level directory.
 
-import copy
 from typing import List, Optional, TypeVar
 
 
@@ -48,7 +47,10 @@ def set_defn(self, meta: str, name: str) -> None:
         self.defn_name = name
 
     def next_line(self: T, n: int = 1) -> T:
-        info = copy.copy(self)
+        # Same as copy.copy(self), only faster.  The parser calls this
+        # for nearly every line of the schema.
+        info = self.__class__.__new__(self.__class__)
+        info.__dict__.update(self.__dict__)
         info.line += n
         return info
 
@@ -315,6 +315,7 @@ def _begin_user_module(self, name: str) -> None:
 
     def visit_begin(self, schema: QAPISchema) -> None:
         # gen_object() is recursive, ensure it doesn't visit the empty type
+        objects_seen.clear()
         objects_seen.add(schema.the_empty_object_type.name)
 
     def _gen_type_cleanup(self, name: str) -> None:
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Benchmark generating the decoders of the whole tree with decodetree,
+# one process per decoder (as meson does) and in batch mode
+#
+# Usage: bench-decodetree.py [--baseline DECODETREE] [--count N]
+#
+# The decoders and their arguments are collected from the decodetree.process()
+# calls in the meson.build files of target/.  --baseline adds another version
+# of decodetree.py, run one process per decoder, for comparison.  The outputs
+# of every mode are checked to be identical.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import ast
+import filecmp
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import simplebench
+from results_to_text import results_to_text
+
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+DECODETREE = os.path.join(SRC_DIR, 'scripts', 'decodetree.py')
+
+PROCESS_RE = re.compile(r"decodetree\.process\(\s*'([^']+)'\s*"
+                        r"(?:,\s*extra_args:\s*(\[[^\]]*\]|'[^']*'))?\s*\)")
+
+# The order of some of the generated code depends on the hash of strings;
+# fix it so that the outputs can be compared
+ENV = dict(os.environ, PYTHONHASHSEED='0')
+
+
+def find_decoders():
+    """Return the arguments of decodetree.py for the decoders of the tree"""
+    decoders = []
+    for root, dirs, files in os.walk(os.path.join(SRC_DIR, 'target')):
+        dirs.sort()
+        if 'meson.build' not in files:
+            continue
+        with open(os.path.join(root, 'meson.build'), encoding='utf-8') as f:
+            for m in PROCESS_RE.finditer(f.read()):
+                extra_args = ast.literal_eval(m.group(2) or '[]')
+                if isinstance(extra_args, str):
+                    extra_args = [extra_args]
+                decoders.append([os.path.join(root, m.group(1))] + extra_args)
+    return decoders
+
+
+def job_args(out_dir, index, args):
+    return args + ['-o', os.path.join(out_dir, f'decode-{index}.c.inc')]
+
+
+def run_per_job(script, out_dir, decoders):
+    for i, args in enumerate(decoders):
+        subprocess.run([sys.executable, script] + job_args(out_dir, i, args),
+                       env=ENV, check=True)
+
+
+def run_batch(out_dir, decoders):
+    manifest = os.path.join(out_dir, 'manifest')
+    with open(manifest, 'w', encoding='utf-8') as f:
+        for i, args in enumerate(decoders):
+            f.write(shlex.join(job_args(out_dir, i, args)) + '\n')
+    subprocess.run([sys.executable, DECODETREE, f'--batch={manifest}'],
+                   env=ENV, check=True)
+
+
+def bench_func(env, case):
+    out_dir = os.path.join(case['dir'], env['id'].replace(' ', '_'))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    start = time.monotonic()
+    env['func'](out_dir, case['decoders'])
+    return {'seconds': time.monotonic() - start}
+
+
+def check_outputs(base_dir, envs):
+    ref = None
+    for env in envs:
+        out_dir = os.path.join(base_dir, env['id'].replace(' ', '_'))
+        files = sorted(f for f in os.listdir(out_dir) if f != 'manifest')
+        if ref is None:
+            ref = (out_dir, files)
+            continue
+        assert files == ref[1], f'{env["id"]}: different outputs'
+        _, mismatch, errors = filecmp.cmpfiles(ref[0], out_dir, files,
+                                               shallow=False)
+        assert not mismatch and not errors, \
+            f'{env["id"]}: {mismatch + errors} differ'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--baseline', metavar='DECODETREE',
+                        help='another decodetree.py to compare with')
+    parser.add_argument('--count', type=int, default=3,
+                        help='number of runs per configuration')
+    args = parser.parse_args()
+
+    decoders = find_decoders()
+    print(f'{len(decoders)} decoders')
+
+    envs = [
+        {'id': 'process per decoder',
+         'func': lambda d, j: run_per_job(DECODETREE, d, j)},
+        {'id': 'batch', 'func': run_batch},
+    ]
+    if args.baseline:
+        baseline = os.path.abspath(args.baseline)
+        envs.insert(0, {'id': 'baseline',
+                        'func': lambda d, j: run_per_job(baseline, d, j)})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [{'id': 'target', 'dir': tmp, 'decoders': decoders}]
+        result = simplebench.bench(bench_func, envs, cases,
+                                   count=args.count)
+        check_outputs(tmp, envs)
+    print(results_to_text(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Benchmark the image helpers of iotests.py on GB-scale raw images
+#
+# Usage: tests/qemu-iotests/check -raw -- \
+#            scripts/simplebench/bench-iotests-images.py [--size GIB]
+#
+# It must be run through "check", which sets up the environment that
+# iotests.py needs. Images are created in its TEST_DIR.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import os
+import struct
+import subprocess
+import time
+
+import iotests
+
+import simplebench
+from results_to_text import results_to_text
+
+
+def create_image_per_sector(name, size):
+    """create_image(), as it used to write one sector at a time"""
+    with open(name, 'wb') as file:
+        i = 0
+        while i < size:
+            sector = struct.pack('>l504xl', i // 512, i // 512)
+            file.write(sector)
+            i = i + 512
+
+
+def compare_qemu_img(img1, img2):
+    try:
+        iotests.qemu_img('compare', '-f', 'raw', '-F', 'raw', img1, img2)
+        return True
+    except subprocess.CalledProcessError as exc:
+        if exc.returncode == 1:
+            return False
+        raise
+
+
+def bench_create(env, case):
+    start = time.monotonic()
+    env['func'](img1, case['size'])
+    return {'seconds': time.monotonic() - start}
+
+
+def bench_compare(env, case):
+    start = time.monotonic()
+    assert env['func'](img1, img2)
+    return {'seconds': time.monotonic() - start}
+
+
+def prepare_compare(case):
+    if case['sparse']:
+        # Mostly holes, with some data at both ends
+        for img in (img1, img2):
+            with open(img, 'wb') as f:
+                f.truncate(case['size'])
+                f.write(b'\1' * 1024 * 1024)
+                f.seek(case['size'] - 1024 * 1024)
+                f.write(b'\1' * 1024 * 1024)
+    else:
+        iotests.create_image(img1, case['size'])
+        iotests.create_image(img2, case['size'])
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=1,
+                    help='size of the fully allocated images, in GiB')
+parser.add_argument('--count', type=int, default=3,
+                    help='number of runs per configuration')
+args = parser.parse_args()
+
+GiB = 1024 * 1024 * 1024
+img1 = os.path.join(iotests.test_dir, 'bench-img1')
+img2 = os.path.join(iotests.test_dir, 'bench-img2')
+
+try:
+    create_cases = [{'id': f'create {args.size}G', 'size': args.size * GiB}]
+    create_envs = [
+        {'id': 'per sector', 'func': create_image_per_sector},
+        {'id': 'create_image', 'func': iotests.create_image},
+    ]
+    result = simplebench.bench(bench_create, create_envs, create_cases,
+                               count=args.count)
+    print(results_to_text(result))
+
+    compare_envs = [
+        {'id': 'qemu-img compare', 'func': compare_qemu_img},
+        {'id': 'compare_images',
+         'func': lambda a, b: iotests.compare_images(a, b, 'raw', 'raw')},
+    ]
+    for case in ({'id': f'compare {args.size}G', 'size': args.size * GiB,
+                  'sparse': False},
+                 {'id': f'compare {8 * args.size}G sparse',
+                  'size': 8 * args.size * GiB, 'sparse': True}):
+        prepare_compare(case)
+        result = simplebench.bench(bench_compare, compare_envs, [case],
+                                   count=args.count)
+        print(results_to_text(result))
+finally:
+    for img in (img1, img2):
+        iotests.try_remove(img)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#
+# Benchmark launch-to-ready latency of QEMU VMs, with and without MachinePool
+#
+# Usage: bench-machine-pool.py [--pattern STRING] QEMU_BINARY [QEMU_ARGS...]
+#
+# A VM is ready once STRING (e.g. a login prompt) has appeared on its
+# serial console, or as soon as QMP is up when no pattern is given.
+# Pooled VMs are restored from a snapshot of a VM that was ready.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'python'))
+from qemu.machine import MachinePool, QEMUMachine  # noqa: E402
+
+import simplebench  # noqa: E402
+from results_to_text import results_to_text  # noqa: E402
+
+
+def make_vm():
+    vm = QEMUMachine(args.binary, args=args.qemu_args)
+    if args.pattern:
+        vm.set_console()
+    return vm
+
+
+def boot(vm):
+    if args.pattern:
+        vm.console_socket.readuntil(args.pattern.encode(), timeout=300)
+
+
+def launch_plain(env, case):
+    start = time.monotonic()
+    vm = make_vm()
+    vm.launch()
+    boot(vm)
+    elapsed = time.monotonic() - start
+    vm.shutdown()
+    return {'seconds': elapsed}
+
+
+def launch_pooled(env, case):
+    pool = pools.get(env['id'])
+    if pool is None:
+        pool = MachinePool(make_vm, size=env['size'], boot=boot)
+        pool.fill()
+        pools[env['id']] = pool
+
+    start = time.monotonic()
+    vm = pool.acquire()
+    elapsed = time.monotonic() - start
+    # Not timed: shutting down, and restoring the next warm VM
+    pool.release(vm)
+    return {'seconds': elapsed}
+
+
+def launch(env, case):
+    return env['func'](env, case)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pattern',
+                    help='console output telling that the guest is ready')
+parser.add_argument('--count', type=int, default=5,
+                    help='number of launches per configuration')
+parser.add_argument('binary')
+parser.add_argument('qemu_args', nargs=argparse.REMAINDER)
+args = parser.parse_args()
+
+pools = {}
+
+test_cases = [{'id': 'launch to ready'}]
+test_envs = [
+    {'id': 'QEMUMachine.launch', 'func': launch_plain},
+    {'id': 'MachinePool (restore)', 'func': launch_pooled, 'size': 0},
+    {'id': 'MachinePool (warm)', 'func': launch_pooled, 'size': 1},
+]
+
+try:
+    result = simplebench.bench(launch, test_envs, test_cases,
+                               count=args.count)
+    print(results_to_text(result))
+finally:
+    for p in pools.values():
+        p.close()
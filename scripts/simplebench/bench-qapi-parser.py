@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+#
+# Benchmark parsing the QAPI schemas of the tree with different versions of
+# the QAPI generator
+#
+# Usage: bench-qapi-parser.py [--count N] [LABEL:SCRIPTS_DIR...]
+#
+# SCRIPTS_DIR is the scripts/ directory of a QEMU source tree, for example
+# of a "git worktree" checked out at an older revision.  The default is to
+# benchmark the scripts of this tree only.  Every version must parse the
+# schemas into the same expressions.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import simplebench
+from results_to_text import results_to_text
+
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SCHEMAS = [os.path.join(SRC_DIR, s) for s in (
+    'qapi/qapi-schema.json',
+    'storage-daemon/qapi/qapi-schema.json',
+    'qga/qapi-schema.json',
+)]
+
+# Run in a separate interpreter for each version of the generator, so that
+# only the parsing itself is timed
+CHILD = '''
+import hashlib, json, sys, time
+from qapi.parser import QAPISchemaParser
+from qapi.schema import QAPISchema
+
+what, schemas = sys.argv[1], sys.argv[2:]
+digest = hashlib.sha256()
+start = time.perf_counter()
+for fname in schemas:
+    if what == 'parse':
+        parser = QAPISchemaParser(fname)
+        for expr in parser.exprs:
+            digest.update(repr((dict(expr), str(expr.info))).encode())
+    else:
+        QAPISchema(fname)
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'digest': digest.hexdigest()}))
+'''
+
+
+def bench_func(env, case):
+    res = subprocess.run([sys.executable, '-c', CHILD, case['id']] + SCHEMAS,
+                         env=dict(os.environ, PYTHONPATH=env['dir']),
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         text=True, check=False)
+    if res.returncode != 0:
+        return {'error': res.stdout}
+    return json.loads(res.stdout)
+
+
+def check_results(result):
+    for case in result['cases']:
+        digests = set()
+        for env in result['envs']:
+            digests |= {r['digest'] for r in
+                        result['tab'][case['id']][env['id']]['runs']
+                        if 'digest' in r}
+        assert len(digests) <= 1, f'{case["id"]}: results differ'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10,
+                        help='number of runs per version')
+    parser.add_argument('env', nargs='*',
+                        default=[f'current:{SRC_DIR}/scripts'],
+                        help='LABEL:SCRIPTS_DIR of a version to benchmark')
+    args = parser.parse_args()
+
+    envs = []
+    for env in args.env:
+        label, path = env.split(':', 1)
+        envs.append({'id': label, 'dir': os.path.abspath(path)})
+    cases = [
+        {'id': 'parse'},
+        {'id': 'check'},
+    ]
+
+    result = simplebench.bench(bench_func, envs, cases, count=args.count)
+    check_results(result)
+    print(results_to_text(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Benchmark routing of QMP events with eager and lazy Message parsing
+#
+# Usage: bench-qmp-events.py [RECORDED_STREAM]
+#
+# RECORDED_STREAM holds one QMP message per line, as received from QEMU.
+# Without it, a synthetic stream of BLOCK_JOB_* events is used.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'python'))
+from qemu.qmp.message import Message  # noqa: E402
+
+import simplebench  # noqa: E402
+from results_to_text import results_to_text  # noqa: E402
+
+
+def synthetic_stream(count):
+    lines = []
+    for i in range(count):
+        event = {
+            'timestamp': {'seconds': 1700000000 + i, 'microseconds': i % 10**6},
+            'event': ('BLOCK_JOB_PENDING', 'BLOCK_JOB_READY',
+                      'BLOCK_JOB_COMPLETED')[i % 3],
+            'data': {'type': 'mirror', 'id': f'job{i % 64}',
+                     'device': f'drive{i % 64}', 'len': 10737418240,
+                     'offset': i * 65536, 'speed': 0,
+                     'status': [{'node': f'n{j}', 'ok': True}
+                                for j in range(8)]},
+        }
+        lines.append(json.dumps(event).encode() + b'\n')
+    return lines
+
+
+def route(env, case):
+    """ Route every message by event name, like QMPClient._on_message. """
+    eager = env['eager']
+    read_data = case['read_data']
+    names = set()
+
+    start = time.monotonic()
+    for line in stream:
+        msg = Message(line, eager=eager)
+        if 'event' in msg:
+            names.add(msg['event'])
+            if read_data:
+                msg.get('data')
+    elapsed = time.monotonic() - start
+
+    return {'iops': len(stream) / elapsed}
+
+
+if len(sys.argv) > 1:
+    with open(sys.argv[1], 'rb') as f:
+        stream = [line for line in f if line.strip()]
+else:
+    stream = synthetic_stream(100000)
+
+test_cases = [
+    {'id': 'route by name', 'read_data': False},
+    {'id': 'route and read data', 'read_data': True},
+]
+
+test_envs = [
+    {'id': 'eager', 'eager': True},
+    {'id': f'lazy ({Message.decoder.__module__})', 'eager': False},
+]
+
+result = simplebench.bench(route, test_envs, test_cases, count=3)
+print(results_to_text(result))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Benchmark pipelined QMP command execution against a fake QMP server
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'python'))
+from qemu.qmp import QMPClient  # noqa: E402
+
+import simplebench  # noqa: E402
+from results_to_text import results_to_text  # noqa: E402
+
+
+GREETING = {'QMP': {'version': {'qemu': {'micro': 0, 'minor': 0, 'major': 9},
+                                'package': ''},
+                    'capabilities': []}}
+
+
+async def fake_qmp_server(reader, writer):
+    """ Answer every command with an empty return, like qom-set would. """
+    decoder = json.JSONDecoder()
+    writer.write(json.dumps(GREETING).encode() + b'\n')
+    buf = ''
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        buf += data.decode()
+        while True:
+            buf = buf.lstrip()
+            try:
+                cmd, end = decoder.raw_decode(buf)
+            except ValueError:
+                # Empty or incomplete command
+                break
+            buf = buf[end:]
+            reply = {'return': {}}
+            if 'id' in cmd:
+                reply['id'] = cmd['id']
+            writer.write(json.dumps(reply).encode() + b'\n')
+        await writer.drain()
+    writer.close()
+
+
+async def run_commands(env, case):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sock = os.path.join(tmpdir, 'qmp.sock')
+        server = await asyncio.start_unix_server(fake_qmp_server, sock)
+        qmp = QMPClient('bench')
+        await qmp.connect(sock)
+
+        msgs = [qmp.make_execute_msg('qom-get', {'path': '/machine',
+                                                 'property': 'type'})
+                for _ in range(case['count'])]
+        start = time.monotonic()
+        if env['window'] is None:
+            for msg in msgs:
+                await qmp.execute_msg(msg)
+        else:
+            await qmp.execute_many(msgs, window=env['window'])
+        elapsed = time.monotonic() - start
+
+        await qmp.disconnect()
+        server.close()
+        await server.wait_closed()
+
+    return {'iops': case['count'] / elapsed}
+
+
+def bench_func(env, case):
+    """ Handle one "cell" of benchmarking table. """
+    return asyncio.run(run_commands(env, case))
+
+
+test_cases = [
+    {'id': '100 commands', 'count': 100},
+    {'id': '10000 commands', 'count': 10000},
+]
+
+test_envs = [
+    {'id': 'execute', 'window': None},
+    {'id': 'execute_many(8)', 'window': 8},
+    {'id': 'execute_many(256)', 'window': 256},
+]
+
+result = simplebench.bench(bench_func, test_envs, test_cases, count=3)
+print(results_to_text(result))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Benchmark generating the trace files of the whole tree with tracetool,
+# one process per output file (as meson does) and in batch mode
+#
+# Usage: bench-tracetool.py [--backends BACKENDS] [--jobs N] [--count N]
+#
+# The outputs of every mode are checked to be identical.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import argparse
+import filecmp
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import simplebench
+from results_to_text import results_to_text
+
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+TRACETOOL = os.path.join(SRC_DIR, 'scripts', 'tracetool.py')
+FORMATS = ('h', 'c', 'rs')
+
+
+def find_groups():
+    """Return the (group name, trace-events path) of the tree"""
+    groups = []
+    for root, dirs, files in os.walk(SRC_DIR):
+        dirs[:] = sorted(d for d in dirs
+                         if not d.startswith(('.', 'build')))
+        if 'trace-events' in files:
+            rel = os.path.relpath(root, SRC_DIR)
+            name = 'root' if rel == '.' else rel.replace('/', '_') \
+                                                .replace('-', '_')
+            groups.append((name, os.path.join(root, 'trace-events')))
+    return groups
+
+
+def job_args(group, events, fmt):
+    # Outputs are relative to the directory tracetool runs in, as their
+    # name ends up in the generated files
+    return [f'--group={group}', f'--format={fmt}', events,
+            f'trace-{group}.{fmt}']
+
+
+def run_per_job(out_dir, groups, backends):
+    for group, events in groups:
+        for fmt in FORMATS:
+            subprocess.run([sys.executable, TRACETOOL,
+                            f'--backends={backends}'] +
+                           job_args(group, events, fmt),
+                           cwd=out_dir, check=True)
+
+
+def run_batch(out_dir, groups, backends, jobs):
+    manifest = os.path.join(out_dir, 'manifest')
+    with open(manifest, 'w', encoding='utf-8') as f:
+        for group, events in groups:
+            for fmt in FORMATS:
+                f.write(shlex.join(job_args(group, events, fmt)) + '\n')
+    subprocess.run([sys.executable, TRACETOOL, f'--backends={backends}',
+                    f'--batch={manifest}', f'--jobs={jobs}'],
+                   cwd=out_dir, check=True)
+
+
+def bench_func(env, case):
+    out_dir = os.path.join(case['dir'], env['id'].replace(' ', '_'))
+    if not case['keep']:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir, exist_ok=True)
+
+    start = time.monotonic()
+    env['func'](out_dir, case['groups'], case['backends'])
+    return {'seconds': time.monotonic() - start}
+
+
+def check_outputs(base_dir, envs):
+    ref = None
+    for env in envs:
+        out_dir = os.path.join(base_dir, env['id'].replace(' ', '_'))
+        files = sorted(f for f in os.listdir(out_dir) if f != 'manifest')
+        if ref is None:
+            ref = (out_dir, files)
+            continue
+        assert files == ref[1], f'{env["id"]}: different outputs'
+        _, mismatch, errors = filecmp.cmpfiles(ref[0], out_dir, files,
+                                               shallow=False)
+        assert not mismatch and not errors, \
+            f'{env["id"]}: {mismatch + errors} differ'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', default='log,simple',
+                        help='trace backends to generate code for')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='processes for the parallel batch mode')
+    parser.add_argument('--count', type=int, default=3,
+                        help='number of runs per configuration')
+    args = parser.parse_args()
+
+    groups = find_groups()
+    print(f'{len(groups)} trace-events files, '
+          f'{len(groups) * len(FORMATS)} outputs')
+
+    envs = [
+        {'id': 'process per output', 'func': run_per_job},
+        {'id': 'batch',
+         'func': lambda d, g, b: run_batch(d, g, b, 1)},
+        {'id': f'batch -j{args.jobs}',
+         'func': lambda d, g, b: run_batch(d, g, b, args.jobs)},
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [
+            {'id': 'clean', 'dir': tmp, 'keep': False,
+             'groups': groups, 'backends': args.backends},
+            {'id': 'unchanged', 'dir': tmp, 'keep': True,
+             'groups': groups, 'backends': args.backends},
+        ]
+        result = simplebench.bench(bench_func, envs, cases,
+                                   count=args.count)
+        check_outputs(tmp, envs)
+    print(results_to_text(result))
+
+
+if __name__ == '__main__':
+    main()
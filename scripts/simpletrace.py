@@ -9,14 +9,25 @@
 #
 # For help see docs/devel/tracing.rst
 
+import io
+import os
+import json
 import sys
+import mmap
+import time
+import signal
 import struct
 import inspect
 import warnings
+import collections
+import concurrent.futures
+from array import array
 from tracetool import read_events, Event
 from tracetool.backend.simple import is_string
 
-__all__ = ['Analyzer', 'Analyzer2', 'process', 'run']
+__all__ = ['Analyzer', 'Analyzer2', 'TraceColumns', 'TraceFollower', 'TraceIndex',
+           'convert', 'follow', 'process', 'process_sharded', 'read_trace_columns', 'run',
+           'update_index']
 
 # This is the binary format that the QEMU "simple" trace backend
 # emits. There is no specification documentation because the format is
@@ -71,6 +82,240 @@ def read_trace_header(fobj):
     if log_version != 4:
         raise ValueError(f'Log format {log_version} not supported with this QEMU release!')
 
+def _build_decoder(event):
+    """Build a function decoding the argument payload of @event.
+
+    Runs of fixed-width arguments are unpacked with a single precompiled
+    struct.Struct.  String arguments are prefixed by a 32-bit length.  The
+    returned function takes (buffer, offset) and returns a tuple of args.
+    """
+    steps = []
+    nfixed = 0
+    for type, _ in event.args:
+        if is_string(type):
+            if nfixed:
+                steps.append(struct.Struct('=%dQ' % nfixed))
+                nfixed = 0
+            steps.append(None)
+        else:
+            nfixed += 1
+    if nfixed:
+        steps.append(struct.Struct('=%dQ' % nfixed))
+
+    if not steps:
+        return lambda buf, offset: ()
+    if len(steps) == 1 and steps[0] is not None:
+        return steps[0].unpack_from
+
+    unpack_len = _u32.unpack_from
+    def decode(buf, offset):
+        args = []
+        for step in steps:
+            if step is None:
+                (length,) = unpack_len(buf, offset)
+                offset += 4
+                args.append(buf[offset:offset + length])
+                offset += length
+            else:
+                args.extend(step.unpack_from(buf, offset))
+                offset += step.size
+        return tuple(args)
+    return decode
+
+_u32 = struct.Struct('=L')
+_u64 = struct.Struct('=Q')
+_rec_struct = struct.Struct('=Q' + rec_header_fmt[1:])
+_mapping_struct = struct.Struct('=QQL')
+
+class _RecordScanner:
+    """Incremental decoder for the records of a trace log.
+
+    Keeps the event ID to name mapping and one decode plan per event ID, so
+    that a log can be fed in one buffer or in consecutive chunks.
+    """
+
+    def __init__(self, events, read_header):
+        frameinfo = inspect.getframeinfo(inspect.currentframe())
+        dropped_event = Event.build("Dropped_Event(uint64_t num_events_dropped)",
+                                    frameinfo.lineno + 1, frameinfo.filename)
+
+        self.event_mapping = {e.name: e for e in events}
+        self.event_mapping["dropped"] = dropped_event
+        self.event_id_to_name = {dropped_event_id: "dropped"}
+
+        # If there is no header assume event ID mapping matches events list
+        if not read_header:
+            for event_id, event in enumerate(events):
+                self.event_id_to_name[event_id] = event.name
+
+        # event ID -> (event, event name, decoder)
+        self._plans = {}
+        self.offset = 0
+
+    def _build_plan(self, event_id):
+        try:
+            event_name = self.event_id_to_name[event_id]
+        except KeyError:
+            raise SimpleException(f'unknown event id {event_id} in trace file')
+        try:
+            event = self.event_mapping[event_name]
+        except KeyError as e:
+            raise SimpleException(
+                f'{e} event is logged but is not declared in the trace events'
+                'file, try using trace-events-all instead.'
+            )
+        plan = (event, event_name, _build_decoder(event))
+        self._plans[event_id] = plan
+        return plan
+
+    def scan(self, buf, offset, end):
+        """Yield (event, event_name, timestamp_ns, pid, args) for records.
+
+        Only complete records in buf[offset:end] are decoded.  On return,
+        self.offset is the position of the first byte not consumed, which is
+        @end unless the buffer finishes with a partial record.
+        """
+        plans = self._plans
+        build_plan = self._build_plan
+        unpack_rec = _rec_struct.unpack_from
+        unpack_mapping = _mapping_struct.unpack_from
+        rec_len = _rec_struct.size
+        mapping_len = _mapping_struct.size
+
+        self.offset = offset
+        while offset + 8 <= end:
+            (rectype,) = _u64.unpack_from(buf, offset)
+            if rectype == record_type_mapping:
+                if offset + mapping_len > end:
+                    break
+                _, event_id, name_len = unpack_mapping(buf, offset)
+                next_offset = offset + mapping_len + name_len
+                if next_offset > end:
+                    break
+                name = bytes(buf[offset + mapping_len:next_offset]).decode()
+                self.event_id_to_name[event_id] = name
+                plans.pop(event_id, None)
+            else:
+                if offset + rec_len > end:
+                    break
+                _, event_id, timestamp_ns, record_length, pid = unpack_rec(buf, offset)
+                next_offset = offset + 8 + record_length
+                if next_offset > end:
+                    break
+                plan = plans.get(event_id)
+                if plan is None:
+                    plan = build_plan(event_id)
+                event, event_name, decode = plan
+                args = decode(buf, offset + rec_len)
+                self.offset = next_offset
+                yield (event, event_name, timestamp_ns, pid, args)
+            offset = next_offset
+            self.offset = offset
+
+    def scan_columns(self, buf, offset, end, batches, seq, limit):
+        """Append up to @limit complete records of buf[offset:end] to @batches.
+
+        @batches maps event names to TraceColumns and is extended as new
+        events are seen; @seq is the index of the first record.  Unlike
+        scan(), no per-record tuple is built for events that only have
+        fixed-width arguments: their payload is copied as is and split into
+        columns by TraceColumns.finish().  Returns the number of records
+        appended and updates self.offset like scan().
+        """
+        plans = self._plans
+        build_plan = self._build_plan
+        unpack_rec = _rec_struct.unpack_from
+        unpack_mapping = _mapping_struct.unpack_from
+        rec_len = _rec_struct.size
+        mapping_len = _mapping_struct.size
+
+        count = 0
+        while count < limit and offset + 8 <= end:
+            (rectype,) = _u64.unpack_from(buf, offset)
+            if rectype == record_type_mapping:
+                if offset + mapping_len > end:
+                    break
+                _, event_id, name_len = unpack_mapping(buf, offset)
+                next_offset = offset + mapping_len + name_len
+                if next_offset > end:
+                    break
+                name = bytes(buf[offset + mapping_len:next_offset]).decode()
+                self.event_id_to_name[event_id] = name
+                plans.pop(event_id, None)
+            else:
+                if offset + rec_len > end:
+                    break
+                _, event_id, timestamp_ns, record_length, pid = unpack_rec(buf, offset)
+                next_offset = offset + 8 + record_length
+                if next_offset > end:
+                    break
+                plan = plans.get(event_id)
+                if plan is None:
+                    plan = build_plan(event_id)
+                event, event_name, decode = plan
+                batch = batches.get(event_name)
+                if batch is None:
+                    batch = batches[event_name] = TraceColumns(event)
+                batch.seq.append(seq + count)
+                batch.timestamp_ns.append(timestamp_ns)
+                batch.pid.append(pid)
+                raw = batch._raw
+                if raw is not None:
+                    payload = offset + rec_len
+                    raw += buf[payload:payload + batch._raw_len]
+                else:
+                    for column, value in zip(batch.args, decode(buf, offset + rec_len)):
+                        column.append(value)
+                count += 1
+            offset = next_offset
+        self.offset = offset
+        return count
+
+def _map_file(fobj):
+    """Return a read-only mmap of fobj, or None if it cannot be mapped."""
+    try:
+        fileno = fobj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    try:
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # Empty files, pipes and other non-regular files
+        return None
+
+def _file_buffers(scanner, fobj, chunk_size=1 << 20):
+    """Yield (buffer, offset, end) triples covering the remainder of fobj.
+
+    Regular files are memory-mapped and yielded as a single buffer; anything
+    else is read in chunks of @chunk_size bytes.  The consumer must leave
+    scanner.offset at the first byte it did not decode; undecoded bytes are
+    carried over to the next chunk.
+    """
+    buf = _map_file(fobj)
+    if buf is not None:
+        with buf:
+            yield buf, fobj.tell(), len(buf)
+            fobj.seek(scanner.offset)
+            if scanner.offset != len(buf):
+                raise SimpleException('Error reading header. Truncated trace record at end of file.')
+        return
+
+    pending = b''
+    while True:
+        chunk = fobj.read(chunk_size)
+        if not chunk:
+            break
+        buf = pending + chunk if pending else chunk
+        yield buf, 0, len(buf)
+        pending = buf[scanner.offset:]
+    if pending:
+        raise SimpleException('Error reading header. Truncated trace record at end of file.')
+
+def _scan_file(scanner, fobj, chunk_size=1 << 20):
+    """Feed the remainder of fobj through scanner."""
+    for buf, offset, end in _file_buffers(scanner, fobj, chunk_size):
+        yield from scanner.scan(buf, offset, end)
+
 def read_trace_records(events, fobj, read_header):
     """Deserialize trace records from a file, yielding record tuples (event, event_num, timestamp, pid, arg1, ..., arg6).
 
@@ -80,55 +325,252 @@ def read_trace_records(events, fobj, read_header):
         read_header (bool): whether headers were read from fobj
 
     """
-    frameinfo = inspect.getframeinfo(inspect.currentframe())
-    dropped_event = Event.build("Dropped_Event(uint64_t num_events_dropped)",
-                                frameinfo.lineno + 1, frameinfo.filename)
+    scanner = _RecordScanner(events, read_header)
+    for event, event_name, timestamp_ns, pid, args in _scan_file(scanner, fobj):
+        yield (event, event_name, timestamp_ns, pid) + args
+
+class TraceColumns:
+    """A batch of records of a single event, stored column by column.
+
+    Attributes:
+        event (Event): the event all records in the batch belong to
+        seq (array): index of each record in the trace file
+        timestamp_ns (array): timestamps in nanoseconds
+        pid (array): recorded process ids
+        args (list): one column per event argument; integer arguments are
+            array('Q') and string arguments are lists of bytes
+    """
 
-    event_mapping = {e.name: e for e in events}
-    event_mapping["dropped"] = dropped_event
-    event_id_to_name = {dropped_event_id: "dropped"}
+    def __init__(self, event):
+        self.event = event
+        self.seq = array('Q')
+        self.timestamp_ns = array('Q')
+        self.pid = array('I')
+        self.args = [[] if is_string(type) else array('Q')
+                     for type, _ in event.args]
+        # Payloads of events without strings are gathered as raw bytes
+        if any(is_string(type) for type, _ in event.args):
+            self._raw = None
+        else:
+            self._raw = bytearray()
+            self._raw_len = 8 * len(event.args)
 
-    # If there is no header assume event ID mapping matches events list
-    if not read_header:
-        for event_id, event in enumerate(events):
-            event_id_to_name[event_id] = event.name
+    def finish(self):
+        """Split gathered raw payloads into the argument columns."""
+        if self._raw:
+            view = memoryview(self._raw).cast('Q')
+            nargs = len(self.args)
+            for i, column in enumerate(self.args):
+                column.frombytes(view[i::nargs].tobytes())
+            view.release()
+            self._raw = bytearray()
 
-    while True:
-        t = fobj.read(8)
-        if len(t) == 0:
-            break
+    def __len__(self):
+        return len(self.seq)
 
-        (rectype, ) = struct.unpack('=Q', t)
-        if rectype == record_type_mapping:
-            event_id, event_name = get_mapping(fobj)
-            event_id_to_name[event_id] = event_name
-        else:
-            event_id, timestamp_ns, pid, args_payload = read_record(fobj)
-            event_name = event_id_to_name[event_id]
-
-            try:
-                event = event_mapping[event_name]
-            except KeyError as e:
-                raise SimpleException(
-                    f'{e} event is logged but is not declared in the trace events'
-                    'file, try using trace-events-all instead.'
-                )
+def read_trace_columns(events, fobj, read_header, batch_size=65536):
+    """Deserialize trace records from a file into per-event column batches.
 
-            offset = 0
-            args = []
-            for type, _ in event.args:
-                if is_string(type):
-                    (length,) = struct.unpack_from('=L', args_payload, offset=offset)
-                    offset += 4
-                    s = args_payload[offset:offset+length]
-                    offset += length
-                    args.append(s)
-                else:
-                    (value,) = struct.unpack_from('=Q', args_payload, offset=offset)
-                    offset += 8
-                    args.append(value)
+    Records are accumulated per event; whenever @batch_size records have been
+    read, a TraceColumns batch is yielded for every event seen since the
+    previous flush.  Use the seq column to restore the original order.
+
+    Args:
+        events (list): list of events already produced by tracetool.read_events
+        fobj (file): input file
+        read_header (bool): whether headers were read from fobj
+        batch_size (int): number of records to read between flushes
+    """
+    scanner = _RecordScanner(events, read_header)
+    batches = {}
+    pending = 0
+    seq = 0
+    for buf, offset, end in _file_buffers(scanner, fobj):
+        while True:
+            count = scanner.scan_columns(buf, offset, end, batches, seq,
+                                         batch_size - pending)
+            offset = scanner.offset
+            seq += count
+            pending += count
+            if pending < batch_size:
+                break
+            for batch in batches.values():
+                batch.finish()
+                yield batch
+            batches = {}
+            pending = 0
+    for batch in batches.values():
+        batch.finish()
+        yield batch
+
+# NumPy dtypes of the argument types accepted by tracetool.validate_type(),
+# normalized like tracetool.c_type_to_rust() does
+_C_TO_NUMPY_TYPE_MAP = {
+    "int": "i4",
+    "long": "i8",
+    "long long": "i8",
+    "short": "i2",
+    "char": "i1",
+    "bool": "b1",
+    "unsigned": "u4",
+    "long unsigned": "u8",
+    "long long unsigned": "u8",
+    "short unsigned": "u2",
+    "char unsigned": "u1",
+    "int8_t": "i1",
+    "uint8_t": "u1",
+    "int16_t": "i2",
+    "uint16_t": "u2",
+    "int32_t": "i4",
+    "uint32_t": "u4",
+    "int64_t": "i8",
+    "uint64_t": "u8",
+    "size_t": "u8",
+    "ssize_t": "i8",
+    "uintptr_t": "u8",
+    "ptrdiff_t": "i8",
+}
+
+def _numpy_type(c_type):
+    """Return the NumPy kind and size of a non-string trace argument type."""
+    if '*' in c_type:
+        return 'u8'
+    bits = [bit for bit in c_type.split() if bit not in ('const', 'signed')]
+    if len(bits) > 1 and 'int' in bits:
+        bits.remove('int')
+    return _C_TO_NUMPY_TYPE_MAP.get(' '.join(sorted(bits)), 'u8')
+
+class _NpyWriter:
+    """Append-only writer of a one-dimensional .npy file.
+
+    The header is padded to a fixed size so that the final shape can be
+    written in place when the file is closed.
+    """
 
-            yield (event_mapping[event_name], event_name, timestamp_ns, pid) + tuple(args)
+    _header_len = 128
+
+    def __init__(self, path, descr):
+        self._fobj = open(path, 'wb')
+        self.path = path
+        self.descr = descr
+        self.count = 0
+        self._write_header()
+
+    def _write_header(self):
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (
+            self.descr, self.count)
+        header = header.ljust(self._header_len - 10 - 1) + '\n'
+        self._fobj.write(b'\x93NUMPY\x01\x00' +
+                         struct.pack('<H', len(header)) + header.encode('latin1'))
+
+    def append(self, data, count):
+        self._fobj.write(data)
+        self.count += count
+
+    def close(self):
+        self._fobj.seek(0)
+        self._write_header()
+        self._fobj.close()
+
+def _narrow(column, dtype):
+    """Return the bytes of a uint64 column truncated to a dtype's size."""
+    size = int(dtype[1:])
+    if size == 8:
+        return column.tobytes()
+    ratio = 8 // size
+    first = 0 if sys.byteorder == 'little' else ratio - 1
+    view = memoryview(column).cast('B').cast({1: 'B', 2: 'H', 4: 'I'}[size])
+    return view[first::ratio].tobytes()
+
+def convert(events, log, output_dir, read_header=True, batch_size=65536):
+    """Convert a trace log to per-event tables of NumPy .npy columns.
+
+    For every event in the log a directory named after the event is created
+    in @output_dir, holding seq.npy, timestamp_ns.npy, pid.npy and one file
+    per argument.  Integer arguments are stored with the width and signedness
+    of their C type.  String arguments are dictionary-encoded: <name>.npy
+    holds uint32 codes into the byte strings of <name>.dict.npy.
+
+    Records are decoded in batches of @batch_size, so memory use does not
+    depend on the size of the log, apart from the string dictionaries.
+
+    Args:
+        events (file-object or list or str): events list or file-like object or file path as str to read event data from
+        log (file-object or str): file-like object or file path as str to read log data from
+        output_dir (str): directory to write the tables to
+        read_header (bool, optional): Whether to read header data from the log data. Defaults to True.
+        batch_size (int, optional): Number of records decoded at a time.
+    """
+    events_list = _read_events_list(events)
+    endian = '<' if sys.byteorder == 'little' else '>'
+    tables = {}
+
+    def open_table(event):
+        table_dir = os.path.join(output_dir, event.name)
+        os.makedirs(table_dir, exist_ok=True)
+        columns = {
+            'seq': _NpyWriter(os.path.join(table_dir, 'seq.npy'), endian + 'u8'),
+            'timestamp_ns': _NpyWriter(os.path.join(table_dir, 'timestamp_ns.npy'), endian + 'u8'),
+            'pid': _NpyWriter(os.path.join(table_dir, 'pid.npy'), endian + 'u4'),
+        }
+        args = []
+        for type, name in event.args:
+            if is_string(type):
+                writer = _NpyWriter(os.path.join(table_dir, name + '.npy'), endian + 'u4')
+                args.append((writer, None, {}))
+            else:
+                dtype = _numpy_type(type)
+                writer = _NpyWriter(os.path.join(table_dir, name + '.npy'),
+                                    ('|' if dtype[1] == '1' else endian) + dtype)
+                args.append((writer, dtype, None))
+        return table_dir, columns, args
+
+    def write_batch(batch):
+        if batch.event.name not in tables:
+            tables[batch.event.name] = open_table(batch.event)
+        _, columns, args = tables[batch.event.name]
+        count = len(batch)
+        columns['seq'].append(batch.seq.tobytes(), count)
+        columns['timestamp_ns'].append(batch.timestamp_ns.tobytes(), count)
+        columns['pid'].append(batch.pid.tobytes(), count)
+        for (writer, dtype, strings), column in zip(args, batch.args):
+            if strings is None:
+                writer.append(_narrow(column, dtype), count)
+            else:
+                codes = array('I', [strings.setdefault(value, len(strings))
+                                    for value in column])
+                writer.append(codes.tobytes(), count)
+
+    def close_tables():
+        for table_dir, columns, args in tables.values():
+            for writer in columns.values():
+                writer.close()
+            for writer, _, strings in args:
+                writer.close()
+                if strings is None:
+                    continue
+                width = max(map(len, strings), default=0) or 1
+                dict_path = writer.path[:-len('.npy')] + '.dict.npy'
+                dict_writer = _NpyWriter(dict_path, f'|S{width}')
+                dict_writer.append(b''.join(value.ljust(width, b'\0')
+                                            for value in strings), len(strings))
+                dict_writer.close()
+
+    def convert_fobj(log_fobj):
+        if read_header:
+            read_trace_header(log_fobj)
+        try:
+            for batch in read_trace_columns(events_list, log_fobj, read_header, batch_size):
+                write_batch(batch)
+        finally:
+            close_tables()
+
+    os.makedirs(output_dir, exist_ok=True)
+    if isinstance(log, str):
+        with open(log, 'rb') as log_fobj:
+            convert_fobj(log_fobj)
+    else:
+        convert_fobj(log)
 
 class Analyzer:
     """[Deprecated. Refer to Analyzer2 instead.]
@@ -206,6 +648,12 @@ def _process_event(self, rec_args, *, event, event_id, timestamp_ns, pid, **kwar
             self._fn_cache[event_id] = self._build_fn(event)
         self._fn_cache[event_id](event, rec)
 
+    def flush(self):
+        """Called periodically while following a live trace.
+
+        Useful to report rolling aggregates; see TraceFollower."""
+        pass
+
     def end(self):
         """Called at the end of the trace."""
         pass
@@ -269,34 +717,301 @@ def _process_event(self, rec_args, *, event, **kwargs):
         fn = getattr(self, event.name, self.catchall)
         fn(*rec_args, event=event, **kwargs)
 
-def process(events, log, analyzer, read_header=True):
+    def merge(self, other):
+        """Fold the partial results of @other into this analyzer.
+
+        Called by process_sharded() to reduce the analyzers that each saw a
+        consecutive slice of the trace.  @other always covers the records
+        that directly follow those seen by self.  Analyzers that support
+        sharded processing must override this method.
+        """
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support sharded processing')
+
+def _read_events_list(events):
+    if isinstance(events, str):
+        with open(events, 'r') as f:
+            return read_events(f, events)
+    elif isinstance(events, list):
+        # Treat as a list of events already produced by tracetool.read_events
+        return events
+    else:
+        # Treat as an already opened file-object
+        return read_events(events, events.name)
+
+class TraceIndex:
+    """Sidecar index of a trace file for seeking by time and event.
+
+    The log is split into blocks of about @block_size bytes that end on
+    record boundaries.  For every block the index keeps its byte range and
+    the smallest and largest timestamp in it, and for every event ID a
+    bitmap of the blocks containing that event.  The event ID to name
+    mapping seen so far is stored as well, so that blocks can be decoded
+    without reading the mapping records that precede them.
+
+    Indexing is incremental: update() only rescans the last block and
+    whatever was appended to the file since.
+    """
+
+    version = 1
+
+    def __init__(self, block_size=1 << 20):
+        self.block_size = block_size
+        # Hex dump of the start of the file and of the end of the indexed part
+        self.fingerprint = None
+        self.tail = None
+        self.data_offset = 0
+        # [start offset, end offset, min timestamp, max timestamp]
+        self.blocks = []
+        # event ID -> bitmap of blocks, as an int
+        self.event_blocks = {}
+        self.event_id_to_name = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save(), or return None if unusable."""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != cls.version:
+            return None
+        index = cls(data['block_size'])
+        index.fingerprint = data['fingerprint']
+        index.tail = data['tail']
+        index.data_offset = data['data_offset']
+        index.blocks = data['blocks']
+        index.event_blocks = {int(k): int(v, 16) for k, v in data['events'].items()}
+        index.event_id_to_name = {int(k): v for k, v in data['mapping'].items()}
+        return index
+
+    def save(self, path):
+        data = {
+            'version': self.version,
+            'block_size': self.block_size,
+            'fingerprint': self.fingerprint,
+            'tail': self.tail,
+            'data_offset': self.data_offset,
+            'blocks': self.blocks,
+            'events': {str(k): f'{v:x}' for k, v in self.event_blocks.items()},
+            'mapping': {str(k): v for k, v in self.event_id_to_name.items()},
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def _reset(self, fingerprint, data_offset):
+        self.fingerprint = fingerprint
+        self.tail = None
+        self.data_offset = data_offset
+        self.blocks = []
+        self.event_blocks = {}
+        self.event_id_to_name = {}
+
+    @staticmethod
+    def _tail(buf, offset):
+        return bytes(buf[max(offset - 64, 0):offset]).hex()
+
+    def update(self, buf, read_header=True):
+        """Index the records of buf that are not indexed yet.
+
+        A trailing partial record is left for a later update.  The index is
+        rebuilt from scratch if buf does not start like the indexed file.
+        """
+        hlen = struct.calcsize(log_header_fmt) if read_header else 0
+        fingerprint = bytes(buf[:64]).hex()
+        if fingerprint != self.fingerprint or \
+           (self.blocks and self._tail(buf, self.blocks[-1][1]) != self.tail):
+            if read_header:
+                read_trace_header(io.BytesIO(buf[:hlen]))
+            self._reset(fingerprint, hlen)
+
+        # The last block may have been cut short by the end of the file
+        if self.blocks:
+            offset = self.blocks.pop()[0]
+            mask = ~(1 << len(self.blocks))
+            for event_id in self.event_blocks:
+                self.event_blocks[event_id] &= mask
+        else:
+            offset = self.data_offset
+
+        unpack_u64 = _u64.unpack_from
+        unpack_rec = _rec_struct.unpack_from
+        unpack_mapping = _mapping_struct.unpack_from
+        rec_len = _rec_struct.size
+        mapping_len = _mapping_struct.size
+        event_blocks = self.event_blocks
+        end = len(buf)
+
+        block_start = offset
+        block_bit = 1 << len(self.blocks)
+        min_ts = max_ts = None
+        seen = set()
+        while offset + 8 <= end:
+            if offset - block_start >= self.block_size:
+                self.blocks.append([block_start, offset, min_ts, max_ts])
+                for event_id in seen:
+                    event_blocks[event_id] = event_blocks.get(event_id, 0) | block_bit
+                block_start = offset
+                block_bit <<= 1
+                min_ts = max_ts = None
+                seen = set()
+
+            (rectype,) = unpack_u64(buf, offset)
+            if rectype == record_type_mapping:
+                if offset + mapping_len > end:
+                    break
+                _, event_id, name_len = unpack_mapping(buf, offset)
+                if offset + mapping_len + name_len > end:
+                    break
+                name = bytes(buf[offset + mapping_len:offset + mapping_len + name_len])
+                self.event_id_to_name[event_id] = name.decode()
+                offset += mapping_len + name_len
+            else:
+                if offset + rec_len > end:
+                    break
+                _, event_id, timestamp_ns, record_length, _ = unpack_rec(buf, offset)
+                if offset + 8 + record_length > end:
+                    break
+                seen.add(event_id)
+                if min_ts is None or timestamp_ns < min_ts:
+                    min_ts = timestamp_ns
+                if max_ts is None or timestamp_ns > max_ts:
+                    max_ts = timestamp_ns
+                offset += 8 + record_length
+
+        if offset != block_start:
+            self.blocks.append([block_start, offset, min_ts, max_ts])
+            for event_id in seen:
+                event_blocks[event_id] = event_blocks.get(event_id, 0) | block_bit
+        self.tail = self._tail(buf, offset)
+
+    def select(self, start_ns=None, end_ns=None, event_ids=None):
+        """Return the (start, stop) byte ranges that may hold matching records.
+
+        Adjacent blocks are merged into a single range.
+        """
+        if event_ids is not None:
+            wanted = 0
+            for event_id in event_ids:
+                wanted |= self.event_blocks.get(event_id, 0)
+
+        ranges = []
+        for i, (start, stop, min_ts, max_ts) in enumerate(self.blocks):
+            if event_ids is not None and not (wanted >> i) & 1:
+                continue
+            if min_ts is not None:
+                if start_ns is not None and max_ts < start_ns:
+                    continue
+                if end_ns is not None and min_ts >= end_ns:
+                    continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+        return ranges
+
+def update_index(log, read_header=True, index_path=None):
+    """Create or incrementally update the sidecar index of a trace file.
+
+    Args:
+        log (str): file path of the log
+        read_header (bool, optional): Whether the log starts with a header. Defaults to True.
+        index_path (str, optional): Path of the index. Defaults to the log path with a '.idx' suffix.
+
+    Returns:
+        The up to date TraceIndex.
+    """
+    if index_path is None:
+        index_path = log + '.idx'
+    index = TraceIndex.load(index_path) or TraceIndex()
+    with open(log, 'rb') as log_fobj:
+        buf = _map_file(log_fobj)
+        if buf is None:
+            raise SimpleException(f'{log}: cannot index an empty or non-regular file')
+        with buf:
+            index.update(buf, read_header)
+    index.save(index_path)
+    return index
+
+def process(events, log, analyzer, read_header=True, start_ns=None, end_ns=None,
+            event_names=None, index_path=None):
     """Invoke an analyzer on each event in a log.
+
+    If any of start_ns, end_ns or event_names is given, only the matching
+    records are passed to the analyzer.  If index_path is given as well and
+    the log is a regular file, the index at that path (see update_index())
+    is brought up to date, saved, and used to skip the parts of the log that
+    cannot match.  Otherwise the whole log is scanned.
+
     Args:
         events (file-object or list or str): events list or file-like object or file path as str to read event data from
         log (file-object or str): file-like object or file path as str to read log data from
         analyzer (Analyzer): Instance of Analyzer to interpret the event data
         read_header (bool, optional): Whether to read header data from the log data. Defaults to True.
+        start_ns (int, optional): Skip records with a timestamp smaller than this.
+        end_ns (int, optional): Skip records with a timestamp equal to or larger than this.
+        event_names (iterable of str, optional): Only process these events.
+        index_path (str, optional): Path of the sidecar index to use for filtering, usually the log path with a '.idx' suffix.
     """
 
-    if isinstance(events, str):
-        with open(events, 'r') as f:
-            events_list = read_events(f, events)
-    elif isinstance(events, list):
-        # Treat as a list of events already produced by tracetool.read_events
-        events_list = events
-    else:
-        # Treat as an already opened file-object
-        events_list = read_events(events, events.name)
+    events_list = _read_events_list(events)
+    filters = {'start_ns': start_ns, 'end_ns': end_ns, 'event_names': event_names,
+               'index_path': index_path}
 
     if isinstance(log, str):
         with open(log, 'rb') as log_fobj:
-            _process(events_list, log_fobj, analyzer, read_header)
+            _process(events_list, log_fobj, analyzer, read_header, **filters)
     else:
         # Treat `log` as an already opened file-object. We will not close it,
         # as we do not own it.
-        _process(events_list, log, analyzer, read_header)
+        _process(events_list, log, analyzer, read_header, **filters)
+
+def _filtered_records(events, log_fobj, read_header, start_ns, end_ns, event_names,
+                      index_path=None):
+    """Yield (event, event_name, timestamp_ns, pid, args) of matching records."""
+    scanner = _RecordScanner(events, read_header)
+    if event_names is not None:
+        event_names = set(event_names)
+
+    buf = None
+    if index_path is not None:
+        buf = _map_file(log_fobj)
+    if buf is None:
+        if read_header:
+            read_trace_header(log_fobj)
+        records = _scan_file(scanner, log_fobj)
+    else:
+        index = TraceIndex.load(index_path) or TraceIndex()
+        index.update(buf, read_header)
+        index.save(index_path)
+
+        scanner.event_id_to_name.update(index.event_id_to_name)
+        event_ids = None
+        if event_names is not None:
+            event_ids = [event_id for event_id, name in scanner.event_id_to_name.items()
+                         if name in event_names]
+        records = (rec
+                   for start, stop in index.select(start_ns, end_ns, event_ids)
+                   for rec in scanner.scan(buf, start, stop))
 
-def _process(events, log_fobj, analyzer, read_header=True):
+    try:
+        for rec in records:
+            timestamp_ns = rec[2]
+            if start_ns is not None and timestamp_ns < start_ns:
+                continue
+            if end_ns is not None and timestamp_ns >= end_ns:
+                continue
+            if event_names is not None and rec[1] not in event_names:
+                continue
+            yield rec
+    finally:
+        if buf is not None:
+            buf.close()
+
+def _process(events, log_fobj, analyzer, read_header=True, start_ns=None, end_ns=None,
+             event_names=None, index_path=None):
     """Internal function for processing
 
     Args:
@@ -304,8 +1019,23 @@ def _process(events, log_fobj, analyzer, read_header=True):
         log_fobj (file): file-object to read log data from
         analyzer (Analyzer): the Analyzer to interpret the event data
         read_header (bool, optional): Whether to read header data from the log data. Defaults to True.
+        start_ns, end_ns, event_names, index_path (optional): Record filters and their index, see process().
     """
 
+    if start_ns is not None or end_ns is not None or event_names is not None:
+        with analyzer:
+            for event, event_id, timestamp_ns, record_pid, rec_args in \
+                    _filtered_records(events, log_fobj, read_header,
+                                      start_ns, end_ns, event_names, index_path):
+                analyzer._process_event(
+                    rec_args,
+                    event=event,
+                    event_id=event_id,
+                    timestamp_ns=timestamp_ns,
+                    pid=record_pid,
+                )
+        return
+
     if read_header:
         read_trace_header(log_fobj)
 
@@ -319,6 +1049,244 @@ def _process(events, log_fobj, analyzer, read_header=True):
                 pid=record_pid,
             )
 
+def _find_shards(scanner, buf, offset, end, nshards):
+    """Split buf[offset:end] into at most @nshards ranges of records.
+
+    Only record headers are decoded.  Returns a list of (start, stop,
+    event_id_to_name) tuples, where the mapping is the one in effect at
+    @start.
+    """
+    unpack_u64 = _u64.unpack_from
+    unpack_rec = _rec_struct.unpack_from
+    unpack_mapping = _mapping_struct.unpack_from
+    rec_len = _rec_struct.size
+    mapping_len = _mapping_struct.size
+    event_id_to_name = scanner.event_id_to_name
+
+    shard_size = max((end - offset) // nshards, 1)
+    shards = []
+    start = offset
+    start_mapping = dict(event_id_to_name)
+    next_split = offset + shard_size
+    while offset + 8 <= end:
+        if offset >= next_split:
+            shards.append((start, offset, start_mapping))
+            start = offset
+            start_mapping = dict(event_id_to_name)
+            next_split = offset + shard_size
+        (rectype,) = unpack_u64(buf, offset)
+        if rectype == record_type_mapping:
+            if offset + mapping_len > end:
+                break
+            _, event_id, name_len = unpack_mapping(buf, offset)
+            name = bytes(buf[offset + mapping_len:offset + mapping_len + name_len])
+            event_id_to_name[event_id] = name.decode()
+            offset += mapping_len + name_len
+        else:
+            if offset + rec_len > end:
+                break
+            record_length = unpack_rec(buf, offset)[3]
+            offset += 8 + record_length
+    if offset != end:
+        raise SimpleException('Error reading header. Truncated trace record at end of file.')
+    if start != offset:
+        shards.append((start, offset, start_mapping))
+    return shards
+
+def _process_shard(events, log_path, start, stop, event_id_to_name, analyzer_factory):
+    """Run a new analyzer over the records in log_path[start:stop]."""
+    analyzer = analyzer_factory()
+    scanner = _RecordScanner(events, True)
+    scanner.event_id_to_name = event_id_to_name
+
+    analyzer.begin()
+    with open(log_path, 'rb') as log_fobj, _map_file(log_fobj) as buf:
+        for event, event_id, timestamp_ns, record_pid, rec_args in scanner.scan(buf, start, stop):
+            analyzer._process_event(
+                rec_args,
+                event=event,
+                event_id=event_id,
+                timestamp_ns=timestamp_ns,
+                pid=record_pid,
+            )
+    return analyzer
+
+def process_sharded(events, log, analyzer_factory, jobs=None, read_header=True):
+    """Invoke analyzers on slices of a log in parallel and merge the results.
+
+    The log is pre-scanned for record boundaries and split into byte ranges.
+    Each range is processed in a worker process by a fresh analyzer, on which
+    begin() is called but not end().  The partial analyzers are then combined
+    in trace order with Analyzer2.merge(), and end() is invoked once on the
+    result.  A log that cannot be memory-mapped, such as a FIFO, is processed
+    serially like process() does.
+
+    Args:
+        events (file-object or list or str): events list or file-like object or file path as str to read event data from
+        log (str): file path of the log; workers open it independently
+        analyzer_factory (callable): picklable callable returning a new Analyzer2, usually the class itself
+        jobs (int, optional): number of worker processes. Defaults to os.cpu_count().
+        read_header (bool, optional): Whether to read header data from the log data. Defaults to True.
+
+    Returns:
+        The merged Analyzer2 instance.
+    """
+    events_list = _read_events_list(events)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    with open(log, 'rb') as log_fobj:
+        buf = _map_file(log_fobj)
+        if buf is None:
+            # Workers can only seek into regular files; process anything
+            # else (a FIFO, an empty file) in this process instead
+            analyzer = analyzer_factory()
+            _process(events_list, log_fobj, analyzer, read_header)
+            return analyzer
+        with buf:
+            if read_header:
+                read_trace_header(log_fobj)
+            scanner = _RecordScanner(events_list, read_header)
+            # Use more shards than workers to even out the load
+            shards = _find_shards(scanner, buf, log_fobj.tell(), len(buf), jobs * 4)
+
+    if not shards:
+        # Only a header, no records
+        analyzer = analyzer_factory()
+        analyzer.begin()
+        analyzer.end()
+        return analyzer
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_process_shard, events_list, log, start, stop,
+                                   event_id_to_name, analyzer_factory)
+                   for start, stop, event_id_to_name in shards]
+        analyzer, *partials = [f.result() for f in futures]
+    for partial in partials:
+        analyzer.merge(partial)
+    analyzer.end()
+    return analyzer
+
+class TraceFollower:
+    """Feed records of a trace file that is still being written to an analyzer.
+
+    The log is kept open and polled for new data.  A record that is only
+    partially written when the end of the file is reached is kept and
+    completed on a later poll.  The most recent records are kept in the
+    `recent` ring as (event_name, timestamp_ns, pid, args) tuples.
+
+    Args:
+        events (file-object or list or str): events list or file-like object or file path as str to read event data from
+        log (file-object or str): file-like object or file path as str to read log data from
+        analyzer (Analyzer): Instance of Analyzer to interpret the event data
+        read_header (bool, optional): Whether to read header data from the log data. Defaults to True.
+        ring_size (int, optional): Number of recent records to keep. Defaults to 1024.
+        poll_interval (float, optional): Seconds to sleep when no new data is available.
+        flush_interval (float, optional): Seconds between calls to analyzer.flush(), or None to never call it.
+    """
+
+    def __init__(self, events, log, analyzer, read_header=True, ring_size=1024,
+                 poll_interval=0.2, flush_interval=None, chunk_size=1 << 20):
+        self.events = _read_events_list(events)
+        self.analyzer = analyzer
+        self.read_header = read_header
+        self.recent = collections.deque(maxlen=ring_size)
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+
+        if isinstance(log, str):
+            self._log_fobj = open(log, 'rb')
+            self._owns_log = True
+        else:
+            self._log_fobj = log
+            self._owns_log = False
+        self._scanner = _RecordScanner(self.events, read_header)
+        self._need_header = read_header
+        self._pending = b''
+        self._stopped = False
+
+    def close(self):
+        """Close the log if it was opened by the follower."""
+        if self._owns_log:
+            self._log_fobj.close()
+
+    def stop(self):
+        """Make run() return after the current poll.  May be called from
+        another thread or a signal handler."""
+        self._stopped = True
+
+    def poll(self):
+        """Process the records appended to the log since the last poll.
+
+        Returns the number of records passed to the analyzer.
+        """
+        chunk = self._log_fobj.read(self.chunk_size)
+        if not chunk:
+            return 0
+        buf = self._pending + chunk if self._pending else chunk
+        offset = 0
+
+        if self._need_header:
+            hlen = struct.calcsize(log_header_fmt)
+            if len(buf) < hlen:
+                self._pending = buf
+                return 0
+            read_trace_header(io.BytesIO(buf[:hlen]))
+            self._need_header = False
+            offset = hlen
+
+        analyzer = self.analyzer
+        recent = self.recent
+        count = 0
+        for event, event_id, timestamp_ns, record_pid, rec_args in \
+                self._scanner.scan(buf, offset, len(buf)):
+            analyzer._process_event(
+                rec_args,
+                event=event,
+                event_id=event_id,
+                timestamp_ns=timestamp_ns,
+                pid=record_pid,
+            )
+            recent.append((event_id, timestamp_ns, record_pid, rec_args))
+            count += 1
+        self._pending = buf[self._scanner.offset:]
+        return count
+
+    def run(self):
+        """Follow the log until stop() is called.
+
+        begin() is invoked on the analyzer first and end() once stop() was
+        called, unless an exception interrupted processing.
+        """
+        self._stopped = False
+        next_flush = None
+        if self.flush_interval is not None:
+            next_flush = time.monotonic() + self.flush_interval
+
+        with self.analyzer:
+            while not self._stopped:
+                if self.poll() == 0:
+                    time.sleep(self.poll_interval)
+                if next_flush is not None and time.monotonic() >= next_flush:
+                    self.analyzer.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+
+def follow(events, log, analyzer, read_header=True, **kwargs):
+    """Invoke an analyzer on a log that is still being written, until interrupted.
+
+    Keyword arguments are passed on to TraceFollower.  Returns on SIGINT,
+    after calling analyzer.end().  Must be called from the main thread; use
+    TraceFollower directly elsewhere.
+    """
+    follower = TraceFollower(events, log, analyzer, read_header, **kwargs)
+    previous = signal.signal(signal.SIGINT, lambda signum, frame: follower.stop())
+    try:
+        follower.run()
+    finally:
+        signal.signal(signal.SIGINT, previous)
+        follower.close()
+
 def run(analyzer):
     """Execute an analyzer on a trace file given on the command-line.
 
@@ -327,13 +1295,18 @@ def run(analyzer):
 
     try:
         # NOTE: See built-in `argparse` module for a more robust cli interface
-        *no_header, trace_event_path, trace_file_path = sys.argv[1:]
-        assert no_header == [] or no_header == ['--no-header'], 'Invalid no-header argument'
+        *options, trace_event_path, trace_file_path = sys.argv[1:]
+        assert set(options) <= {'--no-header', '--follow'}, 'Invalid argument'
+        assert len(set(options)) == len(options), 'Duplicate argument'
     except (AssertionError, ValueError):
-        raise SimpleException(f'usage: {sys.argv[0]} [--no-header] <trace-events> <trace-file>\n')
+        raise SimpleException(f'usage: {sys.argv[0]} [--no-header] [--follow] <trace-events> <trace-file>\n')
+    no_header = '--no-header' in options
 
     with open(trace_event_path, 'r') as events_fobj, open(trace_file_path, 'rb') as log_fobj:
-        process(events_fobj, log_fobj, analyzer, read_header=not no_header)
+        if '--follow' in options:
+            follow(events_fobj, log_fobj, analyzer, read_header=not no_header)
+        else:
+            process(events_fobj, log_fobj, analyzer, read_header=not no_header)
 
 if __name__ == '__main__':
     class Formatter2(Analyzer2):
@@ -353,7 +1326,14 @@ def catchall(self, *rec_args, event, timestamp_ns, pid, event_id):
             print(f'{event.name} {delta_ns / 1000:0.3f} {pid=} ' + ' '.join(fields))
 
     try:
-        run(Formatter2())
+        if sys.argv[1:2] == ['convert']:
+            args = sys.argv[2:]
+            if len(args) not in (3, 4) or args[:-3] not in ([], ['--no-header']):
+                raise SimpleException(f'usage: {sys.argv[0]} convert [--no-header] <trace-events> <trace-file> <output-dir>\n')
+            *no_header, trace_event_path, trace_file_path, output_dir = args
+            convert(trace_event_path, trace_file_path, output_dir, read_header=not no_header)
+        else:
+            run(Formatter2())
     except SimpleException as e:
         sys.stderr.write(str(e) + "\n")
         sys.exit(1)
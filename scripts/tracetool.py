@@ -17,6 +17,7 @@
 
 from tracetool import error_write, out, out_open
 import tracetool.backend
+import tracetool.batch
 import tracetool.format
 
 
@@ -32,6 +33,7 @@ def error_opt(msg = None):
                                for n,d in tracetool.format.get_list() ])
     error_write("""\
 Usage: %(script)s --format=<format> --backends=<backends> [<options>] <trace-events> ... <output>
+       %(script)s --backends=<backends> --batch=<manifest> [<options>]
 
 Backends:
 %(backends)s
@@ -46,6 +48,9 @@ def error_opt(msg = None):
     --binary <path>          Full path to QEMU binary (required for 'stap' backend).
     --group <name>           Name of the event group.
     --probe-prefix <prefix>  Prefix for dtrace probe names (required for 'stap' backend).
+    --batch <manifest>       Run the jobs listed in a manifest file, one per line;
+                             each line holds the options and arguments of a run.
+    --jobs <n>               Number of processes running the jobs of --batch.
 """ % {
             "script" : _SCRIPT,
             "backends" : backend_descr,
@@ -64,6 +69,7 @@ def main(args):
     long_opts = ["backends=", "format=", "help", "list-backends",
                  "check-backends", "group="]
     long_opts += ["binary=", "probe-prefix="]
+    long_opts += ["batch=", "jobs="]
 
     try:
         opts, args = getopt.getopt(args[1:], "", long_opts)
@@ -76,6 +82,8 @@ def main(args):
     arg_group = None
     binary = None
     probe_prefix = None
+    batch = None
+    jobs = 1
     for opt, arg in opts:
         if opt == "--help":
             error_opt()
@@ -99,6 +107,14 @@ def main(args):
         elif opt == '--probe-prefix':
             probe_prefix = arg
 
+        elif opt == "--batch":
+            batch = arg
+        elif opt == "--jobs":
+            try:
+                jobs = int(arg)
+            except ValueError:
+                error_opt("invalid number of jobs: %s" % arg)
+
         else:
             error_opt("unhandled option: %s" % opt)
 
@@ -111,6 +127,18 @@ def main(args):
                 sys.exit(1)
         sys.exit(0)
 
+    if batch is not None:
+        if args:
+            error_opt("--batch takes no trace-events or output filepaths")
+        try:
+            with open(batch, "r") as fh:
+                batch_jobs = tracetool.batch.read_manifest(
+                    fh, batch, binary=binary, probe_prefix=probe_prefix)
+            tracetool.batch.run(batch_jobs, arg_backends, jobs)
+        except tracetool.TracetoolError as e:
+            error_opt(str(e))
+        return
+
     if arg_group is None:
         error_opt("group name is required")
 
@@ -12,6 +12,7 @@
 __email__      = "stefanha@redhat.com"
 
 
+import io
 import os
 import re
 import sys
@@ -83,6 +84,33 @@ def out_open(filename):
     out_filename = posix_relpath(filename)
     out_fobj = open(filename, 'wt')
 
+def out_capture(filename):
+    """Collect the output for filename in memory, and return the buffer.
+
+    Unlike out_open, this restarts line numbering, so that it can be called
+    for several output files in a row.
+    """
+    global out_filename, out_fobj, out_lineno
+    out_filename = posix_relpath(filename)
+    out_lineno = 1
+    out_fobj = io.StringIO()
+    return out_fobj
+
+def write_if_changed(filename, contents):
+    """Write contents to filename, unless it already holds them.
+
+    Returns whether the file was written.
+    """
+    try:
+        with open(filename, 'rt') as fh:
+            if fh.read() == contents:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(filename, 'wt') as fh:
+        fh.write(contents)
+    return True
+
 def out(*lines, **kwargs):
     """Write a set of output lines.
 
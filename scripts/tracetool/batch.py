@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""
+Run several tracetool jobs in one process.
+
+A manifest lists one job per line, with the same options and arguments as
+a single tracetool run::
+
+    --group=root --format=h trace-events trace/trace-root.h
+    --group=root --format=c trace-events trace/trace-root.c
+
+Empty lines and lines starting with '#' are ignored, and arguments are
+split as in a POSIX shell.  Each trace-events file is only parsed once for
+all the jobs using it, and output files are only written when their
+contents change.
+"""
+
+import getopt
+import shlex
+from concurrent.futures import ProcessPoolExecutor
+
+import tracetool
+
+
+class Job:
+    """A tracetool run, as described by a manifest line.
+
+    Attributes
+    ----------
+    group : str
+        Name of the event group.
+    format : str
+        Output format name.
+    inputs : tuple of str
+        Paths of the trace-events files.
+    output : str
+        Path of the output file.
+    binary : str or None
+        See tracetool.backend.dtrace.BINARY.
+    probe_prefix : str or None
+        See tracetool.backend.dtrace.PROBEPREFIX.
+    """
+
+    def __init__(self, group, format, inputs, output,
+                 binary=None, probe_prefix=None):
+        self.group = group
+        self.format = format
+        self.inputs = tuple(inputs)
+        self.output = output
+        self.binary = binary
+        self.probe_prefix = probe_prefix
+
+    def __repr__(self):
+        return "Job(%r, %r, %r, %r)" % (self.group, self.format,
+                                        self.inputs, self.output)
+
+
+def read_manifest(fobj, fname, binary=None, probe_prefix=None):
+    """Read the jobs listed in a manifest.
+
+    Parameters
+    ----------
+    fobj : file
+        Manifest file.
+    fname : str
+        Name of the manifest file.
+    binary, probe_prefix : str or None
+        Defaults for the jobs that do not give '--binary' and
+        '--probe-prefix'.
+
+    Returns a list of Job objects.
+    """
+    jobs = []
+    for lineno, line in enumerate(fobj, 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+
+        where = "%s:%d" % (fname, lineno)
+        try:
+            opts, args = getopt.getopt(shlex.split(line), "",
+                                       ["group=", "format=", "binary=",
+                                        "probe-prefix="])
+        except (getopt.GetoptError, ValueError) as e:
+            raise tracetool.TracetoolError("%s: %s" % (where, e))
+
+        opts = dict(opts)
+        if "--group" not in opts:
+            raise tracetool.TracetoolError("%s: group name is required"
+                                           % where)
+        if len(args) < 2:
+            raise tracetool.TracetoolError(
+                "%s: missing trace-events and output filepaths" % where)
+        job = Job(opts["--group"], opts.get("--format", ""),
+                  args[:-1], args[-1],
+                  opts.get("--binary", binary),
+                  opts.get("--probe-prefix", probe_prefix))
+        if job.format == "stap" and (job.binary is None or
+                                     job.probe_prefix is None):
+            raise tracetool.TracetoolError(
+                "%s: --binary and --probe-prefix are required for "
+                "SystemTAP tapset generator" % where)
+        jobs.append(job)
+    return jobs
+
+
+def _run_jobs(jobs, backends):
+    """Run jobs in this process, and return the outputs that changed."""
+    parsed = {}
+    changed = []
+    for job in jobs:
+        events = []
+        for path in job.inputs:
+            if path not in parsed:
+                with open(path, "r") as fh:
+                    parsed[path] = tracetool.read_events(fh, path)
+            events.extend(parsed[path])
+
+        buf = tracetool.out_capture(job.output)
+        tracetool.generate(events, job.group, job.format, backends,
+                           binary=job.binary, probe_prefix=job.probe_prefix)
+        if tracetool.write_if_changed(job.output, buf.getvalue()):
+            changed.append(job.output)
+    return changed
+
+
+def run(jobs, backends, workers=1):
+    """Run jobs, and return the outputs that changed.
+
+    Parameters
+    ----------
+    jobs : list of Job
+        The jobs to run.
+    backends : list of str
+        Output backend names, for all the jobs.
+    workers : int
+        Number of processes to run the jobs in.  Jobs reading the same
+        trace-events files always run in the same process.
+    """
+    by_inputs = {}
+    for job in jobs:
+        by_inputs.setdefault(job.inputs, []).append(job)
+    batches = list(by_inputs.values())
+
+    if workers <= 1 or len(batches) <= 1:
+        return _run_jobs(jobs, backends)
+
+    changed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(batches) // (workers * 4))
+        for outputs in executor.map(_run_jobs, batches,
+                                    [backends] * len(batches),
+                                    chunksize=chunksize):
+            changed += outputs
+    return changed
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+'''Tests for the download cache of the functional tests'''
+
+import hashlib
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from qemu_test import Asset, QemuBaseTest
+from qemu_test.asset import AssetError
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    '''
+    Serve the files of the server, with support for Range requests.
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.files.get(self.path)
+        rng = self.headers.get('Range')
+        server.requests.append((self.path, rng))
+        if data is None:
+            self.send_error(404)
+            return
+
+        start = 0
+        if rng is not None and server.ranges:
+            start = int(rng[len('bytes='):].rstrip('-'))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+
+        body = data[start:]
+        if server.truncate:
+            # Drop the connection in the middle of the transfer
+            server.truncate -= 1
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+class AssetTest(QemuBaseTest):
+    '''
+    Fetch assets from a local HTTP server
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), AssetHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.truncate = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        env = mock.patch.dict(os.environ,
+                              {'QEMU_TEST_CACHE_DIR': self.workdir})
+        env.start()
+        self.addCleanup(env.stop)
+        for var in ('QEMU_TEST_NO_DOWNLOAD', 'QEMU_TEST_REFRESH_CACHE'):
+            os.environ.pop(var, None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def add_asset(self, name, data):
+        self.server.files['/' + name] = data
+        port = self.server.server_address[1]
+        return Asset(f'http://127.0.0.1:{port}/{name}',
+                     hashlib.sha256(data).hexdigest())
+
+    def test_fetch(self):
+        data = os.urandom(3 << 20)
+        asset = self.add_asset('file', data)
+        with open(asset.fetch(), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        # The hash computed while downloading is recorded, so the file
+        # is not read again
+        with mock.patch.object(Asset, '_check', side_effect=AssertionError):
+            self.assertEqual(asset.fetch(), str(asset.cache_file))
+        self.assertEqual(len(self.server.requests), 1)
+
+        # ... unless it changes
+        os.chmod(asset.cache_file, 0o600)
+        with open(asset.cache_file, 'r+b') as f:
+            f.write(b'garbage')
+        self.assertFalse(asset.valid())
+
+    def test_resume(self):
+        data = os.urandom(3 << 20)
+        asset = self.add_asset('file', data)
+        asset.cache_dir.mkdir(parents=True, exist_ok=True)
+        asset.cache_file.with_suffix('.download').write_bytes(data[:12345])
+        with open(asset.fetch(), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(self.server.requests, [('/file', 'bytes=12345-')])
+
+    def test_resume_after_drop(self):
+        data = os.urandom(3 << 20)
+        asset = self.add_asset('file', data)
+        self.server.truncate = 2
+        with open(asset.fetch(), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertIsNone(self.server.requests[0][1])
+        self.assertIsNotNone(self.server.requests[2][1])
+
+    def test_no_range_support(self):
+        data = os.urandom(1 << 20)
+        asset = self.add_asset('file', data)
+        self.server.ranges = False
+        asset.cache_dir.mkdir(parents=True, exist_ok=True)
+        asset.cache_file.with_suffix('.download').write_bytes(b'x' * 1000)
+        with open(asset.fetch(), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_bad_hash(self):
+        asset = self.add_asset('file', b'data')
+        self.server.files['/file'] = b'other data'
+        with self.assertRaises(AssetError):
+            asset.fetch()
+        self.assertFalse(asset.cache_file.exists())
+        self.assertFalse(asset.cache_file.with_suffix('.download').exists())
+
+    def test_not_found(self):
+        asset = self.add_asset('file', b'data')
+        del self.server.files['/file']
+        with self.assertRaises(AssetError) as cm:
+            asset.fetch()
+        self.assertFalse(cm.exception.transient)
+
+    def test_precache(self):
+        assets = [self.add_asset(f'file{i}', os.urandom(1 << 20))
+                  for i in range(8)]
+        # The same asset, declared twice, is only downloaded once
+        assets.append(self.add_asset('file0', self.server.files['/file0']))
+        Asset.precache(assets, jobs=4)
+        for asset in assets:
+            self.assertTrue(asset.valid())
+        self.assertEqual(len(self.server.requests), 8)
+
+    def test_concurrent_fetch(self):
+        asset = self.add_asset('file', os.urandom(8 << 20))
+        assets = [Asset(asset.url, asset.hash) for _ in range(4)]
+        threads = [threading.Thread(target=a.fetch) for a in assets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(asset.valid())
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    QemuBaseTest.main()
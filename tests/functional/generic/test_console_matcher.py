@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+#
+'''Tests for the incremental matching of console patterns'''
+
+import random
+import re
+
+from qemu_test import QemuBaseTest
+from qemu_test.cmd import ConsoleMatcher
+
+
+def rescan(patterns, chunks):
+    '''
+    What ConsoleMatcher.feed() returns for each chunk, computed by
+    searching all of the data fed so far again for every chunk.
+    '''
+    results = []
+    data = b''
+    for chunk in chunks:
+        prev = len(data)
+        data += chunk
+        found = None
+        for i, pattern in enumerate(patterns):
+            if isinstance(pattern, re.Pattern):
+                continue
+            pos = data.find(pattern)
+            if pos >= 0:
+                end = pos + len(pattern) - prev
+                if found is None or (end, i) < (found[1], found[0]):
+                    found = (i, end)
+        searched = data if found is None else data[:prev + found[1]]
+        for i, pattern in enumerate(patterns):
+            if not isinstance(pattern, re.Pattern):
+                continue
+            match = pattern.search(searched)
+            if match:
+                end = max(match.end() - prev, 0)
+                if found is None or (end, i) < (found[1], found[0]):
+                    found = (i, end)
+        results.append(found)
+        if found is not None:
+            break
+    return results
+
+
+class ConsoleMatcherTest(QemuBaseTest):
+    '''
+    Feed data to a ConsoleMatcher in chunks
+    '''
+
+    def feed(self, patterns, *chunks, max_len=None):
+        matcher = ConsoleMatcher(patterns, max_len)
+        results = []
+        for chunk in chunks:
+            results.append(matcher.feed(chunk))
+            if results[-1] is not None:
+                break
+        return results
+
+    def test_split(self):
+        self.assertEqual(self.feed([b'login:'], b'foo lo', b'gi', b'n: '),
+                         [None, None, (0, 2)])
+        self.assertEqual(self.feed([re.compile(rb'err[0-9]+:')],
+                                   b'an er', b'r12', b'3: x'),
+                         [None, None, (0, 2)])
+
+    def test_overlap(self):
+        # The match that ends first is found, whichever starts first
+        self.assertEqual(self.feed([b'abcd', b'bc'], b'xabcd'), [(1, 4)])
+        self.assertEqual(self.feed([b'bcd', b'abcde'], b'abcde'), [(0, 4)])
+        # Partial matches fall back to the longest suffix that can match
+        self.assertEqual(self.feed([b'aab'], b'aa', b'ab'), [None, (0, 2)])
+        self.assertEqual(self.feed([b'abac', b'bab'], b'aba', b'bac'),
+                         [None, (1, 1)])
+
+    def test_priority(self):
+        # Of the patterns ending at the same byte, the first one wins
+        self.assertEqual(self.feed([b'c', b'abc'], b'abc'), [(0, 3)])
+        self.assertEqual(self.feed([b'abc', b'c'], b'abc'), [(0, 3)])
+        self.assertEqual(self.feed([b'same', b'same'], b'same'), [(0, 4)])
+
+    def test_regex_order(self):
+        hello = re.compile(rb'hel+o')
+        self.assertEqual(self.feed([b'world', hello], b'hello world'),
+                         [(1, 5)])
+        self.assertEqual(self.feed([hello, b'lo'], b'hello'), [(0, 5)])
+        self.assertEqual(self.feed([b'lo', hello], b'hello'), [(0, 5)])
+        # A regex match ending in earlier data is reported at offset 0
+        self.assertEqual(self.feed([b'x', re.compile(rb'ab(?=c)')],
+                                   b'ab', b'cx'), [None, (1, 0)])
+        self.assertEqual(self.feed([re.compile(rb'ab\B')], b'xab', b'c'),
+                         [None, (0, 0)])
+
+    def test_max_len(self):
+        tag = re.compile(rb'<[a-z]*>')
+        self.assertEqual(self.feed([tag], b'<abcde', b'f>'), [None, (0, 2)])
+        # Longer matches are missed
+        self.assertEqual(self.feed([tag], b'<abcde', b'f>', max_len=4),
+                         [None, None])
+        self.assertEqual(self.feed([tag], b'<abcde', b'f>', max_len=8),
+                         [None, (0, 2)])
+
+    def test_no_patterns(self):
+        with self.assertRaises(ValueError):
+            ConsoleMatcher([])
+
+    def test_reset(self):
+        matcher = ConsoleMatcher([b'hello', re.compile(rb'wor+ld')])
+        self.assertIsNone(matcher.feed(b'hel'))
+        self.assertIsNone(matcher.feed(b'wor'))
+        matcher.reset()
+        self.assertIsNone(matcher.feed(b'lo'))
+        self.assertIsNone(matcher.feed(b'ld'))
+        self.assertEqual(matcher.feed(b' world'), (1, 6))
+
+    def test_random(self):
+        rng = random.Random(0)
+        # Regexes and the length of their longest match
+        regexes = [(rb'a[bc]{1,3}a', 5), (rb'ab.*ca', None), (rb'b\b', 1),
+                   (rb'ab\B', 2), (rb'\bcab', 3), (rb'(?<=a)bb', 2),
+                   (rb'c(?=aa)', 3), (rb'a$', 1), (rb'^ba', 2)]
+        for _ in range(2000):
+            patterns = []
+            max_len = 0
+            for _ in range(rng.randint(1, 4)):
+                if rng.random() < 0.3:
+                    regex, length = rng.choice(regexes)
+                    patterns.append(re.compile(regex))
+                    if max_len is not None:
+                        max_len = None if length is None \
+                                  else max(max_len, length)
+                else:
+                    length = rng.randint(1, 4)
+                    patterns.append(bytes(rng.choices(b'abc ', k=length)))
+            data = bytes(rng.choices(b'abc ', k=rng.randint(0, 40)))
+            cuts = sorted(rng.sample(range(len(data) + 1),
+                                     min(len(data) + 1, rng.randint(1, 6))))
+            chunks = [data[i:j] for i, j in zip([0] + cuts, cuts)]
+            expected = rescan(patterns, chunks)
+            self.assertEqual(self.feed(patterns, *chunks), expected,
+                             f'{patterns!r} {chunks!r}')
+            if max_len is not None:
+                self.assertEqual(self.feed(patterns, *chunks,
+                                           max_len=max_len),
+                                 expected,
+                                 f'{patterns!r} {chunks!r} {max_len}')
+
+
+if __name__ == '__main__':
+    QemuBaseTest.main()
@@ -13,11 +13,22 @@
 import time
 import unittest
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.client import IncompleteRead
 from time import sleep
 from pathlib import Path
-from shutil import copyfileobj
 from urllib.error import HTTPError, URLError
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds without any data from the server after which a download is
+# considered stuck
+DOWNLOAD_TIMEOUT = 90
+
 class AssetError(Exception):
     def __init__(self, asset, msg, transient=False):
         self.url = asset.url
@@ -52,15 +63,19 @@ def __repr__(self):
     def __str__(self):
         return str(self.cache_file)
 
-    def _check(self, cache_file):
+    def _hasher(self):
         if self.hash is None:
-            return True
+            return None
         if len(self.hash) == 64:
-            hl = hashlib.sha256()
-        elif len(self.hash) == 128:
-            hl = hashlib.sha512()
-        else:
-            raise AssetError(self, "unknown hash type")
+            return hashlib.sha256()
+        if len(self.hash) == 128:
+            return hashlib.sha512()
+        raise AssetError(self, "unknown hash type")
+
+    def _check(self, cache_file):
+        hl = self._hasher()
+        if hl is None:
+            return True
 
         # Calculate the hash of the file:
         with open(cache_file, 'rb') as file:
@@ -72,12 +87,53 @@ def _check(self, cache_file):
 
         return self.hash == hl.hexdigest()
 
+    def _cache_key(self, path=None):
+        '''
+        Identify the current content of the cache file (or of path, once
+        it replaces the cache file), or None if there is none.
+        '''
+        try:
+            st = os.stat(path or self.cache_file)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_size} {st.st_mtime_ns} {st.st_ino}"
+
+    def _verified_file(self):
+        return self.cache_file.with_suffix(".verified")
+
+    def _is_verified(self):
+        '''
+        Whether the cache file was already found to match the hash, and
+        has not changed since.  This avoids reading GB-sized assets again
+        on every run.
+        '''
+        key = self._cache_key()
+        try:
+            return key is not None and \
+                self._verified_file().read_text() == key
+        except OSError:
+            return False
+
+    def _save_verified(self, path=None):
+        try:
+            self._verified_file().write_text(self._cache_key(path))
+        except OSError as e:
+            self.log.debug("Unable to record hash check of %s: %s",
+                           self.cache_file, e)
+
     def valid(self):
         if os.getenv("QEMU_TEST_REFRESH_CACHE", None) is not None:
             self.log.info("Force refresh of asset %s", self.url)
             return False
 
-        return self.cache_file.exists() and self._check(self.cache_file)
+        if not self.cache_file.exists():
+            return False
+        if self.hash is None or self._is_verified():
+            return True
+        if not self._check(self.cache_file):
+            return False
+        self._save_verified()
+        return True
 
     def fetchable(self):
         return not os.environ.get("QEMU_TEST_NO_DOWNLOAD", False)
@@ -114,6 +170,126 @@ def _wait_for_other_download(self, tmp_cache_file):
         self.log.debug("Time out while waiting for %s!", tmp_cache_file)
         raise TimeoutError(f"Time out while waiting for {tmp_cache_file}")
 
+    def _open_download(self, tmp_cache_file, cache_key):
+        '''
+        Open the partial download of the asset, for appending to it.
+
+        The file is locked, so that other threads or processes wait for
+        the download to complete instead of fetching the asset as well.
+        Returns None if another downloader replaced the cache file,
+        which was identified by cache_key, meanwhile.
+        '''
+        while True:
+            if fcntl is None:
+                # No locking: the existence of the file tells whether
+                # someone else downloads the asset
+                try:
+                    return tmp_cache_file.open("xb")
+                except FileExistsError:
+                    self.log.debug("%s already exists, "
+                                   "waiting for other thread to finish...",
+                                   tmp_cache_file)
+                    if self._wait_for_other_download(tmp_cache_file):
+                        return None
+                    self.log.debug("%s seems to be stale, "
+                                   "deleting and retrying download...",
+                                   tmp_cache_file)
+                    tmp_cache_file.unlink()
+                    continue
+
+            dst = tmp_cache_file.open("ab")
+            try:
+                fcntl.flock(dst, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.log.debug("%s is locked, "
+                               "waiting for other thread to finish...",
+                               tmp_cache_file)
+                fcntl.flock(dst, fcntl.LOCK_EX)
+
+            if self._cache_key() not in (None, cache_key):
+                self.log.debug("%s was downloaded by another thread",
+                               self.cache_file)
+                dst.close()
+                return None
+
+            # Whoever held the lock may have removed the file
+            try:
+                if os.path.samestat(os.fstat(dst.fileno()),
+                                    tmp_cache_file.stat()):
+                    return dst
+            except FileNotFoundError:
+                pass
+            dst.close()
+
+    def _download(self, dst, hl):
+        '''
+        Download the asset to dst, resuming after what it already holds,
+        and update the hash with the data.
+
+        Returns False if the transfer stopped before the end, leaving
+        what was received so far in dst.
+        '''
+        offset = dst.seek(0, os.SEEK_END)
+        req = urllib.request.Request(self.url)
+        if offset:
+            self.log.info("Resuming download of %s at %d bytes",
+                          self.url, offset)
+            req.add_header("Range", f"bytes={offset}-")
+
+        try:
+            resp = urllib.request.urlopen(req, timeout=DOWNLOAD_TIMEOUT)
+        except HTTPError as e:
+            # The error is also the response, which holds the connection
+            e.close()
+            if offset and e.code == 416:
+                # The partial file is no use to the server; start over
+                self.log.debug("Range not satisfiable, restarting download")
+                dst.truncate(0)
+                return False
+            raise
+
+        with resp:
+            if offset:
+                content_range = resp.getheader("Content-Range", "")
+                if (resp.status != 206 or
+                        not content_range.startswith(f"bytes {offset}-")):
+                    # The server sends the whole file
+                    self.log.debug("Range not supported, restarting download")
+                    offset = 0
+                    dst.truncate(0)
+                    dst.seek(0)
+
+            if hl is not None and offset:
+                # Hash the part that was downloaded before
+                with open(dst.name, "rb") as src:
+                    while True:
+                        chunk = src.read(1 << 20)
+                        if not chunk:
+                            break
+                        hl.update(chunk)
+
+            received = 0
+            while True:
+                chunk = resp.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                if hl is not None:
+                    hl.update(chunk)
+                received += len(chunk)
+            dst.flush()
+
+            # Verify downloaded file size against length metadata, if
+            # available.
+            length_hdr = resp.getheader("Content-Length")
+            if length_hdr is not None and received != int(length_hdr):
+                self.log.error("Unable to download %s: "
+                               "connection closed before "
+                               "transfer complete (%d/%s)",
+                               self.url, received, length_hdr)
+                return False
+        return True
+
     def _save_time_stamp(self):
         '''
         Update the time stamp of the asset in the cache. Unfortunately, we
@@ -141,93 +317,117 @@ def fetch(self):
         self.log.info("Downloading %s to %s...", self.url, self.cache_file)
         tmp_cache_file = self.cache_file.with_suffix(".download")
 
-        for _retries in range(3):
-            try:
-                with tmp_cache_file.open("xb") as dst:
-                    with urllib.request.urlopen(self.url) as resp:
-                        copyfileobj(resp, dst)
-                        length_hdr = resp.getheader("Content-Length")
-
-                # Verify downloaded file size against length metadata, if
-                # available.
-                if length_hdr is not None:
-                    length = int(length_hdr)
-                    fsize = tmp_cache_file.stat().st_size
-                    if fsize != length:
-                        self.log.error("Unable to download %s: "
-                                       "connection closed before "
-                                       "transfer complete (%d/%d)",
-                                       self.url, fsize, length)
+        dst = self._open_download(tmp_cache_file, self._cache_key())
+        if dst is None:
+            return str(self.cache_file)
+
+        with dst:
+            hl = None
+            for _retries in range(3):
+                try:
+                    hl = self._hasher()
+                    if self._download(dst, hl):
+                        break
+                except HTTPError as e:
+                    self.log.error("Unable to download %s: HTTP error %d",
+                                   self.url, e.code)
+                    # Treat 404 as fatal, since it is highly likely to
+                    # indicate a broken test rather than a transient
+                    # server or networking problem
+                    if e.code == 404:
                         tmp_cache_file.unlink()
-                        continue
-                break
-            except FileExistsError:
-                self.log.debug("%s already exists, "
-                               "waiting for other thread to finish...",
-                               tmp_cache_file)
-                if self._wait_for_other_download(tmp_cache_file):
-                    return str(self.cache_file)
-                self.log.debug("%s seems to be stale, "
-                               "deleting and retrying download...",
-                               tmp_cache_file)
-                tmp_cache_file.unlink()
-                continue
-            except HTTPError as e:
-                tmp_cache_file.unlink()
-                self.log.error("Unable to download %s: HTTP error %d",
-                               self.url, e.code)
-                # Treat 404 as fatal, since it is highly likely to
-                # indicate a broken test rather than a transient
-                # server or networking problem
-                if e.code == 404:
-                    raise AssetError(self, "Unable to download: "
-                                     "HTTP error %d" % e.code) from e
-                continue
-            except URLError as e:
-                # This is typically a network/service level error
-                # eg urlopen error [Errno 110] Connection timed out>
-                tmp_cache_file.unlink()
-                self.log.error("Unable to download %s: URL error %s",
-                               self.url, e.reason)
-                raise AssetError(self, "Unable to download: URL error %s" %
-                                 e.reason, transient=True) from e
-            except ConnectionError as e:
-                # A socket connection failure, such as dropped conn
-                # or refused conn
-                tmp_cache_file.unlink()
-                self.log.error("Unable to download %s: Connection error %s",
-                               self.url, e)
-                continue
+                        raise AssetError(self, "Unable to download: "
+                                         "HTTP error %d" % e.code) from e
+                    dst.truncate(0)
+                except URLError as e:
+                    # This is typically a network/service level error
+                    # eg urlopen error [Errno 110] Connection timed out>
+                    self.log.error("Unable to download %s: URL error %s",
+                                   self.url, e.reason)
+                    raise AssetError(self, "Unable to download: URL error %s"
+                                     % e.reason, transient=True) from e
+                except (ConnectionError, TimeoutError, IncompleteRead) as e:
+                    # A socket connection failure, such as dropped conn
+                    # or refused conn; what was received is kept, and
+                    # the download resumed from there
+                    self.log.error("Unable to download %s: "
+                                   "Connection error %s", self.url, e)
+                except Exception as e:
+                    tmp_cache_file.unlink()
+                    raise AssetError(self, "Unable to download: %s" % e,
+                                     transient=True) from e
+            else:
+                # The partial download is kept, to be resumed next time
+                raise AssetError(self, "Download retries exceeded",
+                                 transient=True)
+
+            try:
+                # Set these just for informational purposes
+                os.setxattr(str(tmp_cache_file), "user.qemu-asset-url",
+                            self.url.encode('utf8'))
+                os.setxattr(str(tmp_cache_file), "user.qemu-asset-hash",
+                            self.hash.encode('utf8'))
             except Exception as e:
+                self.log.debug("Unable to set xattr on %s: %s",
+                               tmp_cache_file, e)
+
+            if hl is not None and self.hash != hl.hexdigest():
                 tmp_cache_file.unlink()
-                raise AssetError(self, "Unable to download: %s" % e,
-                                 transient=True) from e
+                raise AssetError(self, "Hash does not match %s" % self.hash)
 
-        if not os.path.exists(tmp_cache_file):
-            raise AssetError(self, "Download retries exceeded", transient=True)
+            # Remove write perms to stop tests accidentally modifying them
+            os.chmod(tmp_cache_file, stat.S_IRUSR | stat.S_IRGRP)
+            if hl is not None:
+                # The hash was computed while downloading
+                self._save_verified(tmp_cache_file)
+            # Still holding the lock, so that waiters find the complete
+            # file in place
+            tmp_cache_file.replace(self.cache_file)
 
-        try:
-            # Set these just for informational purposes
-            os.setxattr(str(tmp_cache_file), "user.qemu-asset-url",
-                        self.url.encode('utf8'))
-            os.setxattr(str(tmp_cache_file), "user.qemu-asset-hash",
-                        self.hash.encode('utf8'))
-        except Exception as e:
-            self.log.debug("Unable to set xattr on %s: %s", tmp_cache_file, e)
-
-        if not self._check(tmp_cache_file):
-            tmp_cache_file.unlink()
-            raise AssetError(self, "Hash does not match %s" % self.hash)
-        tmp_cache_file.replace(self.cache_file)
         self._save_time_stamp()
-        # Remove write perms to stop tests accidentally modifying them
-        os.chmod(self.cache_file, stat.S_IRUSR | stat.S_IRGRP)
 
         self.log.info("Cached %s at %s", self.url, self.cache_file)
         return str(self.cache_file)
 
     @staticmethod
-    def precache_test(test):
+    def _assets(test):
+        for name, asset in vars(test.__class__).items():
+            if name.startswith("ASSET_") and isinstance(asset, Asset):
+                yield asset
+
+    def _precache(self):
+        try:
+            self.fetch()
+        except AssetError as e:
+            if not e.transient:
+                raise
+            self.log.error("%s: skipping asset precache", e)
+
+    @staticmethod
+    def precache(assets, jobs=None):
+        '''
+        Fetch assets, several at a time.
+
+        The number of concurrent downloads (and hash checks of already
+        cached assets) is taken from the QEMU_TEST_PRECACHE_JOBS
+        environment variable if jobs is not given, and defaults to 4.
+        '''
+        if jobs is None:
+            jobs = int(os.getenv("QEMU_TEST_PRECACHE_JOBS", "4"))
+
+        # Assets with the same hash share their cache file
+        unique = {}
+        for asset in assets:
+            unique.setdefault(asset.cache_file, asset)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            # Collect the results, so that fatal errors are raised
+            for _ in executor.map(Asset._precache, unique.values()):
+                pass
+
+    @staticmethod
+    @contextmanager
+    def _precache_log():
         log = logging.getLogger('qemu-test')
         log.setLevel(logging.DEBUG)
         handler = logging.StreamHandler(sys.stdout)
@@ -236,24 +436,28 @@ def precache_test(test):
             '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
         log.addHandler(handler)
-        for name, asset in vars(test.__class__).items():
-            if name.startswith("ASSET_") and isinstance(asset, Asset):
-                try:
-                    asset.fetch()
-                except AssetError as e:
-                    if not e.transient:
-                        raise
-                    log.error("%s: skipping asset precache", e)
+        try:
+            yield
+        finally:
+            log.removeHandler(handler)
 
-        log.removeHandler(handler)
+    @staticmethod
+    def precache_test(test):
+        with Asset._precache_log():
+            Asset.precache(Asset._assets(test))
 
     @staticmethod
-    def precache_suite(suite):
+    def _suite_assets(suite):
         for test in suite:
             if isinstance(test, unittest.TestSuite):
-                Asset.precache_suite(test)
+                yield from Asset._suite_assets(test)
             elif isinstance(test, unittest.TestCase):
-                Asset.precache_test(test)
+                yield from Asset._assets(test)
+
+    @staticmethod
+    def precache_suite(suite):
+        with Asset._precache_log():
+            Asset.precache(Asset._suite_assets(suite))
 
     @staticmethod
     def precache_suites(path, cache_tstamp):
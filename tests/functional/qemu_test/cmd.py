@@ -11,9 +11,16 @@
 # This work is licensed under the terms of the GNU GPL, version 2 or
 # later.  See the COPYING file in the top-level directory.
 
+import collections
 import logging
 import os
 import os.path
+import re
+import socket
+
+
+# Maximum number of bytes looked at per read from the console
+_CONSOLE_CHUNK_SIZE = 4096
 
 
 def which(tool):
@@ -30,49 +37,201 @@ def which(tool):
 def is_readable_executable_file(path):
     return os.path.isfile(path) and os.access(path, os.R_OK | os.X_OK)
 
-# @test: functional test to fail if @failure is seen
+class ConsoleMatcher:
+    """
+    Incremental matcher for several console patterns at once.
+
+    Data is fed in chunks with feed(), which reports the first pattern
+    seen since the last reset(). Plain strings are matched with an
+    Aho-Corasick automaton, so each byte is only looked at once however
+    many strings there are. Regexes are searched in the data fed since
+    the last reset(), or only as far back as @max_len bytes before the
+    new data if given.
+
+    :param patterns: byte strings and compiled bytes regexes
+    :param max_len: the length of the longest regex match, including
+                    what lookahead assertions look at
+    """
+
+    def __init__(self, patterns, max_len=None):
+        if not patterns:
+            raise ValueError('no patterns to match')
+        self.patterns = patterns
+        self.max_len = max_len
+        self._regexes = [(i, p) for i, p in enumerate(patterns)
+                         if isinstance(p, re.Pattern)]
+
+        # Build the trie; _out[state] is the first pattern (by index)
+        # that ends in that state.
+        goto = [{}]
+        self._out = [None]
+        for i, pattern in enumerate(patterns):
+            if isinstance(pattern, re.Pattern):
+                continue
+            state = 0
+            for byte in pattern:
+                nxt = goto[state].get(byte)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][byte] = nxt
+                    goto.append({})
+                    self._out.append(None)
+                state = nxt
+            if self._out[state] is None:
+                self._out[state] = i
+
+        # Turn it into a complete transition table, following failure
+        # links breadth first so that they are resolved before use.
+        self._delta = [None] * len(goto)
+        self._delta[0] = [goto[0].get(byte, 0) for byte in range(256)]
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out = self._out[fail[state]]
+            if out is not None and (self._out[state] is None or
+                                    out < self._out[state]):
+                self._out[state] = out
+            row = list(self._delta[fail[state]])
+            for byte, nxt in goto[state].items():
+                fail[nxt] = self._delta[fail[state]][byte]
+                row[byte] = nxt
+                queue.append(nxt)
+            self._delta[state] = row
+
+        self.reset()
+
+    def reset(self):
+        """Forget about the data fed so far."""
+        self._state = 0
+        self._data = bytearray()
+
+    def feed(self, data):
+        """
+        Feed data, and look for the first pattern it completes.
+
+        :return: None, or a tuple with the index of the pattern that was
+                 found and the number of bytes of data up to the end of
+                 the match.
+        """
+        found = None
+        delta = self._delta
+        out = self._out
+        state = self._state
+        for pos, byte in enumerate(data):
+            state = delta[state][byte]
+            if out[state] is not None:
+                found = (out[state], pos + 1)
+                break
+        self._state = state
+
+        if self._regexes:
+            # Look for a regex match ending no later than any string
+            prev = len(self._data)
+            self._data += data if found is None else data[:found[1]]
+            # Starting max_len bytes back also covers matches ending at
+            # prev, whose \b or \B only hold now that the next byte is
+            # known
+            start = 0
+            if self.max_len is not None:
+                start = max(prev - self.max_len, 0)
+            for i, regex in self._regexes:
+                match = regex.search(self._data, start)
+                if match:
+                    end = max(match.end() - prev, 0)
+                    if found is None or (end, i) < (found[1], found[0]):
+                        found = (i, end)
+        return found
+
+def _to_bytes_patterns(messages):
+    """
+    Convert a console message, or a list of them, into a list of
+    byte strings and bytes regexes.
+    """
+    if messages is None:
+        return []
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    patterns = []
+    for message in messages:
+        if isinstance(message, str):
+            message = message.encode()
+        elif isinstance(message, re.Pattern) and \
+                isinstance(message.pattern, str):
+            message = re.compile(message.pattern.encode(),
+                                 message.flags & ~re.UNICODE)
+        patterns.append(message)
+    return patterns
+
+def _describe_pattern(pattern):
+    if isinstance(pattern, re.Pattern):
+        return pattern.pattern
+    return pattern
+
+# @test: functional test to fail if a failure pattern is seen
 # @vm: the VM whose console to process
-# @success: a non-None string to look for
-# @failure: a string to look for that triggers test failure, or None
+# @matcher: ConsoleMatcher for the success patterns followed by the
+#           failure patterns
+# @nsuccess: the number of success patterns
 #
-# Read up to 1 line of text from @vm, looking for @success
-# and optionally @failure.
+# Read up to 1 line of text from @vm, looking for the patterns of
+# @matcher.
 #
-# If @success or @failure are seen, immediately return True,
+# If a success or failure pattern is seen, immediately return True,
 # even if end of line is not yet seen. ie remainder of the
 # line is left unread.
 #
-# If end of line is seen, with neither @success or @failure
-# return False
+# If end of line is seen, with no pattern seen, return False
 #
 # In both cases, also return the contents of the line (in bytes)
 # up to that point.
 #
-# If @failure is seen, then mark @test as failed
-def _console_read_line_until_match(test, vm, success, failure):
-    msg = bytes([])
+# If a failure pattern is seen, then mark @test as failed
+#
+# The console is read in chunks, which are peeked at first so that
+# only the bytes up to the end of the line or of the match are
+# consumed.
+def _console_read_line_until_match(test, vm, matcher, nsuccess):
+    msg = bytearray()
     done = False
+    matcher.reset()
+    console = vm.console_socket
     while True:
-        c = vm.console_socket.recv(1)
-        if not c:
+        chunk = console.recv(_CONSOLE_CHUNK_SIZE, socket.MSG_PEEK)
+        if not chunk:
             done = True
+            success = _describe_pattern(matcher.patterns[0])
             test.fail(
                 f"EOF in console, expected '{success}'")
             break
-        msg += c
 
-        if success in msg:
+        eol = chunk.find(b'\n')
+        if eol >= 0:
+            chunk = chunk[:eol + 1]
+        found = matcher.feed(chunk)
+        if found is not None:
+            chunk = chunk[:found[1]]
+
+        consumed = 0
+        while consumed < len(chunk):
+            consumed += len(console.recv(len(chunk) - consumed))
+        msg += chunk
+
+        if found is not None:
             done = True
+            index = found[0]
+            if index >= nsuccess:
+                console.close()
+                failure = _describe_pattern(matcher.patterns[index])
+                success = _describe_pattern(matcher.patterns[0])
+                test.fail(
+                    f"'{failure}' found in console, expected '{success}'")
             break
-        if failure and failure in msg:
-            done = True
-            vm.console_socket.close()
-            test.fail(
-                f"'{failure}' found in console, expected '{success}'")
 
-        if c == b'\n':
+        if chunk.endswith(b'\n'):
             break
 
+    msg = bytes(msg)
     console_logger = logging.getLogger('console')
     try:
         console_logger.debug(msg.decode().strip())
@@ -87,7 +246,9 @@ def _console_interaction(test, success_message, failure_message,
     Interact with the console until either message is seen.
 
     :param success_message: if this message appears, finish interaction
+                            (a string, a compiled regex, or a list of them)
     :param failure_message: if this message appears, test fails
+                            (a string, a compiled regex, or a list of them)
     :param send_string: a string to send to the console before trying
                         to read a new line
     :param keep_sending: keep sending the send string each time
@@ -109,13 +270,11 @@ def _console_interaction(test, success_message, failure_message,
     # We'll process console in bytes, to avoid having to
     # deal with unicode decode errors from receiving
     # partial utf8 byte sequences
-    success_message_b = None
-    if success_message is not None:
-        success_message_b = success_message.encode()
-
-    failure_message_b = None
-    if failure_message is not None:
-        failure_message_b = failure_message.encode()
+    success_patterns = _to_bytes_patterns(success_message)
+    failure_patterns = _to_bytes_patterns(failure_message)
+    matcher = None
+    if success_patterns:
+        matcher = ConsoleMatcher(success_patterns + failure_patterns)
 
     out = bytes([])
 
@@ -126,14 +285,13 @@ def _console_interaction(test, success_message, failure_message,
                 send_string = None # send only once
 
         # Only consume console output if waiting for something
-        if success_message is None:
+        if matcher is None:
             if send_string is None:
                 break
             continue
 
-        done, line = _console_read_line_until_match(test, vm,
-                                                    success_message_b,
-                                                    failure_message_b)
+        done, line = _console_read_line_until_match(test, vm, matcher,
+                                                    len(success_patterns))
 
         out += line
 
@@ -162,7 +320,9 @@ def interrupt_interactive_console_until_pattern(test, success_message,
                  read and probed for a success or failure message
     :type test: :class:`qemu_test.QemuSystemTest`
     :param success_message: if this message appears, test succeeds
+                            (a string, a compiled regex, or a list of them)
     :param failure_message: if this message appears, test fails
+                            (a string, a compiled regex, or a list of them)
     :param interrupt_string: a string to send to the console before trying
                              to read a new line
     :param vm: VM to use
@@ -182,7 +342,9 @@ def wait_for_console_pattern(test, success_message, failure_message=None,
                  read and probed for a success or failure message
     :type test: :class:`qemu_test.QemuSystemTest`
     :param success_message: if this message appears, test succeeds
+                            (a string, a compiled regex, or a list of them)
     :param failure_message: if this message appears, test fails
+                            (a string, a compiled regex, or a list of them)
     :param vm: VM to use
 
     :return: The collected output (in bytes form).
@@ -219,7 +381,9 @@ def exec_command_and_wait_for_pattern(test, command,
     :type test: :class:`qemu_test.QemuSystemTest`
     :param command: the command to send
     :param success_message: if this message appears, test succeeds
+                            (a string, a compiled regex, or a list of them)
     :param failure_message: if this message appears, test fails
+                            (a string, a compiled regex, or a list of them)
     :param vm: VM to use
 
     :return: The collected output (in bytes form).
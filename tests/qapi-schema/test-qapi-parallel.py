@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# QAPI parallel code generation test
+#
+# Check that running the code generators in parallel writes the same files,
+# with the same contents and in the same order, as running them serially.
+#
+# This work is licensed under the terms of the GNU GPL, version 2 or later.
+# See the COPYING file in the top-level directory.
+#
+
+
+import difflib
+import sys
+
+from qapi.backend import QAPICBackend
+from qapi.gen import output_writer
+from qapi.schema import QAPISchema
+
+
+def generate(schema, jobs):
+    outputs = []
+    with output_writer(lambda pathname, text:
+                       outputs.append((pathname, text))):
+        QAPICBackend(jobs).generate(schema, output_dir='out', prefix='',
+                                    unmask=False, builtins=True,
+                                    gen_tracing=True)
+    return outputs
+
+
+def test_parallel(fname):
+    schema = QAPISchema(fname)
+    expected = generate(schema, 1)
+    actual = generate(schema, 4)
+    if actual == expected:
+        return 0
+
+    print('%s: parallel generation differs from serial' % fname)
+    names = [pathname + '\n' for pathname, _ in expected]
+    pnames = [pathname + '\n' for pathname, _ in actual]
+    if pnames != names:
+        sys.stdout.writelines(difflib.unified_diff(
+            names, pnames, 'files written', 'files written (parallel)'))
+        return 1
+    for (pathname, text), (_, ptext) in zip(expected, actual):
+        sys.stdout.writelines(difflib.unified_diff(
+            text.splitlines(True), ptext.splitlines(True),
+            pathname, pathname + ' (parallel)'))
+    return 1
+
+
+def main(argv):
+    status = 0
+    for fname in argv[1:]:
+        status |= test_parallel(fname)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
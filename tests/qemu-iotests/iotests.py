@@ -17,27 +17,30 @@
 #
 
 import argparse
+from array import array
 import atexit
 import bz2
 from collections import OrderedDict
+import errno
 import faulthandler
+import io
 import json
 import logging
 import os
 import re
 import shutil
 import signal
-import struct
 import subprocess
 import sys
 import time
-from typing import (Any, Callable, Dict, Iterable, Iterator,
-                    List, Optional, Sequence, TextIO, Tuple, Type, TypeVar)
+from typing import (Any, Callable, Dict, Iterable, Iterator, List,
+                    Optional, Sequence, TextIO, Tuple, Type, TypeVar)
 import unittest
 
 from contextlib import contextmanager
 
 from qemu.machine import qtest
+from qemu.machine.event_cache import EventFilter
 from qemu.qmp.legacy import QMPMessage, QMPReturnValue, QEMUMonitorProtocol
 from qemu.utils import VerboseProcessError
 
@@ -143,6 +146,7 @@ def unarchive_sample_image(sample, fname):
 
 def qemu_tool_popen(args: Sequence[str],
                     connect_stderr: bool = True) -> 'subprocess.Popen[str]':
+    qemu_io_session_close()
     stderr = subprocess.STDOUT if connect_stderr else None
     # pylint: disable=consider-using-with
     return subprocess.Popen(args,
@@ -229,6 +233,7 @@ def qemu_tool(*args: str, check: bool = True, combine_stdio: bool = True
         properties. If streams are not combined, it will also have a
         stderr property.
     """
+    qemu_io_session_close()
     subp = subprocess.run(
         args,
         stdout=subprocess.PIPE,
@@ -353,6 +358,124 @@ def qemu_io_wrap_args(args: Sequence[str]) -> List[str]:
 def qemu_io_popen(*args):
     return qemu_tool_popen(qemu_io_wrap_args(args))
 
+# First words of the qemu-io commands which qemu_io() may run in a
+# session: they act on the open image only, and are done once they have
+# printed their output.
+qemu_io_session_cmds = {'read', 'r', 'readv', 'write', 'w', 'writev',
+                        'flush', 'f', 'truncate', 't', 'length', 'l',
+                        'info', 'i', 'discard', 'd', 'alloc', 'a', 'map'}
+
+# The qemu-io process kept running by qemu_io() within qemu_io_session(),
+# or None outside of it
+_qemu_io_session: Optional['QemuIoInteractive'] = None
+_qemu_io_session_enabled = False
+
+def qemu_io_session_split_args(args: Sequence[str]
+                               ) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Split qemu-io arguments into its options and the commands to run.
+
+    :return: the options and the commands, or None if the command line
+             cannot be run in a session.
+    """
+    opts: List[str] = []
+    cmds: List[str] = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('-c', '--cmd') and i + 1 < len(args):
+            cmds.append(args[i + 1])
+            i += 2
+            continue
+        if arg.startswith(('-c', '--cmd', '-h', '--help', '-V', '--version')):
+            return None
+        opts.append(arg)
+        i += 1
+
+    for cmd in cmds:
+        words = cmd.split()
+        if '\n' in cmd or not words or words[0] not in qemu_io_session_cmds:
+            return None
+    if not cmds:
+        return None
+    return opts, cmds
+
+def qemu_io_session_close() -> None:
+    """
+    Stop the qemu-io process kept running by qemu_io(), if any.
+
+    :raise VerboseProcessError:
+        When qemu-io reports that one of the commands it ran failed.
+    """
+    # pylint: disable=global-statement
+    global _qemu_io_session
+    session, _qemu_io_session = _qemu_io_session, None
+    if session is None:
+        return
+    output = session.close()
+    if session.returncode:
+        raise VerboseProcessError(session.returncode, session.args,
+                                  output=output)
+
+@contextmanager
+def qemu_io_session() -> Iterator[None]:
+    """
+    Let qemu_io() run its commands in a long-lived qemu-io process.
+
+    Within the context, consecutive qemu_io() and qemu_io_log() calls
+    with the same options send their '-c' commands to the same qemu-io
+    process instead of starting a new one each time.  This is limited to
+    check=True calls running the commands in `qemu_io_session_cmds`;
+    other calls start their own process, as usual.
+
+    The process keeps the image open, so it is stopped whenever another
+    command line is used, when another tool is run through qemu_tool()
+    or qemu_tool_popen(), when a VM is launched and at the end of the
+    context.  Anything else accessing the image (e.g. reading the file
+    from Python) must happen outside of the context.
+
+    qemu-io only reports failed commands in its exit code: they raise a
+    VerboseProcessError when the process is stopped, not from the
+    qemu_io() call that ran them.
+    """
+    # pylint: disable=global-statement
+    global _qemu_io_session_enabled
+    assert not _qemu_io_session_enabled, 'qemu_io_session() is not reentrant'
+    _qemu_io_session_enabled = True
+    try:
+        yield
+    finally:
+        _qemu_io_session_enabled = False
+        qemu_io_session_close()
+
+def _qemu_io_session_run(args: Sequence[str]
+                         ) -> 'Optional[subprocess.CompletedProcess[str]]':
+    # pylint: disable=global-statement
+    global _qemu_io_session
+    split = qemu_io_session_split_args(args)
+    if split is None:
+        return None
+    opts, cmds = split
+
+    full_args = qemu_io_wrap_args(opts)
+    if _qemu_io_session is not None and _qemu_io_session.args != full_args:
+        qemu_io_session_close()
+    if _qemu_io_session is None:
+        try:
+            _qemu_io_session = QemuIoInteractive(*opts)
+        except ValueError:
+            # Let qemu_tool() run it again and report the error
+            return None
+
+    try:
+        output = ''.join(_qemu_io_session.cmds(*cmds))
+    except VerboseProcessError:
+        # qemu-io exited
+        _qemu_io_session = None
+        raise
+    return subprocess.CompletedProcess(qemu_io_wrap_args(args), 0,
+                                       stdout=output)
+
 def qemu_io(*args: str, check: bool = True, combine_stdio: bool = True
             ) -> 'subprocess.CompletedProcess[str]':
     """
@@ -360,7 +483,14 @@ def qemu_io(*args: str, check: bool = True, combine_stdio: bool = True
 
     This function always prepends either QEMU_IO_OPTIONS or
     QEMU_IO_OPTIONS_NO_FMT.
+
+    Within qemu_io_session(), the commands may run in a qemu-io process
+    that is kept running across calls.
     """
+    if _qemu_io_session_enabled and check and combine_stdio:
+        result = _qemu_io_session_run(args)
+        if result is not None:
+            return result
     return qemu_tool(*qemu_io_wrap_args(args),
                      check=check, combine_stdio=combine_stdio)
 
@@ -371,52 +501,104 @@ def qemu_io_log(*args: str, check: bool = True
     return result
 
 class QemuIoInteractive:
-    def __init__(self, *args):
+    prompt = b'qemu-io> '
+    # How much output to read at once
+    read_size = 64 * 1024
+
+    def __init__(self, *args: str) -> None:
         self.args = qemu_io_wrap_args(args)
+        self.returncode: Optional[int] = None
         # We need to keep the Popen objext around, and not
         # close it immediately. Therefore, disable the pylint check:
         # pylint: disable=consider-using-with
         self._p = subprocess.Popen(self.args, stdin=subprocess.PIPE,
                                    stdout=subprocess.PIPE,
                                    stderr=subprocess.STDOUT,
-                                   universal_newlines=True)
-        out = self._p.stdout.read(9)
-        if out != 'qemu-io> ':
+                                   bufsize=0)
+        # Output read from qemu-io but not returned yet
+        self._buf = bytearray()
+
+        out = self._read_until_prompt()
+        if out is None or out:
             # Most probably qemu-io just failed to start.
             # Let's collect the whole output and exit.
-            out += self._p.stdout.read()
+            if out is not None:
+                self._p.kill()
+            output = self._decode(bytes(self._buf) +
+                                  self._p.communicate()[0])
             self._p.wait(timeout=1)
-            raise ValueError(out)
-
-    def close(self):
-        self._p.communicate('q\n')
-
-    def _read_output(self):
-        pattern = 'qemu-io> '
-        n = len(pattern)
-        pos = 0
-        s = []
-        while pos != n:
-            c = self._p.stdout.read(1)
-            # check unexpected EOF
-            assert c != ''
-            s.append(c)
-            if c == pattern[pos]:
-                pos += 1
-            else:
-                pos = 0
+            raise ValueError(output)
+
+    def close(self) -> str:
+        """
+        Quit qemu-io, and return what it printed after the last command.
+
+        Its exit code is then available as `returncode`.
+        """
+        out = self._p.communicate(b'q\n')[0]
+        self.returncode = self._p.returncode
+        return self._decode(bytes(self._buf) + out)
 
-        return ''.join(s[:-n])
+    @staticmethod
+    def _decode(out: bytes) -> str:
+        # Like reading the pipe with universal_newlines=True
+        return out.decode().replace('\r\n', '\n').replace('\r', '\n')
 
-    def cmd(self, cmd):
+    def _read_until_prompt(self) -> Optional[bytes]:
+        """
+        Read the output up to the next prompt and drop the prompt.
+
+        :return: the output, or None if qemu-io exited first.
+        """
+        assert self._p.stdout is not None
+        start = 0
+        while True:
+            pos = self._buf.find(self.prompt, start)
+            if pos >= 0:
+                out = bytes(self._buf[:pos])
+                del self._buf[:pos + len(self.prompt)]
+                return out
+            # The prompt may be split between two reads
+            start = max(0, len(self._buf) - len(self.prompt) + 1)
+            chunk = self._p.stdout.read(self.read_size)
+            if not chunk:
+                return None
+            self._buf += chunk
+
+    def _read_output(self) -> str:
+        out = self._read_until_prompt()
+        if out is None:
+            self.returncode = self._p.wait()
+            raise VerboseProcessError(self.returncode, self.args,
+                                      output=self._decode(bytes(self._buf)))
+        return self._decode(out)
+
+    def _send(self, cmd: str) -> None:
         # quit command is in close(), '\n' is added automatically
         assert '\n' not in cmd
         cmd = cmd.strip()
         assert cmd not in ('q', 'quit')
-        self._p.stdin.write(cmd + '\n')
-        self._p.stdin.flush()
+        assert self._p.stdin is not None
+        self._p.stdin.write(cmd.encode() + b'\n')
+
+    def cmd(self, cmd: str) -> str:
+        self._send(cmd)
         return self._read_output()
 
+    def cmds(self, *cmds: str) -> List[str]:
+        """
+        Run several commands, and return the output of each.
+
+        Commands are still sent one at a time: qemu-io reads its input
+        through stdio, but only does so when the pipe is readable, so a
+        command sent ahead of its prompt would wait for the next one.
+        """
+        outputs = []
+        for cmd in cmds:
+            self._send(cmd)
+            outputs.append(self._read_output())
+        return outputs
+
 
 class QemuStorageDaemon:
     _qmp: Optional[QEMUMonitorProtocol] = None
@@ -542,15 +724,93 @@ def qemu_nbd_popen(*args):
             p.kill()
             p.wait()
 
+# Size of the blocks compared at once by the in-process image comparison
+COMPARE_BLOCK_SIZE = 4 * 1024 * 1024
+
+def _next_data(files: Sequence[io.RawIOBase], offset: int, end: int) -> int:
+    """
+    Return the first offset in [offset, end) where one of the files may
+    contain data, or end if they only have holes there.
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        return offset
+    result = end
+    for f in files:
+        try:
+            result = min(result, os.lseek(f.fileno(), offset, os.SEEK_DATA))
+        except OSError as exc:
+            if exc.errno != errno.ENXIO:
+                # SEEK_DATA not supported by the filesystem
+                return offset
+    return max(result, offset)
+
+def _read_block(f: io.RawIOBase, buf: bytearray, offset: int, length: int
+                ) -> memoryview:
+    """
+    Read @length bytes at @offset of @f into @buf, and return a view of
+    them; readinto() may return less than asked for.
+    """
+    view = memoryview(buf)[:length]
+    f.seek(offset)
+    pos = 0
+    while pos < length:
+        n = f.readinto(view[pos:])
+        assert n, 'unexpected end of file'
+        pos += n
+    return view
+
+def _raw_images_identical(path1: str, path2: str) -> bool:
+    """
+    Compare two raw images like "qemu-img compare" does, without forking
+    it: the extra data of the larger image, if any, must be zeroes.
+    """
+    with open(path1, 'rb', buffering=0) as f1, \
+         open(path2, 'rb', buffering=0) as f2:
+        size1 = os.fstat(f1.fileno()).st_size
+        size2 = os.fstat(f2.fileno()).st_size
+        buf1 = bytearray(COMPARE_BLOCK_SIZE)
+        buf2 = bytearray(COMPARE_BLOCK_SIZE)
+
+        files = (f1, f2)
+        end = min(size1, size2)
+        offset = _next_data(files, 0, end)
+        while offset < end:
+            length = min(COMPARE_BLOCK_SIZE, end - offset)
+            if _read_block(f1, buf1, offset, length) != \
+                    _read_block(f2, buf2, offset, length):
+                return False
+            offset = _next_data(files, offset + length, end)
+
+        # Whatever the larger image has beyond the end of the other one
+        # must read as zeroes
+        larger = f1 if size1 > size2 else f2
+        zeroes = bytes(COMPARE_BLOCK_SIZE)
+        end = max(size1, size2)
+        offset = _next_data((larger,), min(size1, size2), end)
+        while offset < end:
+            length = min(COMPARE_BLOCK_SIZE, end - offset)
+            if _read_block(larger, buf1, offset, length) != zeroes[:length]:
+                return False
+            offset = _next_data((larger,), offset + length, end)
+
+    return True
+
 def compare_images(img1: str, img2: str,
                    fmt1: str = imgfmt, fmt2: str = imgfmt) -> bool:
     """
     Compare two images with QEMU_IMG; return True if they are identical.
 
+    Two raw image files are compared in-process instead, which is a lot
+    faster than running qemu-img for them.
+
     :raise CalledProcessError:
         when qemu-img crashes or returns a status code of anything other
         than 0 (identical) or 1 (different).
     """
+    if fmt1 == fmt2 == 'raw' and os.path.isfile(img1) and \
+            os.path.isfile(img2):
+        return _raw_images_identical(img1, img2)
+
     try:
         qemu_img('compare', '-f', fmt1, '-F', fmt2, img1, img2)
         return True
@@ -559,14 +819,26 @@ def compare_images(img1: str, img2: str,
             return False
         raise
 
+# Number of sectors create_image() writes at once
+CREATE_IMAGE_CHUNK_SECTORS = 8192
+
 def create_image(name, size):
     '''Create a fully-allocated raw image with sector markers'''
+    # Each 512-byte sector starts and ends with its index as a 32-bit
+    # big-endian integer; fill in the markers of many sectors at once.
+    sectors = (size + 511) // 512
+    chunk = bytearray(min(sectors, CREATE_IMAGE_CHUNK_SECTORS) * 512)
+    words = memoryview(chunk).cast('I')
+    assert words.itemsize == 4
     with open(name, 'wb') as file:
-        i = 0
-        while i < size:
-            sector = struct.pack('>l504xl', i // 512, i // 512)
-            file.write(sector)
-            i = i + 512
+        for start in range(0, sectors, CREATE_IMAGE_CHUNK_SECTORS):
+            count = min(sectors - start, CREATE_IMAGE_CHUNK_SECTORS)
+            markers = array('I', range(start, start + count))
+            if sys.byteorder == 'little':
+                markers.byteswap()
+            words[0:count * 128:128] = markers
+            words[127:count * 128:128] = markers
+            file.write(words[:count * 128])
 
 def image_size(img: str) -> int:
     """Return image's virtual size"""
@@ -865,6 +1137,7 @@ def _post_shutdown(self) -> None:
 
     def _pre_launch(self) -> None:
         super()._pre_launch()
+        qemu_io_session_close()
         if qemu_print:
             # set QEMU binary output to stdout
             self._close_qemu_log_file()
@@ -1013,14 +1286,14 @@ def run_job(self, job: str, auto_finalize: bool = True,
         """
         match_device = {'data': {'device': job}}
         match_id = {'data': {'id': job}}
-        events = [
+        events = EventFilter([
             ('BLOCK_JOB_COMPLETED', match_device),
             ('BLOCK_JOB_CANCELLED', match_device),
             ('BLOCK_JOB_ERROR', match_device),
             ('BLOCK_JOB_READY', match_device),
             ('BLOCK_JOB_PENDING', match_id),
             ('JOB_STATUS_CHANGE', match_id)
-        ]
+        ])
         error = None
         while True:
             ev = filter_qmp_event(self.events_wait(events, timeout=wait))
@@ -27,7 +27,8 @@
 import shutil
 import sys
 from multiprocessing import Pool
-from typing import List, Optional, Any, Sequence, Dict
+from typing import (List, Optional, Any, Sequence, Dict, Collection,
+                    Generator, Iterable, Tuple)
 from testenv import TestEnv
 
 
@@ -95,6 +96,56 @@ def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
         self.save()
 
 
+def estimate_durations(tests: Iterable[str],
+                       last_elapsed: LastElapsedTime) -> Dict[str, float]:
+    """ Estimate how long each test takes, from the elapsed time cache
+
+    Tests that have not passed before are assumed to take as long as the
+    average of those that have.
+    """
+    last = {t: last_elapsed.get(t) for t in tests}
+    known = [el for el in last.values() if el is not None]
+    default = sum(known) / len(known) if known else 1.0
+    return {t: default if el is None else el for t, el in last.items()}
+
+
+def make_batches(tests: Sequence[str], durations: Dict[str, float],
+                 serial: Collection[str] = ()) -> List[List[str]]:
+    """ Group tests into batches, in the order they should be started
+
+    Each test is a batch on its own, except for those in @serial, which
+    all go into one batch so that they run one after another.  Batches
+    are sorted longest first: handing them out in this order to the
+    first free worker keeps a long test from starting last and setting
+    the total run time.  Batches of equal duration keep their order.
+    """
+    batches = [[t] for t in tests if t not in serial]
+    serial_batch = [t for t in tests if t in serial]
+    if serial_batch:
+        batches.append(serial_batch)
+    return sorted(batches, key=lambda b: -sum(durations[t] for t in b))
+
+
+def shard_tests(tests: Sequence[str], shard: int, n_shards: int,
+                durations: Dict[str, float],
+                serial: Collection[str] = ()) -> List[str]:
+    """ Select the tests of one of @n_shards shards of similar duration
+
+    @shard counts from 0.  Batches (see make_batches()) are assigned
+    longest first to the shard with the least work so far, so all the
+    shards get the same split as long as they are computed from the
+    same @tests and @durations.
+    """
+    loads = [0.0] * n_shards
+    selected = set()
+    for batch in make_batches(tests, durations, serial):
+        i = loads.index(min(loads))
+        loads[i] += sum(durations[t] for t in batch)
+        if i == shard:
+            selected.update(batch)
+    return [t for t in tests if t in selected]
+
+
 class TestResult:
     def __init__(self, status: str, description: str = '',
                  elapsed: Optional[float] = None, diff: Sequence[str] = (),
@@ -109,35 +160,56 @@ def __init__(self, status: str, description: str = '',
 
 class TestRunner(contextlib.AbstractContextManager['TestRunner']):
     shared_self = None
+    last_elapsed_cache = '.last-elapsed-cache'
 
     @staticmethod
-    def proc_run_test(test: str, test_field_width: int) -> TestResult:
+    def proc_run_tests(
+            job: Tuple[List[Tuple[int, str]], int]
+    ) -> List[Tuple[int, TestResult]]:
         # We are in a subprocess, we can't change the runner object!
         runner = TestRunner.shared_self
         assert runner is not None
-        return runner.run_test(test, test_field_width, mp=True)
+        batch, test_field_width = job
+        results = []
+        for i, test in batch:
+            res = runner.run_test(test, test_field_width, mp=True)
+            results.append((i, res))
+            if res.interrupted:
+                break
+        return results
 
-    def run_tests_pool(self, tests: List[str],
-                       test_field_width: int, jobs: int) -> List[TestResult]:
+    def run_tests_pool(
+            self, tests: List[str], test_field_width: int, jobs: int,
+            serial: Collection[str] = ()
+    ) -> Generator[Tuple[int, TestResult], None, None]:
+        """
+        Run tests in a pool of @jobs workers, longest ones first
+
+        Yield (index in @tests, result) pairs as the tests finish.
+        """
+        durations = estimate_durations(tests, self.last_elapsed)
+        index = {t: i for i, t in enumerate(tests)}
+        jobs_args = [([(index[t], t) for t in batch], test_field_width)
+                     for batch in make_batches(tests, durations, serial)]
 
-        # passing self directly to Pool.starmap() just doesn't work, because
-        # it's a context manager.
+        # passing self directly to Pool.imap_unordered() just doesn't work,
+        # because it's a context manager.
         assert TestRunner.shared_self is None
         TestRunner.shared_self = self
 
-        with Pool(jobs) as p:
-            results = p.starmap(self.proc_run_test,
-                                zip(tests, [test_field_width] * len(tests)))
-
-        TestRunner.shared_self = None
-
-        return results
+        try:
+            with Pool(jobs) as p:
+                for results in p.imap_unordered(self.proc_run_tests,
+                                                jobs_args):
+                    yield from results
+        finally:
+            TestRunner.shared_self = None
 
     def __init__(self, env: TestEnv, tap: bool = False,
                  color: str = 'auto') -> None:
         self.env = env
         self.tap = tap
-        self.last_elapsed = LastElapsedTime('.last-elapsed-cache', env)
+        self.last_elapsed = LastElapsedTime(self.last_elapsed_cache, env)
 
         assert color in ('auto', 'on', 'off')
         self.color = (color == 'on') or (color == 'auto' and
@@ -376,7 +448,15 @@ def run_test(self, test: str,
         sys.stdout.flush()
         return res
 
-    def run_tests(self, tests: List[str], jobs: int = 1) -> bool:
+    def run_tests(self, tests: List[str], jobs: int = 1,
+                  serial: Collection[str] = ()) -> bool:
+        """
+        Run tests, and print a summary
+
+        :param tests: test file paths
+        :param jobs: number of tests to run in parallel
+        :param serial: tests that must not run in parallel with one another
+        """
         n_run = 0
         failed = []
         notrun = []
@@ -391,41 +471,49 @@ def run_tests(self, tests: List[str], jobs: int = 1) -> bool:
 
         test_field_width = max(len(os.path.basename(t)) for t in tests) + 2
 
+        done: Generator[Tuple[int, TestResult], None, None]
         if jobs > 1:
-            results = self.run_tests_pool(tests, test_field_width, jobs)
+            done = self.run_tests_pool(tests, test_field_width, jobs, serial)
+        else:
+            done = ((i, self.run_test(t, test_field_width))
+                    for i, t in enumerate(tests))
+
+        # Results are handled as soon as they come, which in parallel mode
+        # is in no particular order; the summary follows the order of @tests.
+        results: List[Optional[TestResult]] = [None] * len(tests)
+        with contextlib.closing(done):
+            for i, res in done:
+                results[i] = res
+                assert res.status in ('pass', 'fail', 'not run')
+
+                if res.status == 'fail' and res.diff:
+                    if self.tap:
+                        print('\n'.join(res.diff), file=sys.stderr)
+                    else:
+                        print('\n'.join(res.diff))
+                elif res.status == 'pass':
+                    assert res.elapsed is not None
+                    self.last_elapsed.update(tests[i], res.elapsed)
 
-        for i, t in enumerate(tests):
-            name = os.path.basename(t)
+                sys.stdout.flush()
+                if res.interrupted:
+                    break
 
-            if jobs > 1:
-                res = results[i]
-            else:
-                res = self.run_test(t, test_field_width)
-
-            assert res.status in ('pass', 'fail', 'not run')
+        for t, result in zip(tests, results):
+            if result is None:
+                continue
+            name = os.path.basename(t)
 
-            if res.casenotrun:
+            if result.casenotrun:
                 casenotrun.append(t)
 
-            if res.status != 'not run':
+            if result.status != 'not run':
                 n_run += 1
 
-            if res.status == 'fail':
+            if result.status == 'fail':
                 failed.append(name)
-                if res.diff:
-                    if self.tap:
-                        print('\n'.join(res.diff), file=sys.stderr)
-                    else:
-                        print('\n'.join(res.diff))
-            elif res.status == 'not run':
+            elif result.status == 'not run':
                 notrun.append(name)
-            elif res.status == 'pass':
-                assert res.elapsed is not None
-                self.last_elapsed.update(t, res.elapsed)
-
-            sys.stdout.flush()
-            if res.interrupted:
-                break
 
         if not self.tap:
             if notrun: